@@ -0,0 +1,155 @@
+import copy
+import hashlib
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.authentication import TokenAuthentication
+
+from api.cache import increment
+from recipes.versions import auth_version, get_version
+
+SHARED_KEY = 'auth-token:{}'
+
+
+class TokenCache:
+    """
+    Ограниченный по размеру и времени жизни кэш в памяти процесса:
+    давно не использованные записи вытесняются первыми.
+    """
+
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def delete_where(self, predicate):
+        with self.lock:
+            for key in [key for key, (_, value) in self.entries.items()
+                        if predicate(value)]:
+                del self.entries[key]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class LocalCounters:
+    """
+    Счетчики в памяти процесса. Накопленное переносится в общий кэш
+    (для cache_stats) не чаще раза в interval секунд, а не на каждый
+    запрос.
+    """
+
+    def __init__(self, prefix, interval):
+        self.prefix = prefix
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.counts = Counter()
+        self.flushed = time.monotonic()
+
+    def increment(self, name):
+        with self.lock:
+            self.counts[name] += 1
+            if time.monotonic() - self.flushed < self.interval:
+                return
+        self.flush()
+
+    def flush(self):
+        with self.lock:
+            counts, self.counts = self.counts, Counter()
+            self.flushed = time.monotonic()
+        for name, value in counts.items():
+            increment(f'{self.prefix}:{name}', value)
+
+
+token_cache = TokenCache(
+    settings.AUTH_TOKEN_CACHE_SIZE, settings.AUTH_TOKEN_CACHE_TTL)
+auth_counters = LocalCounters(
+    'auth', settings.AUTH_TOKEN_VERSION_CHECK_INTERVAL)
+
+
+def forget_user(user_id):
+    """Удаляет записи пользователя из кэша токенов этого процесса."""
+    token_cache.delete_where(lambda entry: entry[0].pk == user_id)
+
+
+def shared_key(key):
+    return SHARED_KEY.format(hashlib.sha256(key.encode()).hexdigest())
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    Аутентификация по токену без запроса к базе на каждый вызов API:
+    пользователь токена берется из кэша процесса (и, если включено
+    AUTH_TOKEN_SHARED_CACHE, из общего кэша). Запись действует, пока не
+    изменилась версия auth пользователя: ее меняют сигналы при
+    удалении токена, сохранении и деактивации пользователя. Версия
+    сверяется с общим кэшем не чаще раза в
+    AUTH_TOKEN_VERSION_CHECK_INTERVAL секунд; в процессе, где произошло
+    изменение, сигналы удаляют записи сразу.
+    """
+
+    def get_cached(self, key):
+        entry = token_cache.get(key)
+        if entry is not None:
+            user, token, version, checked = entry
+        elif settings.AUTH_TOKEN_SHARED_CACHE:
+            entry = cache.get(shared_key(key))
+            if entry is None:
+                return None
+            # Время проверки из другого процесса не имеет смысла здесь.
+            (user, token, version), checked = entry, None
+        else:
+            return None
+        now = time.monotonic()
+        if (checked is None or now - checked
+                >= settings.AUTH_TOKEN_VERSION_CHECK_INTERVAL):
+            if version != get_version(auth_version(user.pk)):
+                token_cache.delete(key)
+                return None
+            token_cache.set(key, (user, token, version, now))
+        return user, token
+
+    def authenticate_credentials(self, key):
+        cached = self.get_cached(key)
+        if cached is not None:
+            auth_counters.increment('hits')
+            user, token = cached
+            # Каждый запрос получает свою копию: представления меняют
+            # объект пользователя, а запись кэша общая для потоков.
+            return copy.copy(user), token
+        auth_counters.increment('misses')
+        user, token = super().authenticate_credentials(key)
+        version = get_version(auth_version(user.pk))
+        token_cache.set(key, (user, token, version, time.monotonic()))
+        if settings.AUTH_TOKEN_SHARED_CACHE:
+            cache.set(shared_key(key), (user, token, version),
+                      settings.AUTH_TOKEN_CACHE_TTL)
+        return copy.copy(user), token
@@ -0,0 +1,66 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+
+from recipes.versions import get_versions
+
+COUNTER_KEY = 'counter:{}'
+
+
+def increment(name, delta=1):
+    """Счетчик в общем кэше, например попаданий в кэш ответов."""
+    key = COUNTER_KEY.format(name)
+    cache.add(key, 0, None)
+    try:
+        cache.incr(key, delta)
+    except ValueError:
+        cache.set(key, delta, None)
+
+
+def get_counters(*names):
+    found = cache.get_many([COUNTER_KEY.format(name) for name in names])
+    return {name: found.get(COUNTER_KEY.format(name), 0) for name in names}
+
+
+def normalized_query(request):
+    """Строка запроса без учета порядка параметров и их значений."""
+    return '&'.join(
+        f'{name}={value}'
+        for name in sorted(request.query_params)
+        for value in sorted(request.query_params.getlist(name)))
+
+
+def response_key(request, action, versions, **kwargs):
+    """
+    Ключ кэша ответа: версии данных, действие, хост и нормализованная
+    строка запроса.
+    """
+    query = normalized_query(request)
+    params = ','.join(f'{name}={kwargs[name]}' for name in sorted(kwargs))
+    # Строка запроса может быть длинной и содержать пробелы и кириллицу
+    # (например, ?search=), поэтому в ключ идет ее хэш: memcached не
+    # принимает такие ключи.
+    digest = hashlib.sha256(
+        f'{request.scheme}://{request.get_host()}?{query}'.encode()
+    ).hexdigest()
+    return (f'response:{":".join(map(repr, versions))}:{action}:{params}:'
+            f'{digest}')
+
+
+def cached_data(request, name, action, version_names, render, **kwargs):
+    """
+    Данные ответа из кэша или render(), если их там нет. Возвращает пару
+    (data, hit).
+    """
+    key = response_key(
+        request, action, get_versions(*version_names), **kwargs)
+    data = cache.get(key)
+    if data is not None:
+        increment(f'{name}:hits')
+        return data, True
+    increment(f'{name}:misses')
+    data = render()
+    if data is not None:
+        cache.set(key, data, settings.RESPONSE_CACHE_TIMEOUT)
+    return data, False
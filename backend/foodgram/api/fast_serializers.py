@@ -0,0 +1,185 @@
+from collections import defaultdict
+
+from recipes import images
+from recipes.models import Recipe, RecipeIngredient
+from recipes.relations import EMPTY
+
+from api.serializers import RecipeSerializer, user_relations
+
+USER_FIELDS = ('email', 'id', 'username', 'first_name', 'last_name')
+# Столбцы values(), из которых строятся поля ответа рецепта.
+RECIPE_COLUMNS = {
+    'id': ('id',),
+    'author': ('author_id',) + tuple(
+        f'author__{field}' for field in USER_FIELDS if field != 'id'),
+    'name': ('name',),
+    'image': ('image',),
+    'image_variants': ('image', 'processed_image'),
+    'text': ('text',),
+    'cooking_time': ('cooking_time',),
+}
+# Поля, для которых нужны связи пользователя запроса.
+RELATION_FIELDS = {'author', 'is_favorited', 'is_in_shopping_cart'}
+PREVIEW_FIELDS = (
+    'id', 'name', 'image', 'processed_image', 'cooking_time', 'author_id')
+SUBSCRIPTION_FIELDS = USER_FIELDS + ('recipes_count',)
+
+image_storage = Recipe._meta.get_field('image').storage
+
+
+def recipe_columns(fields):
+    """Столбцы для полей ответа fields; id нужен всегда."""
+    return tuple(dict.fromkeys(
+        column for field in ('id',) + tuple(fields)
+        for column in RECIPE_COLUMNS.get(field, ())))
+
+
+RECIPE_FIELDS = recipe_columns(RecipeSerializer.Meta.fields)
+
+
+def absolute_url(request, url):
+    return url if request is None else request.build_absolute_uri(url)
+
+
+def image_url(request, name):
+    """Как serializers.ImageField: адрес файла или None."""
+    if not name:
+        return None
+    return absolute_url(request, image_storage.url(name))
+
+
+def image_variants(request, row):
+    """Как ImageVariantsField для строки рецепта."""
+    urls = images.image_variant_urls(row['image'], row['processed_image'])
+    if urls is None or request is None:
+        return urls
+    return {
+        variant: {encoding: absolute_url(request, url)
+                  for encoding, url in encodings.items()}
+        for variant, encodings in urls.items()}
+
+
+def tags_by_recipe(recipe_ids):
+    """Теги рецептов одним запросом, в порядке TagSerializer (-id)."""
+    tags = defaultdict(list)
+    for recipe_id, *tag in Recipe.tags.through.objects.filter(
+            recipe_id__in=recipe_ids).order_by('-tag_id').values_list(
+                'recipe_id', 'tag_id', 'tag__name', 'tag__color',
+                'tag__slug'):
+        tags[recipe_id].append(dict(zip(('id', 'name', 'color', 'slug'),
+                                        tag)))
+    return tags
+
+
+def ingredients_by_recipe(recipe_ids):
+    """Ингредиенты рецептов с количеством одним запросом."""
+    ingredients = defaultdict(list)
+    for recipe_id, *ingredient in RecipeIngredient.objects.filter(
+            recipe_id__in=recipe_ids).order_by('-id').values_list(
+                'recipe_id', 'ingredient_id', 'ingredient__name',
+                'ingredient__measurement_unit', 'amount'):
+        ingredients[recipe_id].append(dict(zip(
+            ('id', 'name', 'measurement_unit', 'amount'), ingredient)))
+    return ingredients
+
+
+def previews_by_author(recipes, author_ids):
+    """Превью рецептов авторов из queryset recipes одним запросом."""
+    previews = defaultdict(list)
+    for row in recipes.filter(author_id__in=author_ids).values(
+            *PREVIEW_FIELDS):
+        previews[row['author_id']].append(row)
+    return previews
+
+
+class FastReadSerializer:
+    """
+    Сериализатор только для чтения. Принимает строки values() вместо
+    объектов моделей и собирает ответ для всей страницы сразу, с тем же
+    порядком полей и теми же значениями, что и сериализатор DRF, которому
+    он соответствует. Связи читаются одним запросом на страницу.
+    Подклассы определяют to_representation(rows) для списка строк.
+    """
+
+    def __init__(self, instance=None, many=False, context=None, **kwargs):
+        self.instance = instance
+        self.many = many
+        self.context = context or {}
+
+    @property
+    def data(self):
+        rows = list(self.instance) if self.many else [self.instance]
+        items = self.to_representation(rows) if rows else []
+        return items if self.many else items[0]
+
+
+class FastRecipeSerializer(FastReadSerializer):
+    """
+    Ответ RecipeSerializer из строк со столбцами recipe_columns(fields).
+    Поля берутся из context['fields'], теги, ингредиенты и связи
+    пользователя читаются, только если они нужны для этих полей.
+    """
+
+    def to_representation(self, rows):
+        fields = self.context.get('fields')
+        if fields is None:
+            fields = RecipeSerializer.Meta.fields
+        request = self.context.get('request')
+        relations = (user_relations(self.context)
+                     if RELATION_FIELDS.intersection(fields) else EMPTY)
+        recipe_ids = [row['id'] for row in rows]
+        tags = tags_by_recipe(recipe_ids) if 'tags' in fields else {}
+        ingredients = (ingredients_by_recipe(recipe_ids)
+                       if 'ingredients' in fields else {})
+        getters = {
+            'id': lambda row: row['id'],
+            'tags': lambda row: tags.get(row['id'], []),
+            'author': lambda row: {
+                'email': row['author__email'],
+                'id': row['author_id'],
+                'username': row['author__username'],
+                'first_name': row['author__first_name'],
+                'last_name': row['author__last_name'],
+                'is_subscribed': row['author_id'] in relations.following,
+            },
+            'ingredients': lambda row: ingredients.get(row['id'], []),
+            'is_favorited': lambda row: row['id'] in relations.favorites,
+            'is_in_shopping_cart': lambda row: row['id'] in relations.cart,
+            'name': lambda row: row['name'],
+            'image': lambda row: image_url(request, row['image']),
+            'image_variants': lambda row: image_variants(request, row),
+            'text': lambda row: row['text'],
+            'cooking_time': lambda row: row['cooking_time'],
+        }
+        selected = [(field, getters[field]) for field in fields]
+        return [{field: get(row) for field, get in selected}
+                for row in rows]
+
+
+class FastSubscriptionSerializer(FastReadSerializer):
+    """
+    Ответ SubscriptionSerializer из строк с полями SUBSCRIPTION_FIELDS.
+    Превью рецептов берутся из queryset в context['preview_recipes'].
+    """
+
+    def preview(self, request, row):
+        return {
+            'id': row['id'],
+            'name': row['name'],
+            'image': image_url(request, row['image']),
+            'image_variants': image_variants(request, row),
+            'cooking_time': row['cooking_time'],
+        }
+
+    def to_representation(self, rows):
+        request = self.context.get('request')
+        following = user_relations(self.context).following
+        previews = previews_by_author(
+            self.context['preview_recipes'], [row['id'] for row in rows])
+        return [{
+            **{field: row[field] for field in USER_FIELDS},
+            'is_subscribed': row['id'] in following,
+            'recipes': [self.preview(request, recipe)
+                        for recipe in previews.get(row['id'], ())],
+            'recipes_count': row['recipes_count'],
+        } for row in rows]
@@ -0,0 +1,93 @@
+import binascii
+import re
+import tempfile
+import uuid
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from PIL import Image
+from rest_framework import serializers
+
+BASE64_HEADER = ';base64,'
+BASE64_CHUNK_SIZE = 64 * 1024
+NOT_BASE64 = re.compile(r'[^A-Za-z0-9+/=]')
+IMAGE_FORMATS = {'JPEG': 'jpg', 'PNG': 'png', 'GIF': 'gif', 'WEBP': 'webp'}
+
+
+def decode_base64(data, destination, offset=0):
+    """
+    Декодирует base64 начиная с offset по кускам в файл, не собирая в
+    памяти вторую копию изображения. Символы вне алфавита base64 (переводы
+    строк) пропускаются. Возвращает число записанных байт.
+    """
+    written = 0
+    rest = ''
+    for start in range(offset, len(data), BASE64_CHUNK_SIZE):
+        chunk = rest + NOT_BASE64.sub('', data[
+            start:start + BASE64_CHUNK_SIZE])
+        # Декодируется только целое число четверок символов, остаток
+        # переносится в следующий кусок.
+        cut = len(chunk) - len(chunk) % 4
+        chunk, rest = chunk[:cut], chunk[cut:]
+        written += destination.write(binascii.a2b_base64(chunk))
+        if written > settings.IMAGE_MAX_UPLOAD_SIZE:
+            raise serializers.ValidationError(
+                'Изображение слишком большое!')
+    if rest:
+        raise serializers.ValidationError('Некорректное изображение!')
+    return written
+
+
+class StreamingImageField(serializers.FileField):
+    """
+    Изображение файлом из multipart-запроса или строкой base64 (с
+    заголовком data:image/...;base64, или без него). Base64 декодируется
+    во временный файл, а размер в байтах и пикселях проверяется до того,
+    как изображение будет декодировано целиком. В отличие от ImageField
+    файл не читается в память для проверки.
+    """
+
+    def to_internal_value(self, data):
+        if isinstance(data, str):
+            data = self.decode(data)
+        if not isinstance(data, UploadedFile):
+            raise serializers.ValidationError(
+                'Ожидается файл или строка base64.')
+        if data.size > settings.IMAGE_MAX_UPLOAD_SIZE:
+            raise serializers.ValidationError(
+                'Изображение слишком большое!')
+        self.check_image(data)
+        return super().to_internal_value(data)
+
+    def decode(self, data):
+        offset = data.find(BASE64_HEADER, 0, 100)
+        offset = 0 if offset < 0 else offset + len(BASE64_HEADER)
+        upload = UploadedFile(
+            tempfile.TemporaryFile(), 'upload', 'application/octet-stream')
+        try:
+            upload.size = decode_base64(data, upload, offset)
+        except binascii.Error:
+            upload.close()
+            raise serializers.ValidationError('Некорректное изображение!')
+        except serializers.ValidationError:
+            upload.close()
+            raise
+        return upload
+
+    def check_image(self, upload):
+        upload.seek(0)
+        try:
+            image = Image.open(upload)
+            width, height = image.size
+            if width * height > settings.IMAGE_MAX_PIXELS:
+                raise serializers.ValidationError(
+                    'Изображение слишком большое по размеру в пикселях!')
+            image.verify()
+        except (OSError, SyntaxError, Image.DecompressionBombError):
+            raise serializers.ValidationError('Некорректное изображение!')
+        extension = IMAGE_FORMATS.get(image.format)
+        if extension is None:
+            raise serializers.ValidationError(
+                'Формат изображения не поддерживается!')
+        upload.name = f'{uuid.uuid4()}.{extension}'
+        upload.seek(0)
@@ -1,6 +1,13 @@
+from django import forms
+from django.core.cache import cache
+from django.db.models import Exists, OuterRef
 from django_filters import rest_framework as django_filters
 
-from recipes.models import Ingredient, Recipe
+from recipes.models import (FavoriteRecipe, Ingredient, Recipe, ShoppingCart,
+                            Tag)
+from recipes.scores import ORDERINGS, order_by_score
+from recipes.search import search_recipes, with_ingredients
+from recipes.versions import get_version
 
 
 class IngredientFilter(django_filters.FilterSet):
@@ -11,8 +18,50 @@ class IngredientFilter(django_filters.FilterSet):
         fields = ('name',)
 
 
+def get_tag_ids(slugs):
+    """
+    id тегов по слагам. Соответствие слагов и id хранится в кэше до
+    изменения тегов, чтобы не обращаться за ним к базе на каждый запрос.
+    """
+    key = f'tag-ids:{get_version("tags")}'
+    tag_ids = cache.get(key)
+    if tag_ids is None:
+        tag_ids = dict(Tag.objects.values_list('slug', 'id'))
+        cache.set(key, tag_ids)
+    return [tag_ids[slug] for slug in slugs if slug in tag_ids]
+
+
+class MultipleSlugField(forms.MultipleChoiceField):
+    """Список слагов без заранее известных вариантов выбора."""
+
+    def valid_value(self, value):
+        return True
+
+
+class MultipleSlugFilter(django_filters.Filter):
+    field_class = MultipleSlugField
+
+
+class MultipleIdField(forms.TypedMultipleChoiceField):
+    """Список целых id без заранее известных вариантов выбора."""
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('coerce', int)
+        super().__init__(*args, **kwargs)
+
+    def valid_value(self, value):
+        return True
+
+
+class MultipleIdFilter(django_filters.Filter):
+    field_class = MultipleIdField
+
+
 class RecipeFilter(django_filters.FilterSet):
-    """Фильтрсет рецептов."""
+    """
+    Фильтрсет рецептов. Каждый фильтр сужает пришедший queryset
+    подзапросом Exists, поэтому фильтры комбинируются без дублей строк.
+    """
 
     is_favorited = django_filters.BooleanFilter(
         method='get_is_favorited',
@@ -24,8 +73,18 @@ class RecipeFilter(django_filters.FilterSet):
         field_name='author__id',
         lookup_expr='exact'
     )
-    tags = django_filters.AllValuesMultipleFilter(
-        field_name='tags__slug',
+    tags = MultipleSlugFilter(
+        method='get_tags',
+    )
+    ingredients = MultipleIdFilter(
+        method='get_ingredients',
+    )
+    search = django_filters.CharFilter(
+        method='get_search',
+    )
+    ordering = django_filters.ChoiceFilter(
+        choices=[(ordering, ordering) for ordering in ORDERINGS],
+        method='get_ordering',
     )
 
     class Meta:
@@ -34,17 +93,45 @@ class RecipeFilter(django_filters.FilterSet):
             'is_favorited',
             'is_in_shopping_cart',
             'author',
-            'tags'
+            'tags',
+            'ingredients',
+            'search',
+            'ordering',
         )
 
     def get_is_favorited(self, queryset, name, value):
         cur_user = self.request.user
-        if value:
-            return Recipe.objects.filter(favorite_recipe__user=cur_user)
-        return Recipe.objects.all()
+        if not value:
+            return queryset
+        if cur_user.is_anonymous:
+            return queryset.none()
+        return queryset.filter(Exists(
+            FavoriteRecipe.recipe.through.objects.filter(
+                favoriterecipe__user=cur_user, recipe=OuterRef('pk'))))
 
     def get_is_in_shopping_cart(self, queryset, name, value):
         cur_user = self.request.user
-        if value:
-            return Recipe.objects.filter(cart__user=cur_user)
-        return Recipe.objects.all()
+        if not value:
+            return queryset
+        if cur_user.is_anonymous:
+            return queryset.none()
+        return queryset.filter(Exists(
+            ShoppingCart.recipe.through.objects.filter(
+                shoppingcart__user=cur_user, recipe=OuterRef('pk'))))
+
+    def get_tags(self, queryset, name, value):
+        tag_ids = get_tag_ids(value)
+        if not tag_ids:
+            return queryset.none()
+        return queryset.filter(Exists(
+            Recipe.tags.through.objects.filter(
+                recipe=OuterRef('pk'), tag_id__in=tag_ids)))
+
+    def get_ingredients(self, queryset, name, value):
+        return with_ingredients(queryset, value)
+
+    def get_search(self, queryset, name, value):
+        return search_recipes(queryset, value)
+
+    def get_ordering(self, queryset, name, value):
+        return order_by_score(queryset, value)
@@ -1,9 +1,18 @@
+import hashlib
+
 from django.shortcuts import get_object_or_404
-from rest_framework.permissions import IsAuthenticated
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.functional import cached_property
+from django.utils.http import http_date, quote_etag
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import SAFE_METHODS, IsAuthenticated
+from rest_framework.response import Response
 
+from api.cache import cached_data, normalized_query
 from api.permissions import IsAdminOrReadOnly
 from api.serializers import SubscribeRecipeSerializer
 from recipes.models import Recipe
+from recipes.versions import get_versions, relations_version
 
 
 class GetObjectMixin:
@@ -22,3 +31,134 @@ class PermissionAndPaginationMixin:
     """Миксин для списка тегов и ингридиентов."""
     permission_classes = (IsAdminOrReadOnly,)
     pagination_class = None
+
+
+class ConditionalGetMixin:
+    """
+    Миксин для ответов 304 Not Modified по версиям ресурсов: ETag и
+    Last-Modified вычисляются до обращения к базе и сериализатору.
+    """
+    list_versions = ()
+    retrieve_versions = ()
+    per_user = False
+
+    def get_version_names(self):
+        if self.action == 'list':
+            names = list(self.list_versions)
+        else:
+            names = [name.format(**self.kwargs)
+                     for name in self.retrieve_versions]
+        user = self.request.user
+        if self.per_user and user.is_authenticated:
+            names.append(relations_version(user.id))
+        return names
+
+    def conditional(self, handler, request, *args, **kwargs):
+        names = self.get_version_names()
+        if not names:
+            return handler(request, *args, **kwargs)
+        versions = get_versions(*names)
+        # Фильтры, страница и выбор полей меняют ответ при тех же версиях.
+        etag = quote_etag(hashlib.md5(repr(
+            (names, versions, normalized_query(request))
+        ).encode()).hexdigest())
+        last_modified = int(max(versions))
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = handler(request, *args, **kwargs)
+        if response.status_code in (200, 304):
+            response['ETag'] = etag
+            response['Last-Modified'] = http_date(last_modified)
+        if self.per_user:
+            patch_vary_headers(response, ('Authorization',))
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional(super().retrieve, request, *args, **kwargs)
+
+
+class AnonymousResponseCacheMixin:
+    """
+    Миксин кэширования списка и отдельных объектов для анонимных
+    пользователей: ответ не зависит от пользователя и сбрасывается
+    сменой версий response_cache_versions.
+    """
+    response_cache_name = None
+    response_cache_versions = ()
+
+    def cached(self, handler, request, *args, **kwargs):
+        if request.user.is_authenticated:
+            return handler(request, *args, **kwargs)
+        response = None
+
+        def render():
+            nonlocal response
+            response = handler(request, *args, **kwargs)
+            return response.data if response.status_code == 200 else None
+
+        data, hit = cached_data(
+            request, self.response_cache_name, self.action,
+            self.response_cache_versions, render, **kwargs)
+        if response is None:
+            response = Response(data)
+        response['X-Cache'] = 'HIT' if hit else 'MISS'
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.cached(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached(super().retrieve, request, *args, **kwargs)
+
+
+class SparseFieldsMixin:
+    """
+    Миксин выбора полей ответа параметрами fields и omit: имена полей
+    через запятую, fields=all — все поля. Без fields отдаются поля
+    default_fields для действия, а если их нет — все поля all_fields.
+    Выбранные поля передаются сериализатору в контексте, а вьюсет по
+    ним решает, какие связи и столбцы читать.
+    """
+    fields_param = 'fields'
+    omit_param = 'omit'
+    all_fields = ()
+    default_fields = {}
+    sparse_actions = ('list', 'retrieve')
+
+    def get_field_names(self, param):
+        names = [
+            name.strip()
+            for value in self.request.query_params.getlist(param)
+            for name in value.split(',') if name.strip()]
+        unknown = set(names) - set(self.all_fields) - {'all'}
+        if unknown:
+            raise ValidationError({param: (
+                f'Неизвестные поля: {", ".join(sorted(unknown))}. '
+                f'Доступны: {", ".join(self.all_fields)}.')})
+        return names
+
+    @cached_property
+    def response_fields(self):
+        """Поля ответа в порядке all_fields, None вне sparse_actions."""
+        if (self.request.method not in SAFE_METHODS
+                or self.action not in self.sparse_actions):
+            return None
+        selected = self.get_field_names(self.fields_param)
+        if not selected:
+            selected = self.default_fields.get(self.action, self.all_fields)
+        elif 'all' in selected:
+            selected = self.all_fields
+        omitted = set(self.get_field_names(self.omit_param))
+        return tuple(
+            name for name in self.all_fields
+            if name in selected and name not in omitted)
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        if self.response_fields is not None:
+            context['fields'] = self.response_fields
+        return context
@@ -1,5 +1,170 @@
+import base64
+import json
+from functools import reduce
+from operator import or_
+
+from django.core.paginator import Paginator
+from django.db import connection
+from django.db.models import F, Q
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+def estimate_count(queryset):
+    """
+    Примерное число строк запроса по статистике PostgreSQL: для всей
+    таблицы из pg_class, для запроса с условиями из плана EXPLAIN. На
+    других базах считается точный COUNT(*).
+    """
+    if connection.vendor != 'postgresql':
+        return queryset.count()
+    with connection.cursor() as cursor:
+        if not queryset.query.where:
+            cursor.execute(
+                'SELECT reltuples FROM pg_class WHERE oid = %s::regclass',
+                [queryset.model._meta.db_table])
+            row = cursor.fetchone()
+            if row and row[0] >= 0:
+                return int(row[0])
+        sql, params = queryset.order_by().values('pk').query.sql_with_params()
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+class EstimatedCountPaginator(Paginator):
+    @cached_property
+    def count(self):
+        return estimate_count(self.object_list)
+
+
+class KeysetPagination:
+    """
+    Постраничный вывод по ключу: следующая страница начинается после
+    значений сортировки последнего объекта, поэтому база не пропускает
+    OFFSET строк и не считает COUNT(*). Сортировка берется из атрибута
+    вьюсета cursor_ordering или из queryset и дополняется id.
+    """
+    cursor_query_param = 'cursor'
+
+    def __init__(self, page_size):
+        self.page_size = page_size
+
+    def get_ordering(self, queryset, view):
+        ordering = list(getattr(view, 'cursor_ordering', None) or (
+            queryset.query.order_by or queryset.model._meta.ordering))
+        if not {'id', '-id', 'pk', '-pk'} & set(ordering):
+            ordering.append('-id' if ordering[0].startswith('-') else 'id')
+        return [(field.lstrip('-'), field.startswith('-'))
+                for field in ordering]
+
+    def decode_cursor(self, request):
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None
+        try:
+            position = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        except ValueError:
+            position = None
+        if not isinstance(position, list):
+            raise NotFound('Некорректный курсор.')
+        return position
+
+    def encode_cursor(self, position):
+        # Даты сохраняются с микросекундами: DjangoJSONEncoder обрезает
+        # их до миллисекунд, и строки на границе страниц терялись бы.
+        return base64.urlsafe_b64encode(json.dumps(
+            position, default=lambda value: value.isoformat()
+        ).encode()).decode()
+
+    def after(self, ordering, position):
+        """
+        Условие «строго после position» для составного ключа. Лишнее
+        нестрогое условие на первое поле дает базе границу для поиска
+        по индексу, иначе OR проверяется фильтром с начала индекса.
+        """
+        field, descending = ordering[0]
+        bound = Q(**{f'{field}__{"lte" if descending else "gte"}':
+                     position[0]})
+        conditions = []
+        for index, (field, descending) in enumerate(ordering):
+            lookup = 'lt' if descending else 'gt'
+            condition = {f'{field}__{lookup}': position[index]}
+            condition.update({
+                ordering[number][0]: position[number]
+                for number in range(index)})
+            conditions.append(Q(**condition))
+        return bound & reduce(or_, conditions)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        ordering = self.get_ordering(queryset, view)
+        queryset = queryset.order_by(*(
+            f'-{field}' if descending else field
+            for field, descending in ordering))
+        position = self.decode_cursor(request)
+        if position is not None:
+            if len(position) != len(ordering):
+                raise NotFound('Некорректный курсор.')
+            queryset = queryset.filter(self.after(ordering, position))
+        keys = {f'cursor_key_{index}': F(field)
+                for index, (field, _) in enumerate(ordering)}
+        page = list(queryset.annotate(**keys)[:self.page_size + 1])
+        self.next_position = None
+        if len(page) > self.page_size:
+            page = page[:self.page_size]
+            last = page[-1]
+            # Страница может состоять из строк values(), а не объектов.
+            self.next_position = [
+                last[key] if isinstance(last, dict) else getattr(last, key)
+                for key in keys]
+        return page
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        return replace_query_param(
+            self.request.build_absolute_uri(), self.cursor_query_param,
+            self.encode_cursor(self.next_position))
+
+    def get_paginated_response(self, data, count=None):
+        response = {'next': self.get_next_link(), 'results': data}
+        if count is not None:
+            response = {'count': count, **response}
+        return Response(response)
 
 
 class LimitFieldPagination(PageNumberPagination):
+    """
+    Постраничный вывод с размером страницы в параметре limit. С
+    параметром cursor (для первой страницы пустым) страницы выдаются по
+    ключу, а с count=estimate вместо точного COUNT(*) отдается оценка.
+    """
     page_size_query_param = 'limit'
+    count_query_param = 'count'
+
+    def is_estimated(self, request):
+        return request.query_params.get(self.count_query_param) == 'estimate'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = None
+        estimated = self.is_estimated(request)
+        if KeysetPagination.cursor_query_param in request.query_params:
+            self.keyset = KeysetPagination(self.get_page_size(request))
+            self.estimated_count = (
+                estimate_count(queryset) if estimated else None)
+            return self.keyset.paginate_queryset(queryset, request, view)
+        self.django_paginator_class = (
+            EstimatedCountPaginator if estimated else Paginator)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(
+                data, self.estimated_count)
+        return super().get_paginated_response(data)
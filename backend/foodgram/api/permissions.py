@@ -8,9 +8,11 @@ class IsAuthorOrAdminOrReadOnly(permissions.BasePermission):
             or request.user.is_authenticated)
 
     def has_object_permission(self, request, view, obj):
+        # Безопасные методы проверяются первыми: при чтении объектом
+        # может быть строка values() без поля author.
         return (
-            obj.author == request.user
-            or request.method in permissions.SAFE_METHODS
+            request.method in permissions.SAFE_METHODS
+            or obj.author == request.user
             or request.user.is_superuser)
 
 
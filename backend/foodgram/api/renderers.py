@@ -0,0 +1,48 @@
+from rest_framework.renderers import BrowsableAPIRenderer, JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer на orjson. Компактный ответ без отступов совпадает с
+    ответом JSONRenderer побайтно: даты и остальные типы, которые orjson
+    не пишет сам так же, как DRF, передаются кодировщику DRF. Если orjson
+    не установлен, запрошены отступы или ASCII, а также на данных, которые
+    orjson не принимает, ответ строит JSONRenderer.
+
+    Числа с плавающей точкой вне [1e-4, 1e16) orjson пишет без «+» и
+    ведущего нуля в порядке, поэтому рендерер подключается только к
+    ответам, в которых таких чисел нет.
+    """
+    options = 0 if orjson is None else (
+        orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        | orjson.OPT_PASSTHROUGH_DATACLASS)
+    default = JSONEncoder().default
+
+    def is_fast(self, accepted_media_type, renderer_context):
+        return (
+            orjson is not None and self.compact and not self.ensure_ascii
+            and self.get_indent(
+                accepted_media_type, renderer_context or {}) is None)
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if not self.is_fast(accepted_media_type, renderer_context):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            content = orjson.dumps(data, default=self.default,
+                                   option=self.options)
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        # Как и JSONRenderer, экранирует разделители строк для JavaScript.
+        return content.replace(
+            b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+
+
+FAST_RENDERER_CLASSES = (FastJSONRenderer, BrowsableAPIRenderer)
@@ -1,16 +1,40 @@
+import json
+from collections import OrderedDict
+
 import django.contrib.auth.password_validation as validators
 from django.contrib.auth import authenticate, get_user_model
 from django.contrib.auth.hashers import make_password
-from django.shortcuts import get_object_or_404
+from django.db import transaction
 from djoser.serializers import UserCreateSerializer, UserSerializer
-from drf_extra_fields.fields import Base64ImageField
 from rest_framework import serializers
+from rest_framework.exceptions import NotFound
+
+from api.fields import StreamingImageField
 
-from recipes.models import Ingredient, Recipe, RecipeIngredient, Subscribe, Tag
+from recipes import cart_totals, images, relations
+from recipes.models import (Ingredient, Recipe, RecipeIngredient,
+                            ShoppingListExport, ShoppingListItem, Subscribe,
+                            Tag)
 
 
 User = get_user_model()
 ERR_MSG = 'Не удается войти в систему с предоставленными учетными данными.'
+MATCH_MAX_INGREDIENTS = 50
+# Поля карточки рецепта: их по умолчанию отдает список рецептов.
+RECIPE_CARD_FIELDS = (
+    'id', 'tags', 'author', 'is_favorited', 'is_in_shopping_cart', 'name',
+    'image', 'image_variants', 'cooking_time')
+
+
+def user_relations(context):
+    """
+    Избранное, корзина и подписки пользователя запроса: флаги в ответах
+    проверяются по этим множествам без запроса на каждый объект.
+    """
+    request = context.get('request')
+    if request is None:
+        return relations.EMPTY
+    return relations.request_relations(request)
 
 
 class CustomUserSerializer(UserCreateSerializer):
@@ -27,10 +51,7 @@ class CustomUserSerializer(UserCreateSerializer):
             'is_subscribed')
 
     def get_is_subscribed(self, obj):
-        user = self.context.get('request').user
-        if user.is_anonymous:
-            return False
-        return Subscribe.objects.filter(user=user, author=obj.id).exists()
+        return obj.id in user_relations(self.context).following
 
 
 class TagSerializer(serializers.ModelSerializer):
@@ -87,19 +108,44 @@ class IngredientAmountRecipeSerializer(serializers.ModelSerializer):
         fields = ('id', 'amount')
 
 
+class ImageVariantsField(serializers.Field):
+    """
+    Адреса уменьшенных копий изображения рецепта по размерам и форматам.
+    Пока копии не построены, отдается None.
+    """
+
+    def __init__(self, **kwargs):
+        kwargs['source'] = '*'
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, recipe):
+        urls = images.variant_urls(recipe)
+        request = self.context.get('request')
+        if urls is None or request is None:
+            return urls
+        return {
+            variant: {encoding: request.build_absolute_uri(url)
+                      for encoding, url in encodings.items()}
+            for variant, encodings in urls.items()}
+
+
 class PreviewRecipeSerializer(serializers.ModelSerializer):
     """
     Сериализатор для получения данных о рецептах для выдачи их в списке
     подписок.
     """
+    image_variants = ImageVariantsField()
+
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'image_variants', 'cooking_time')
 
 
 class RecipeSerializer(serializers.ModelSerializer):
     """
-    Сериализатор для получения данных о рецептах
+    Сериализатор для получения данных о рецептах. Если в контексте есть
+    fields, отдаются только перечисленные в нем поля.
     """
     author = CustomUserSerializer(read_only=True,)
     ingredients = RecipeIngredientSerializer(
@@ -108,6 +154,7 @@ class RecipeSerializer(serializers.ModelSerializer):
         source='ingredients_in_recipe')
     tags = TagSerializer(many=True, required=True)
     image = serializers.ImageField(required=True)
+    image_variants = ImageVariantsField()
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
 
@@ -115,33 +162,59 @@ class RecipeSerializer(serializers.ModelSerializer):
         model = Recipe
         fields = ('id', 'tags', 'author', 'ingredients', 'is_favorited',
                   'is_in_shopping_cart',
-                  'name', 'image', 'text',
+                  'name', 'image', 'image_variants', 'text',
                   'cooking_time')
 
+    def get_fields(self):
+        fields = super().get_fields()
+        selected = self.context.get('fields')
+        if selected is None:
+            return fields
+        return OrderedDict(
+            (name, field) for name, field in fields.items()
+            if name in selected)
+
     def get_is_favorited(self, obj):
-        user = self.context.get('request').user
-        if user.is_anonymous:
-            return False
-        return Recipe.objects.filter(favorite_recipe__user=user,
-                                     id=obj.id).exists()
+        return obj.id in user_relations(self.context).favorites
 
     def get_is_in_shopping_cart(self, obj):
-        user = self.context.get('request').user
-        if user.is_anonymous:
-            return False
-        return Recipe.objects.filter(cart__user=user, id=obj.id).exists()
+        return obj.id in user_relations(self.context).cart
+
+
+class MatchedRecipeSerializer(RecipeSerializer):
+    """
+    Сериализатор рецепта, подобранного по ингредиентам, с долей его
+    ингредиентов, которые есть у пользователя.
+    """
+    coverage = serializers.FloatField(read_only=True)
+    matched_ingredients = serializers.IntegerField(read_only=True)
+
+    class Meta(RecipeSerializer.Meta):
+        fields = RecipeSerializer.Meta.fields + (
+            'coverage', 'matched_ingredients')
+
+
+class RecipeMatchQuerySerializer(serializers.Serializer):
+    """Параметры подбора рецептов по имеющимся ингредиентам."""
+    ingredients = serializers.ListField(
+        child=serializers.IntegerField(min_value=1), source='ingredient_ids',
+        min_length=1, max_length=MATCH_MAX_INGREDIENTS)
+    limit = serializers.IntegerField(min_value=1, max_value=100, default=20)
+    min_coverage = serializers.FloatField(
+        min_value=0, max_value=1, default=0)
 
 
 class RecipeWriteSerializer(serializers.ModelSerializer):
     """
-    Сериализатор для создания рецептов.
+    Сериализатор для создания рецептов. Ингредиенты и теги проверяются
+    одним запросом на каждую модель, а при изменении рецепта строки
+    ингредиентов обновляются по разнице со старым составом.
     """
-    image = Base64ImageField(
+    image = StreamingImageField(
         max_length=None,
         use_url=True)
-    tags = serializers.PrimaryKeyRelatedField(
-        many=True,
-        queryset=Tag.objects.all())
+    tags = serializers.ListField(
+        child=serializers.IntegerField())
     ingredients = IngredientAmountRecipeSerializer(
         many=True)
 
@@ -150,24 +223,45 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
         fields = '__all__'
         read_only_fields = ('author',)
 
-    def validate(self, data):
-        ingredients = data['ingredients']
-        ingredient_list = []
-        for items in ingredients:
-            ingredient = get_object_or_404(
-                Ingredient, id=items['id'])
-            if ingredient in ingredient_list:
+    def to_internal_value(self, data):
+        if hasattr(data, 'getlist'):
+            data = self.parse_form(data)
+        return super().to_internal_value(data)
+
+    def parse_form(self, data):
+        """
+        Данные multipart-формы: изображение приходит файлом, теги —
+        повторяющимся полем, ингредиенты — строкой JSON.
+        """
+        values = data.dict()
+        if 'tags' in data:
+            values['tags'] = data.getlist('tags')
+        if isinstance(values.get('ingredients'), str):
+            try:
+                values['ingredients'] = json.loads(values['ingredients'])
+            except ValueError:
                 raise serializers.ValidationError(
-                    'Ингредиент должен быть уникальным!')
-            ingredient_list.append(ingredient)
+                    {'ingredients': 'Ожидается список в формате JSON.'})
+        return values
+
+    def validate(self, data):
+        ingredient_ids = [item['id'] for item in data['ingredients']]
+        if len(set(ingredient_ids)) != len(ingredient_ids):
+            raise serializers.ValidationError(
+                'Ингредиент должен быть уникальным!')
+        found = Ingredient.objects.in_bulk(ingredient_ids)
+        if len(found) != len(ingredient_ids):
+            raise NotFound('Ингредиент не найден.')
         tags = data['tags']
         if not tags:
             raise serializers.ValidationError(
                 'Нужен хотя бы один тэг для рецепта!')
-        for tag_name in tags:
-            if not Tag.objects.filter(name=tag_name).exists():
+        existing_tags = Tag.objects.in_bulk(tags)
+        for tag_id in tags:
+            if tag_id not in existing_tags:
                 raise serializers.ValidationError(
-                    f'Тэга {tag_name} не существует!')
+                    f'Тэга {tag_id} не существует!')
+        data['tags'] = list(dict.fromkeys(tags))
         return data
 
     def validate_cooking_time(self, cooking_time):
@@ -187,15 +281,37 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
         return ingredients
 
     def create_ingredients(self, ingredients, recipe):
-        create_ingredient = [
+        RecipeIngredient.objects.bulk_create([
             RecipeIngredient(
                 recipe=recipe,
-                ingredient=Ingredient.objects.get(pk=ingredient["id"]),
-                amount=ingredient['amount']
-            )
-            for ingredient in ingredients]
-        RecipeIngredient.objects.bulk_create(create_ingredient)
-
+                ingredient_id=ingredient['id'],
+                amount=ingredient['amount'])
+            for ingredient in ingredients])
+
+    def update_ingredients(self, ingredients, recipe):
+        amounts = {item['id']: item['amount'] for item in ingredients}
+        current = {row.ingredient_id: row
+                   for row in recipe.ingredients_in_recipe.all()}
+        old_amounts = {ingredient_id: row.amount
+                       for ingredient_id, row in current.items()}
+        removed = [row.id for ingredient_id, row in current.items()
+                   if ingredient_id not in amounts]
+        if removed:
+            RecipeIngredient.objects.filter(id__in=removed).delete()
+        changed = []
+        for ingredient_id, amount in amounts.items():
+            row = current.get(ingredient_id)
+            if row is not None and row.amount != amount:
+                row.amount = amount
+                changed.append(row)
+        if changed:
+            RecipeIngredient.objects.bulk_update(changed, ('amount',))
+        self.create_ingredients(
+            [item for item in ingredients if item['id'] not in current],
+            recipe)
+        cart_totals.composition_changed(recipe.id, old_amounts, amounts)
+
+    @transaction.atomic
     def create(self, validated_data):
         ingredients = validated_data.pop('ingredients')
         tags = validated_data.pop('tags')
@@ -204,11 +320,11 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
         self.create_ingredients(ingredients, recipe)
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
         if 'ingredients' in validated_data:
-            ingredients = validated_data.pop('ingredients')
-            instance.ingredients.clear()
-            self.create_ingredients(ingredients, instance)
+            self.update_ingredients(
+                validated_data.pop('ingredients'), instance)
         if 'tags' in validated_data:
             instance.tags.set(
                 validated_data.pop('tags'))
@@ -216,11 +332,10 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
             instance, validated_data)
 
     def to_representation(self, instance):
+        request = self.context.get('request')
         return RecipeSerializer(
-            instance,
-            context={
-                'request': self.context.get('request')
-            }).data
+            Recipe.objects.with_related().get(pk=instance.pk),
+            context={'request': request}).data
 
 
 class SubscribeRecipeSerializer(serializers.ModelSerializer):
@@ -228,9 +343,11 @@ class SubscribeRecipeSerializer(serializers.ModelSerializer):
     Сериализатор для обработки запросов на создание и удаление подписки на
     пользователя.
     """
+    image_variants = ImageVariantsField()
+
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'image_variants', 'cooking_time')
 
 
 class SubscribeSerializer(serializers.ModelSerializer):
@@ -286,21 +403,17 @@ class SubscriptionSerializer(UserSerializer):
         )
 
     def get_is_subscribed(self, obj):
-        cur_user = self.context['request'].user
-        if cur_user.is_anonymous:
-            return False
-        author = obj
-        return Subscribe.objects.filter(
-            user=cur_user,
-            author=author
-        ).exists()
+        return obj.id in user_relations(self.context).following
 
     def get_recipes(self, obj):
-        try:
-            limit = self.context['request'].query_params['recipes_limit']
-            quantity_recipe = obj.recipes.all()[:int(limit)]
-        except Exception:
-            quantity_recipe = obj.recipes.all()
+        if hasattr(obj, 'preview_recipes'):
+            quantity_recipe = obj.preview_recipes
+        else:
+            try:
+                limit = self.context['request'].query_params['recipes_limit']
+                quantity_recipe = obj.recipes.all()[:int(limit)]
+            except Exception:
+                quantity_recipe = obj.recipes.all()
         serializer = PreviewRecipeSerializer(
             instance=quantity_recipe,
             many=True,
@@ -311,8 +424,31 @@ class SubscriptionSerializer(UserSerializer):
         return serializer.data
 
     def get_recipes_count(self, obj):
-        quantity_recipe = obj.recipes.all()
-        return quantity_recipe.count()
+        return obj.recipes_count
+
+
+class ShoppingListItemSerializer(serializers.ModelSerializer):
+    """
+    Сериализатор строки списка покупок.
+    """
+    id = serializers.IntegerField(source='ingredient.id')
+    name = serializers.CharField(source='ingredient.name')
+    measurement_unit = serializers.CharField(
+        source='ingredient.measurement_unit')
+    amount = serializers.IntegerField(source='total')
+
+    class Meta:
+        model = ShoppingListItem
+        fields = ('id', 'name', 'measurement_unit', 'amount')
+
+
+class ShoppingListExportSerializer(serializers.ModelSerializer):
+    """
+    Сериализатор для получения статуса выгрузки списка покупок.
+    """
+    class Meta:
+        model = ShoppingListExport
+        fields = ('id', 'format', 'status', 'error', 'created', 'finished')
 
 
 class UserPasswordSerializer(serializers.Serializer):
@@ -0,0 +1,41 @@
+from functools import partial
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from api.authentication import forget_user
+from recipes.versions import auth_version, bump_version
+
+User = get_user_model()
+
+
+def reset_auth(user_id):
+    bump_version(auth_version(user_id))
+    forget_user(user_id)
+
+
+def bump_auth(user_id):
+    """
+    Сбрасывает закэшированные токены пользователя сразу и еще раз после
+    коммита, чтобы запрос, прочитавший старые данные до коммита, не
+    сохранил их под новой версией. Из кэша этого процесса записи
+    удаляются сразу, другие процессы заметят новую версию не позже чем
+    через AUTH_TOKEN_VERSION_CHECK_INTERVAL секунд.
+    """
+    reset_auth(user_id)
+    transaction.on_commit(partial(reset_auth, user_id))
+
+
+@receiver(post_delete, sender=Token)
+def token_deleted(sender, instance, **kwargs):
+    """Выход из системы (удаление токена в djoser) или удаление в админке."""
+    bump_auth(instance.user_id)
+
+
+@receiver((post_save, post_delete), sender=User)
+def user_changed(sender, instance, **kwargs):
+    """Смена пароля в set_password, деактивация и другие изменения."""
+    bump_auth(instance.pk)
@@ -0,0 +1,1042 @@
+import base64
+import io
+import json
+import os
+import tempfile
+from datetime import timedelta
+from unittest import mock, skipUnless
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APITestCase, APITransactionTestCase
+
+from api import fields
+from api.authentication import auth_counters, token_cache
+from api.cache import get_counters
+from recipes import (cart_totals, counters, exports, images, query_plans,
+                     recipe_matcher, relations, scores, shopping_list,
+                     synthetic)
+from recipes.ingredient_index import ingredient_index
+from recipes.models import (FavoriteRecipe, Ingredient, Recipe,
+                            RecipeIngredient, ShoppingCart, ShoppingListExport,
+                            Subscribe, Tag)
+from recipes.versions import auth_version, bump_version
+
+User = get_user_model()
+
+
+def png_base64(size=(10, 10), mode='RGB'):
+    image = io.BytesIO()
+    Image.new(mode, size, 'red').save(image, 'PNG')
+    return ('data:image/png;base64,'
+            + base64.b64encode(image.getvalue()).decode())
+
+
+class CatalogTestCase(APITestCase):
+    """
+    Рецепты нескольких авторов с тегами и ингредиентами, у читателя есть
+    избранное, корзина и подписки.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader = User.objects.create_user(
+            username='reader', email='reader@example.com', password='pw')
+        authors = [
+            User.objects.create_user(
+                username=f'author{number}',
+                email=f'author{number}@example.com', password='pw')
+            for number in range(8)]
+        tags = [Tag.objects.create(name=f'tag{number}', slug=f'tag{number}',
+                                   color=color)
+                for number, color in enumerate(('#0000FF', '#FFA500'))]
+        ingredients = [
+            Ingredient.objects.create(name=f'ingredient{number}',
+                                      measurement_unit='г')
+            for number in range(5)]
+        for number in range(40):
+            recipe = Recipe.objects.create(
+                author=authors[number % len(authors)], name=f'recipe{number}',
+                text='text', cooking_time=5)
+            recipe.tags.set(tags)
+            RecipeIngredient.objects.bulk_create(
+                RecipeIngredient(recipe=recipe, ingredient=ingredient,
+                                 amount=number + 1)
+                for ingredient in ingredients[:3])
+            if number % 3 == 0:
+                cls.reader.favorite_recipe.recipe.add(recipe)
+                cls.reader.cart.recipe.add(recipe)
+        for author in authors:
+            cls.reader.follower.create(author=author)
+        # У части рецептов готовы варианты изображения.
+        Recipe.objects.filter(id__in=[
+            recipe.id for recipe in Recipe.objects.all()[::2]]).update(
+                image='recipes/images/dish.jpg',
+                processed_image='recipes/images/dish.jpg')
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_authenticate(self.reader)
+
+
+class QueryCountTests(CatalogTestCase):
+    """Число запросов к базе у списков не зависит от размера страницы."""
+
+    def assert_queries(self, queries, url):
+        cache.clear()
+        with self.assertNumQueries(queries):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_recipe_list(self):
+        for fast in (True, False):
+            with self.subTest(fast=fast), override_settings(
+                    FAST_READ_SERIALIZERS=fast):
+                # COUNT, страница, теги, связи пользователя (3 запроса).
+                for limit in (6, 30):
+                    data = self.assert_queries(
+                        6, f'/api/recipes/?limit={limit}')
+                    self.assertEqual(len(data['results']), limit)
+                    self.assert_queries(
+                        7, f'/api/recipes/?limit={limit}&fields=all')
+
+    def test_subscriptions(self):
+        for fast in (True, False):
+            with self.subTest(fast=fast), override_settings(
+                    FAST_READ_SERIALIZERS=fast):
+                # COUNT, страница, связи пользователя (3 запроса),
+                # превью рецептов.
+                for limit in (2, 8):
+                    data = self.assert_queries(
+                        6, f'/api/users/subscriptions/?limit={limit}'
+                        f'&recipes_limit=3')
+                    self.assertEqual(len(data['results']), limit)
+
+
+class FastSerializerTests(CatalogTestCase):
+    """
+    Быстрые сериализаторы отдают тот же ответ, что и сериализаторы DRF,
+    побайтно.
+    """
+
+    def test_fast_output_matches_drf(self):
+        for url in ('/api/recipes/?limit=30',
+                    '/api/recipes/?limit=30&fields=all',
+                    '/api/recipes/?limit=30&fields=all&omit=text,ingredients',
+                    '/api/users/subscriptions/?limit=8',
+                    '/api/users/subscriptions/?limit=8&recipes_limit=3'):
+            with self.subTest(url=url):
+                content = {}
+                for fast in (True, False):
+                    with override_settings(FAST_READ_SERIALIZERS=fast):
+                        cache.clear()
+                        response = self.client.get(url)
+                    self.assertEqual(response.status_code, 200)
+                    content[fast] = response.content
+                self.assertEqual(content[True], content[False])
+
+
+class IngredientSearchTests(APITestCase):
+    """Подсказки ингредиентов отдает индекс в памяти процесса."""
+
+    def setUp(self):
+        cache.clear()
+        for name in ('Сок яблочный', 'яблоко', 'Яблочный уксус', 'Ёжевика',
+                     'груша'):
+            Ingredient.objects.create(name=name, measurement_unit='г')
+
+    def names(self, query):
+        response = self.client.get(f'/api/ingredients/?{query}')
+        self.assertEqual(response.status_code, 200)
+        return [ingredient['name'] for ingredient in response.data]
+
+    def test_prefix_matches_first(self):
+        self.assertEqual(self.names('name=ЯБЛ'), [
+            'яблоко', 'Яблочный уксус', 'Сок яблочный'])
+        self.assertEqual(self.names('name=ябл&limit=1'), ['яблоко'])
+        self.assertEqual(self.names('name=ежев'), ['Ёжевика'])
+        with self.assertNumQueries(0):
+            ingredient_index.search('груш')
+
+    def test_rebuilt_after_ingredient_changes(self):
+        self.assertEqual(self.names('name=груш'), ['груша'])
+        Ingredient.objects.create(name='Грушевый сироп', measurement_unit='мл')
+        Ingredient.objects.filter(name='груша').get().delete()
+        self.assertEqual(self.names('name=груш'), ['Грушевый сироп'])
+
+
+class RecipeFilterTests(CatalogTestCase):
+    """Фильтры рецептов комбинируются подзапросами без дублей строк."""
+
+    def ids(self, query):
+        response = self.client.get(f'/api/recipes/?limit=100&{query}')
+        self.assertEqual(response.status_code, 200)
+        ids = [recipe['id'] for recipe in response.data['results']]
+        self.assertEqual(len(ids), len(set(ids)))
+        return set(ids)
+
+    def test_combined_filters(self):
+        favorites = set(self.reader.favorite_recipe.recipe.values_list(
+            'id', flat=True))
+        author = Recipe.objects.get(name='recipe3').author
+        self.assertEqual(self.ids('tags=tag0&tags=tag1'),
+                         set(Recipe.objects.values_list('id', flat=True)))
+        self.assertEqual(
+            self.ids('is_favorited=1&is_in_shopping_cart=1&tags=tag1'),
+            favorites)
+        self.assertEqual(
+            self.ids(f'is_favorited=1&author={author.id}'),
+            favorites & set(author.recipes.values_list('id', flat=True)))
+        self.assertEqual(self.ids('tags=missing'), set())
+        self.client.force_authenticate(None)
+        self.assertEqual(self.ids('is_favorited=1'), set())
+
+    def test_new_tag_is_found(self):
+        self.assertEqual(self.ids('tags=new'), set())
+        tag = Tag.objects.create(name='new', slug='new', color='#00FF00')
+        recipe = Recipe.objects.get(name='recipe1')
+        recipe.tags.add(tag)
+        self.assertEqual(self.ids('tags=new&tags=missing'), {recipe.id})
+
+
+class LoadIngredientsTests(APITestCase):
+    """load_db загружает ингредиенты пачками без повторов."""
+
+    def setUp(self):
+        cache.clear()
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def write(self, name, content):
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'w', encoding='utf-8') as stream:
+            stream.write(content)
+        return path
+
+    def load(self, *args, **options):
+        output = io.StringIO()
+        call_command('load_db', *args, stdout=output, **options)
+        return output.getvalue()
+
+    def test_csv_is_deduplicated(self):
+        path = self.write('ingredients.csv', (
+            'соль,г\n соль , г\nсоль,ч. л.\nперец\n,г\nмука,г\n'))
+        self.assertIn('Read 5 rows (3 unique), created 3', self.load(
+            path, batch_size=2))
+        self.assertIn('created 0', self.load(path))
+        self.assertEqual(
+            set(Ingredient.objects.values_list('name', 'measurement_unit')),
+            {('соль', 'г'), ('соль', 'ч. л.'), ('мука', 'г')})
+
+    def test_json_from_stdin(self):
+        self.assertEqual(ingredient_index.search('мук'), [])
+        data = json.dumps([{'name': 'мука', 'measurement_unit': 'г'}])
+        with mock.patch('sys.stdin', io.StringIO(data)):
+            self.load('-', format='json')
+        self.assertEqual(
+            [row['name'] for row in ingredient_index.search('мук')],
+            ['мука'])
+
+    def test_unreadable_files(self):
+        with self.assertRaisesMessage(CommandError, 'use --format'):
+            self.load(self.write('ingredients.txt', 'мука,г\n'))
+        with self.assertRaisesMessage(CommandError, 'Cannot read'):
+            self.load(self.write('ingredients.json', '[{"name": "мука"}]'))
+
+
+class RecipeSearchTests(APITestCase):
+    """Поиск рецептов по словам названия и описания и по ингредиентам."""
+
+    def setUp(self):
+        cache.clear()
+        author = User.objects.create_user(
+            username='author', email='author@example.com', password='pw')
+        beet, onion = (
+            Ingredient.objects.create(name=name, measurement_unit='г')
+            for name in ('свекла', 'лук'))
+        self.ingredient_ids = (beet.id, onion.id)
+        for name, text, ingredients in (
+                ('Борщ', 'Суп со свеклой и капустой', (beet, onion)),
+                ('Винегрет', 'Салат из свеклы, вкуснее борща', (beet,)),
+                ('Пирог', 'Тесто и капуста', (onion,))):
+            recipe = Recipe.objects.create(
+                author=author, name=name, text=text, cooking_time=5)
+            RecipeIngredient.objects.bulk_create(
+                RecipeIngredient(recipe=recipe, ingredient=ingredient,
+                                 amount=1)
+                for ingredient in ingredients)
+
+    def names(self, query):
+        response = self.client.get(f'/api/recipes/?{query}')
+        self.assertEqual(response.status_code, 200)
+        return [recipe['name'] for recipe in response.data['results']]
+
+    def test_words_and_prefixes(self):
+        self.assertEqual(set(self.names('search=капуст')), {'Борщ', 'Пирог'})
+        self.assertEqual(self.names('search=Суп капуст'), ['Борщ'])
+        self.assertEqual(self.names('search=торт'), [])
+        self.assertEqual(len(self.names('search=, !')), 3)
+        beet, onion = self.ingredient_ids
+        self.assertEqual(
+            self.names(f'ingredients={beet}&ingredients={onion}'), ['Борщ'])
+
+    def test_renamed_recipe_is_found(self):
+        self.assertEqual(self.names('search=Щи'), [])
+        recipe = Recipe.objects.get(name='Пирог')
+        recipe.name = 'Щи'
+        recipe.save()
+        self.assertEqual(self.names('search=Щи'), ['Щи'])
+
+    @skipUnless(connection.vendor == 'postgresql',
+                'Ranking needs PostgreSQL full-text search')
+    def test_name_matches_rank_first(self):
+        self.assertEqual(self.names('search=борщ'), ['Борщ', 'Винегрет'])
+
+
+class RelationsCacheTests(CatalogTestCase):
+    """Флаги избранного, корзины и подписок из кэша связей читателя."""
+
+    def flags(self, recipe):
+        data = self.client.get(f'/api/recipes/{recipe.id}/').data
+        return (data['is_favorited'], data['is_in_shopping_cart'],
+                data['author']['is_subscribed'])
+
+    def test_loaded_once(self):
+        favorites = set(self.reader.favorite_recipe.recipe.values_list(
+            'id', flat=True))
+        found = relations.get_relations(self.reader)
+        self.assertEqual(found.favorites, favorites)
+        self.assertEqual(len(found.following), 8)
+        with self.assertNumQueries(0):
+            self.assertEqual(relations.get_relations(self.reader), found)
+        self.assertEqual(relations.get_relations(AnonymousUser()),
+                         relations.EMPTY)
+
+    def test_flags_follow_changes(self):
+        recipe = Recipe.objects.get(name='recipe0')
+        self.assertEqual(self.flags(recipe), (True, True, True))
+        self.client.delete(f'/api/recipes/{recipe.id}/favorite/')
+        self.assertEqual(self.flags(recipe), (False, True, True))
+        recipe.cart.clear()
+        self.assertEqual(self.flags(recipe), (False, False, True))
+        self.reader.follower.get(author=recipe.author).delete()
+        self.assertEqual(self.flags(recipe), (False, False, False))
+        recipe.favorite_recipe.add(self.reader.favorite_recipe)
+        self.assertEqual(self.flags(recipe), (True, False, False))
+
+
+class ConditionalGetTests(APITestCase):
+    """ETag списка рецептов меняется, когда меняются рецепты."""
+
+    def setUp(self):
+        self.reader, self.author = (
+            User.objects.create_user(
+                username=name, email=f'{name}@example.com', password='pw')
+            for name in ('reader', 'author'))
+        self.client.force_authenticate(self.reader)
+
+    def get(self, url, etag=None):
+        headers = {} if etag is None else {'HTTP_IF_NONE_MATCH': etag}
+        return self.client.get(url, **headers)
+
+    def test_list_etag_changes_after_another_user_writes(self):
+        etag = self.get('/api/recipes/')['ETag']
+        self.assertEqual(self.get('/api/recipes/', etag).status_code, 304)
+        Recipe.objects.create(
+            author=self.author, name='recipe', text='text', cooking_time=5)
+        response = self.get('/api/recipes/', etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_list_etag_depends_on_query(self):
+        etag = self.get('/api/recipes/?limit=6&page=1')['ETag']
+        self.assertEqual(
+            self.get('/api/recipes/?page=1&limit=6', etag).status_code, 304)
+        self.assertEqual(
+            self.get('/api/recipes/?limit=3&page=1', etag).status_code, 200)
+
+
+class RecipeWriteMixin:
+    """Автор с рецептом из одного ингредиента и данные для его записи."""
+    ingredient_count = 3
+
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(
+            username='author', email='author@example.com', password='pw')
+        self.tag = Tag.objects.create(name='tag', slug='tag', color='#0000FF')
+        self.ingredients = [
+            Ingredient.objects.create(name=f'ingredient{number}',
+                                      measurement_unit='г')
+            for number in range(self.ingredient_count)]
+        self.recipe = Recipe.objects.create(
+            author=self.author, name='recipe', text='text', cooking_time=5)
+        self.recipe.tags.set([self.tag])
+        RecipeIngredient.objects.create(
+            recipe=self.recipe, ingredient=self.ingredients[0], amount=1)
+        self.anonymous = self.client_class()
+        self.client.force_authenticate(self.author)
+
+    def recipe_data(self, ingredients, **fields):
+        return {'name': 'recipe', 'tags': [self.tag.id], 'cooking_time': 5,
+                'text': 'text', 'ingredients': [
+                    {'id': ingredient.id, 'amount': 2}
+                    for ingredient in ingredients], **fields}
+
+    def patch_recipe(self, ingredients, **fields):
+        response = self.client.patch(
+            f'/api/recipes/{self.recipe.id}/',
+            self.recipe_data(ingredients, **fields), format='json')
+        self.assertEqual(response.status_code, 200)
+        return response
+
+
+class TemporaryMediaMixin:
+    """Файлы, сохраненные тестом, пишутся во временный MEDIA_ROOT."""
+
+    def setUp(self):
+        super().setUp()
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        media_root = override_settings(MEDIA_ROOT=media.name)
+        media_root.enable()
+        self.addCleanup(media_root.disable)
+
+
+class RecipeWriteTestCase(RecipeWriteMixin, APITransactionTestCase):
+    """Записи коммитятся, как в работе, и обработчики коммита выполняются."""
+
+
+class WriteQueryCountTests(TemporaryMediaMixin, RecipeWriteMixin,
+                           APITestCase):
+    """
+    Число запросов при записи рецепта не зависит от числа ингредиентов.
+    Кэш очищается, поэтому связи автора для ответа читаются заново.
+    """
+    ingredient_count = 30
+
+    def assert_write_queries(self, queries, write):
+        cache.clear()
+        with self.assertNumQueries(queries):
+            write()
+
+    def test_create(self):
+        # Ингредиенты и теги, рецепт со счетчиком автора и рейтингом,
+        # теги и ингредиенты одной вставкой, ответ со связями автора.
+        for count in (3, 30):
+            with self.subTest(count=count):
+                self.assert_write_queries(22, lambda: self.assertEqual(
+                    self.client.post('/api/recipes/', self.recipe_data(
+                        self.ingredients[:count], image=png_base64()),
+                        format='json').status_code, 201))
+
+    def test_update(self):
+        # Из одного ингредиента в 30 и из 30 в 10.
+        for count in (30, 10):
+            with self.subTest(count=count):
+                self.assert_write_queries(18, lambda: self.patch_recipe(
+                    self.ingredients[:count]))
+        self.assertEqual(self.recipe.ingredients_in_recipe.count(), 10)
+
+
+class ImageVariantTests(TemporaryMediaMixin, RecipeWriteMixin, APITestCase):
+    """Варианты изображения строятся вне запроса и для текущего файла."""
+
+    def put_image(self, **image):
+        """Заменяет изображение рецепта, возвращает image_variants ответа."""
+        return self.patch_recipe(
+            self.ingredients[:1], image=png_base64(**image)).data[
+                'image_variants']
+
+    def process(self):
+        output = io.StringIO()
+        call_command('process_recipe_images', once=True, stdout=output,
+                     stderr=output)
+        return output.getvalue()
+
+    def test_variants(self):
+        self.assertIsNone(self.put_image(size=(1500, 900), mode='RGBA'))
+        self.assertIn('Processed 1 images', self.process())
+        self.recipe.refresh_from_db()
+        self.assertFalse(images.pending().exists())
+        urls = self.client.get(
+            f'/api/recipes/{self.recipe.id}/').data['image_variants']
+        self.assertEqual(set(urls), {'full', 'card', 'thumbnail'})
+        for variant in images.VARIANTS:
+            for encoding in images.ENCODINGS:
+                name = images.variant_name(
+                    self.recipe.image.name, variant, encoding)
+                with default_storage.open(name) as stream:
+                    self.assertLessEqual(
+                        max(Image.open(stream).size), max(variant.size))
+                self.assertTrue(urls[variant.name][encoding.name].endswith(
+                    default_storage.url(name)))
+
+    def test_replaced_image_is_processed_again(self):
+        self.put_image()
+        self.process()
+        self.assertIsNone(self.put_image(size=(20, 20)))
+        self.assertTrue(images.pending().exists())
+        self.assertTrue(images.process(self.recipe.id))
+        self.assertFalse(images.process(self.recipe.id))
+
+    def test_too_large_image_is_skipped(self):
+        self.put_image(size=(100, 100))
+        with override_settings(IMAGE_MAX_PIXELS=99 * 99):
+            self.assertIn('ImageTooLarge', self.process())
+        self.assertTrue(images.pending().exists())
+
+
+class ImageUploadTests(TemporaryMediaMixin, RecipeWriteMixin, APITestCase):
+    """Base64 изображения декодируется по кускам с проверкой размеров."""
+
+    def create(self, image):
+        return self.client.post(
+            '/api/recipes/', self.recipe_data(self.ingredients, image=image),
+            format='json')
+
+    def test_decoded_in_chunks(self):
+        data = png_base64(size=(40, 40)).split(',', 1)[1]
+        wrapped = '\n'.join(data[start:start + 7]
+                            for start in range(0, len(data), 7))
+        destination = io.BytesIO()
+        with mock.patch.object(fields, 'BASE64_CHUNK_SIZE', 5):
+            written = fields.decode_base64(wrapped, destination)
+        self.assertEqual(destination.getvalue(), base64.b64decode(data))
+        self.assertEqual(written, len(destination.getvalue()))
+        response = self.create(wrapped)
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(Recipe.objects.get(
+            id=response.data['id']).image.name.endswith('.png'))
+
+    def test_rejected_images(self):
+        image = png_base64(size=(40, 40))
+        for name, data, limits in (
+                ('bytes', image, {'IMAGE_MAX_UPLOAD_SIZE': 50}),
+                ('pixels', image, {'IMAGE_MAX_PIXELS': 39 * 39}),
+                ('truncated', image[:-1], {}),
+                ('not an image',
+                 base64.b64encode(b'not an image').decode(), {})):
+            with self.subTest(name), override_settings(**limits):
+                response = self.create(data)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('image', response.data)
+        self.assertEqual(Recipe.objects.count(), 1)
+
+
+class ResponseCacheTests(RecipeWriteTestCase):
+    """
+    Ответы анонимам берутся из кэша, пока рецепты не изменились, и
+    пересобираются после записи рецепта.
+    """
+
+    def assert_cache(self, url, status):
+        response = self.anonymous.get(url)
+        self.assertEqual(response['X-Cache'], status)
+        return response.data
+
+    def test_hit_until_recipe_written(self):
+        for url in ('/api/recipes/', f'/api/recipes/{self.recipe.id}/'):
+            with self.subTest(url=url):
+                self.assert_cache(url, 'MISS')
+                with self.assertNumQueries(0):
+                    self.assert_cache(url, 'HIT')
+        self.patch_recipe(self.ingredients, name='renamed')
+        data = self.assert_cache('/api/recipes/', 'MISS')
+        self.assertEqual(data['results'][0]['name'], 'renamed')
+        data = self.assert_cache(f'/api/recipes/{self.recipe.id}/', 'MISS')
+        self.assertEqual(len(data['ingredients']), 3)
+
+    def test_composition_change_invalidates_detail(self):
+        url = f'/api/recipes/{self.recipe.id}/'
+        self.assert_cache(url, 'MISS')
+        RecipeIngredient.objects.create(
+            recipe=self.recipe, ingredient=self.ingredients[1], amount=1)
+        data = self.assert_cache(url, 'MISS')
+        self.assertEqual(len(data['ingredients']), 2)
+
+
+class MatcherJournalTests(RecipeWriteTestCase):
+    """Запись рецепта попадает в журнал индекса подбора один раз."""
+    ingredient_count = 20
+
+    def journal_size(self):
+        return cache.get(recipe_matcher.CHANGES_KEY, 0)
+
+    def test_recipe_write_is_journaled_once(self):
+        before = self.journal_size()
+        self.patch_recipe(self.ingredients)
+        self.patch_recipe(self.ingredients[5:])
+        self.assertEqual(self.journal_size(), before + 2)
+        self.assertEqual(
+            cache.get(recipe_matcher.CHANGE_KEY.format(before + 2)),
+            self.recipe.id)
+
+
+class CartTotalsTests(RecipeWriteMixin, APITestCase):
+    """Списки покупок следуют за корзинами и составом рецептов."""
+
+    def setUp(self):
+        super().setUp()
+        self.second = Recipe.objects.create(
+            author=self.author, name='second', text='text', cooking_time=5)
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(recipe=self.second, ingredient=ingredient,
+                             amount=10)
+            for ingredient in self.ingredients[:2])
+        self.reader = User.objects.create_user(
+            username='reader', email='reader@example.com', password='pw')
+        self.first_id, self.second_id, self.third_id = (
+            ingredient.id for ingredient in self.ingredients)
+
+    def assert_totals(self, user, expected):
+        self.assertEqual({
+            ingredient_id: (total, recipe_count)
+            for ingredient_id, total, recipe_count in
+            user.shopping_list_items.values_list(
+                'ingredient_id', 'total', 'recipe_count')}, expected)
+        self.assertEqual(cart_totals.rebuild(dry_run=True), 0)
+
+    def test_cart_changes(self):
+        self.reader.cart.recipe.add(self.recipe, self.second)
+        self.assert_totals(self.reader, {
+            self.first_id: (11, 2), self.second_id: (10, 1)})
+        self.second.cart.add(self.author.cart)
+        self.assert_totals(self.author, {
+            self.first_id: (10, 1), self.second_id: (10, 1)})
+        self.author.cart.recipe.remove(self.recipe)
+        self.reader.cart.recipe.remove(self.recipe)
+        self.assert_totals(self.reader, {
+            self.first_id: (10, 1), self.second_id: (10, 1)})
+        self.second.cart.clear()
+        self.assert_totals(self.reader, {})
+        self.assert_totals(self.author, {})
+
+    def test_requests_and_cart_deletion(self):
+        self.client.force_authenticate(self.reader)
+        for recipe in (self.recipe, self.second):
+            self.client.post(f'/api/recipes/{recipe.id}/shopping_cart/')
+        self.client.delete(f'/api/recipes/{self.recipe.id}/shopping_cart/')
+        self.assert_totals(self.reader, {
+            self.first_id: (10, 1), self.second_id: (10, 1)})
+        self.reader.cart.delete()
+        self.assert_totals(self.reader, {})
+
+    def test_composition_change(self):
+        self.reader.cart.recipe.add(self.recipe, self.second)
+        self.patch_recipe(self.ingredients[1:])
+        self.assert_totals(self.reader, {
+            self.first_id: (10, 1), self.second_id: (12, 2),
+            self.third_id: (2, 1)})
+        self.recipe.delete()
+        self.assert_totals(self.reader, {
+            self.first_id: (10, 1), self.second_id: (10, 1)})
+
+
+class TokenCacheTests(APITestCase):
+    """Кэш токенов сбрасывается при выходе, смене пароля и удалении."""
+
+    def setUp(self):
+        token_cache.clear()
+        self.user = User.objects.create_user(
+            username='reader', email='reader@example.com',
+            password='Old-password-1')
+        response = self.client.post('/api/auth/token/login/', {
+            'email': 'reader@example.com', 'password': 'Old-password-1'})
+        self.key = response.json()['auth_token']
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.key}')
+
+    def get_me(self):
+        """Профиль и признак того, что токен читался из базы."""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/users/me/')
+        return response, any(
+            'authtoken_token' in query['sql'] for query in queries)
+
+    def test_cached_lookup(self):
+        auth_counters.flush()
+        self.assertEqual(self.get_me()[0].status_code, 200)
+        response, token_read = self.get_me()
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(token_read)
+        self.assertEqual(auth_counters.counts['hits'], 1)
+        auth_counters.flush()
+        self.assertEqual(auth_counters.counts, {})
+        self.assertGreaterEqual(get_counters('auth:hits')['auth:hits'], 1)
+
+    def test_version_checked_after_interval(self):
+        self.get_me()
+        # Изменение в другом процессе: в этом процессе запись не удалена.
+        bump_version(auth_version(self.user.pk))
+        self.assertFalse(self.get_me()[1])
+        with override_settings(AUTH_TOKEN_VERSION_CHECK_INTERVAL=0):
+            self.assertTrue(self.get_me()[1])
+            self.assertFalse(self.get_me()[1])
+
+    def test_logout(self):
+        self.get_me()
+        self.client.post('/api/auth/token/logout/')
+        self.assertIsNone(token_cache.get(self.key))
+        self.assertEqual(self.get_me()[0].status_code, 401)
+
+    def test_password_change(self):
+        self.get_me()
+        response = self.client.post('/api/users/set_password/', {
+            'current_password': 'Old-password-1',
+            'new_password': 'New-password-2'})
+        self.assertEqual(response.status_code, 201)
+        self.assertIsNone(token_cache.get(self.key))
+        response, token_read = self.get_me()
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(token_read)
+        self.assertTrue(token_cache.get(self.key)[0].check_password(
+            'New-password-2'))
+
+    def test_token_deletion(self):
+        self.get_me()
+        Token.objects.filter(user=self.user).delete()
+        self.assertIsNone(token_cache.get(self.key))
+        self.assertEqual(self.get_me()[0].status_code, 401)
+
+    def test_deactivation(self):
+        self.get_me()
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.get_me()[0].status_code, 401)
+
+
+class ScoreOrderingTests(APITestCase):
+    """Популярные и набирающие популярность рецепты по рейтингам."""
+
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(
+            username='author', email='author@example.com', password='pw')
+        self.fans = [
+            User.objects.create_user(
+                username=f'fan{number}', email=f'fan{number}@example.com',
+                password='pw')
+            for number in range(4)]
+        now = timezone.now()
+        # Чем старше рецепт, тем больше у него поклонников.
+        for number in range(5):
+            recipe = Recipe.objects.create(
+                author=self.author, name=f'recipe{number}', text='text',
+                cooking_time=5)
+            Recipe.objects.filter(id=recipe.id).update(
+                pub_date=now - timedelta(days=number))
+            for fan in self.fans[:number]:
+                fan.favorite_recipe.recipe.add(recipe)
+        scores.compute()
+
+    def names(self, ordering):
+        """Все страницы по курсору в порядке ordering."""
+        url = f'/api/recipes/?ordering={ordering}&limit=2&cursor='
+        names = []
+        while url is not None:
+            data = self.client.get(url).data
+            names += [recipe['name'] for recipe in data['results']]
+            url = data['next']
+        return names
+
+    def test_orderings(self):
+        self.assertEqual(self.names('popular'), [
+            'recipe4', 'recipe3', 'recipe2', 'recipe1', 'recipe0'])
+        self.assertEqual(self.names('trending'), [
+            'recipe1', 'recipe2', 'recipe3', 'recipe4', 'recipe0'])
+        self.assertEqual(
+            self.client.get('/api/recipes/?ordering=newest').status_code, 400)
+
+    def test_scores_follow_recompute(self):
+        Recipe.objects.create(
+            author=self.author, name='new', text='text', cooking_time=5)
+        recipe = Recipe.objects.get(name='recipe0')
+        for fan in self.fans:
+            fan.favorite_recipe.recipe.add(recipe)
+            fan.cart.recipe.add(recipe)
+        # Новый рецепт получает нулевой рейтинг сразу, остальные
+        # рейтинги меняются только при пересчете.
+        self.assertEqual(self.names('popular'), [
+            'recipe4', 'recipe3', 'recipe2', 'recipe1', 'new', 'recipe0'])
+        call_command('compute_recipe_scores', stdout=io.StringIO())
+        self.assertEqual(self.names('popular'), [
+            'recipe0', 'recipe4', 'recipe3', 'recipe2', 'recipe1', 'new'])
+
+
+class SubscriptionCursorTests(APITestCase):
+    """Страницы подписок по курсору не повторяют авторов."""
+
+    def setUp(self):
+        users = [
+            User.objects.create_user(
+                username=f'user{number}', email=f'user{number}@example.com',
+                password='pw')
+            for number in range(10)]
+        self.reader, others, self.authors = users[0], users[1:3], users[3:]
+        # Чужие подписки на тех же авторов есть и до, и после своих.
+        for follower in (others[0], self.reader, others[1]):
+            for author in self.authors:
+                follower.follower.create(author=author)
+        self.client.force_authenticate(self.reader)
+
+    def test_cursor_pages_cover_subscriptions_once(self):
+        for fast in (True, False):
+            with self.subTest(fast=fast), override_settings(
+                    FAST_READ_SERIALIZERS=fast):
+                url = '/api/users/subscriptions/?limit=3&cursor='
+                ids = []
+                for _ in range(len(self.authors)):
+                    data = self.client.get(url).data
+                    ids += [user['id'] for user in data['results']]
+                    url = data['next']
+                    if url is None:
+                        break
+                self.assertIsNone(url)
+                self.assertEqual(
+                    ids, [author.id for author in reversed(self.authors)])
+
+
+class ShoppingListTestCase(APITestCase):
+    """В корзине читателя рецепт из двадцати ингредиентов."""
+
+    def setUp(self):
+        cache.clear()
+        self.reader = User.objects.create_user(
+            username='reader', email='reader@example.com', password='pw')
+        self.recipe = Recipe.objects.create(
+            author=self.reader, name='recipe', text='text', cooking_time=5)
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(
+                recipe=self.recipe, amount=number + 1,
+                ingredient=Ingredient.objects.create(
+                    name=f'ingredient{number:02}', measurement_unit='г'))
+            for number in range(20))
+        self.reader.cart.recipe.add(self.recipe)
+        self.client.force_authenticate(self.reader)
+
+    def download(self, url='/api/recipes/download_shopping_cart/', **extra):
+        response = self.client.get(url, **extra)
+        self.assertEqual(response.status_code, 200)
+        content = b''.join(response.streaming_content)
+        self.assertEqual(int(response['Content-Length']), len(content))
+        return response, content
+
+
+class PdfShoppingListTests(ShoppingListTestCase):
+    """PDF списка покупок разбит на страницы и кэшируется по составу."""
+
+    def test_pages(self):
+        response, content = self.download()
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertTrue(content.startswith(b'%PDF'))
+        self.assertIn(b'/Count 2', content)
+
+    def test_cached_until_cart_changes(self):
+        render = mock.Mock(wraps=shopping_list.render_pdf)
+        renderer = shopping_list.RENDERERS['pdf']._replace(render=render)
+        with mock.patch.dict(shopping_list.RENDERERS, pdf=renderer):
+            first = self.download()[1]
+            self.assertEqual(self.download()[1], first)
+            self.assertEqual(render.call_count, 1)
+            self.reader.cart.recipe.remove(self.recipe)
+            self.assertNotEqual(self.download()[1], first)
+            self.assertEqual(render.call_count, 2)
+
+
+class ExportFormatTests(ShoppingListTestCase):
+    """Формат выгрузки выбирают параметр format и заголовок Accept."""
+
+    def test_formats(self):
+        response, content = self.download(
+            '/api/recipes/download_shopping_cart/?format=txt')
+        self.assertEqual(response['Content-Type'], 'text/plain; charset=utf-8')
+        self.assertIn('1.  ingredient00 - 1г', content.decode())
+        response, content = self.download(
+            '/api/recipes/download_shopping_cart/?format=csv')
+        self.assertIn('attachment; filename="somefilename.csv"',
+                      response['Content-Disposition'])
+        self.assertEqual(content.decode().splitlines()[:2], [
+            'name,measurement_unit,amount', 'ingredient00,г,1'])
+        response, content = self.download(
+            HTTP_ACCEPT='text/csv;q=0.5, application/json')
+        self.assertEqual(json.loads(content)[-1], {
+            'name': 'ingredient19', 'measurement_unit': 'г', 'amount': 20})
+
+    def test_unknown_and_refused_formats(self):
+        response = self.client.get(
+            '/api/recipes/download_shopping_cart/?format=xlsx')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            shopping_list.select_format(accept='text/csv;q=0, text/html'),
+            shopping_list.DEFAULT_FORMAT)
+        self.assertEqual(
+            shopping_list.select_format('txt', 'application/json'), 'txt')
+
+    def test_registered_renderer(self):
+        with mock.patch.dict(shopping_list.RENDERERS):
+            shopping_list.register_renderer('md', 'text/markdown', 'md')(
+                lambda items: f'{len(items)} items'.encode())
+            response, content = self.download(
+                '/api/recipes/download_shopping_cart/?format=md')
+        self.assertEqual(response['Content-Type'],
+                         'text/markdown; charset=utf-8')
+        self.assertEqual(content, b'20 items')
+
+
+@override_settings(SHOPPING_LIST_EXPORT_WORKERS=0)
+class StaleExportTests(APITestCase):
+    """Задачи, брошенные упавшим обработчиком, не висят вечно."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='user', email='user@example.com', password='pw')
+        self.client.force_authenticate(self.user)
+        self.long_ago = timezone.now() - timedelta(days=1)
+
+    def test_running_export_fails_after_claim_timeout(self):
+        export = ShoppingListExport.objects.create(
+            user=self.user, format='txt', status=ShoppingListExport.RUNNING)
+        ShoppingListExport.objects.filter(id=export.id).update(
+            started=self.long_ago)
+        response = self.client.get(
+            f'/api/recipes/download_shopping_cart/{export.id}/')
+        self.assertEqual(response.data['status'], ShoppingListExport.FAILED)
+        self.assertEqual(response.data['error'], exports.STALE_ERROR)
+
+    def test_unfinished_exports_expire_by_created(self):
+        for status in (ShoppingListExport.PENDING,
+                       ShoppingListExport.RUNNING):
+            ShoppingListExport.objects.create(
+                user=self.user, format='txt', status=status)
+        fresh = ShoppingListExport.objects.create(
+            user=self.user, format='txt')
+        ShoppingListExport.objects.exclude(id=fresh.id).update(
+            created=self.long_ago)
+        self.assertEqual(exports.purge_expired(), 2)
+        self.assertQuerysetEqual(
+            ShoppingListExport.objects.all(), [fresh], transform=lambda x: x)
+
+
+class CounterTests(APITestCase):
+    """
+    Счетчики меняются сигналами по реально записанным связям, откуда бы
+    ни пришло изменение.
+    """
+
+    def setUp(self):
+        self.author = User.objects.create_user(
+            username='author', email='author@example.com', password='pw')
+        self.reader = User.objects.create_user(
+            username='reader', email='reader@example.com', password='pw')
+        self.recipe = Recipe.objects.create(
+            author=self.author, name='recipe', text='text', cooking_time=5)
+        self.client.force_authenticate(self.reader)
+
+    def assert_counts(self, favorites, cart, recipes):
+        self.recipe.refresh_from_db()
+        self.author.refresh_from_db()
+        self.assertEqual(self.recipe.favorites_count, favorites)
+        self.assertEqual(self.recipe.shopping_cart_count, cart)
+        self.assertEqual(self.author.recipes_count, recipes)
+        self.assertFalse(any(counters.recount_all(dry_run=True).values()))
+
+    def test_repeated_requests_count_once(self):
+        for url in (f'/api/recipes/{self.recipe.id}/favorite/',
+                    f'/api/recipes/{self.recipe.id}/shopping_cart/'):
+            for _ in range(2):
+                self.client.post(url)
+        self.assert_counts(1, 1, 1)
+        for url in (f'/api/recipes/{self.recipe.id}/favorite/',
+                    f'/api/recipes/{self.recipe.id}/shopping_cart/'):
+            for _ in range(2):
+                self.client.delete(url)
+        self.assert_counts(0, 0, 1)
+
+    def test_orm_changes_are_counted(self):
+        self.recipe.favorite_recipe.add(
+            self.reader.favorite_recipe, self.author.favorite_recipe)
+        self.reader.cart.recipe.add(self.recipe)
+        self.assert_counts(2, 1, 1)
+        self.recipe.favorite_recipe.clear()
+        self.reader.cart.recipe.clear()
+        self.assert_counts(0, 0, 1)
+
+    def test_removing_absent_links_is_not_counted(self):
+        other = Recipe.objects.create(
+            author=self.author, name='other', text='text', cooking_time=5)
+        self.reader.favorite_recipe.recipe.add(self.recipe)
+        self.reader.favorite_recipe.recipe.remove(self.recipe, other)
+        self.reader.favorite_recipe.recipe.remove(self.recipe)
+        other.favorite_recipe.remove(self.reader.favorite_recipe)
+        self.reader.cart.recipe.remove(other)
+        self.assert_counts(0, 0, 2)
+
+    def test_stale_save_keeps_counters(self):
+        stale_author = User.objects.get(id=self.author.id)
+        stale_recipe = Recipe.objects.get(id=self.recipe.id)
+        Recipe.objects.create(
+            author=self.author, name='second', text='text', cooking_time=5)
+        self.reader.favorite_recipe.recipe.add(self.recipe)
+        stale_author.set_password('new password')
+        stale_author.save()
+        stale_recipe.name = 'renamed'
+        stale_recipe.save()
+        self.assert_counts(1, 0, 2)
+        self.assertEqual(self.recipe.name, 'renamed')
+        self.assertTrue(self.author.check_password('new password'))
+
+    def test_deletions_are_counted(self):
+        Recipe.objects.create(
+            author=self.author, name='second', text='text', cooking_time=5
+        ).delete()
+        self.reader.favorite_recipe.recipe.add(self.recipe)
+        self.reader.cart.recipe.add(self.recipe)
+        self.assert_counts(1, 1, 1)
+        self.reader.delete()
+        self.assert_counts(0, 0, 1)
+
+
+@skipUnless(connection.vendor == 'postgresql',
+            'EXPLAIN checks need PostgreSQL')
+class QueryPlanTests(APITestCase):
+    """Горячие эндпоинты читают большие таблицы только по индексам."""
+
+    large_tables = {
+        model._meta.db_table for model in (
+            User, Recipe, RecipeIngredient, Subscribe,
+            FavoriteRecipe.recipe.through, ShoppingCart.recipe.through)}
+
+    def setUp(self):
+        cache.clear()
+        synthetic.seed(users=20, recipes=100, ingredients=50)
+        # На маленькой базе планировщик и так выбирает Seq Scan; с
+        # запретом он остается в плане, только если индекса нет.
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+
+    def test_hot_endpoints(self):
+        user, context = query_plans.endpoint_context()
+        self.client.force_authenticate(user)
+        for name, url in query_plans.ENDPOINTS:
+            with self.subTest(name):
+                queries, problems = query_plans.check_endpoint(
+                    self.client, url.format(**context), self.large_tables)
+                self.assertGreater(queries, 0)
+                self.assertEqual(problems, [])
+
+    def test_unindexed_filter_is_reported(self):
+        table = Recipe._meta.db_table
+        plan = query_plans.explain(
+            f'SELECT id FROM {table} WHERE cooking_time + 0 = 1')
+        self.assertEqual(query_plans.seq_scans(plan), [table])
@@ -4,7 +4,8 @@ from rest_framework.routers import DefaultRouter
 from api.views import (AddAndDeleteSubscribe, AddDeleteFavoriteRecipe,
                        AddDeleteShoppingCart, CustomUserViewSet,
                        DownloadShoppingCart, IngredientViewSet, RecipeViewSet,
-                       SubscriptionsView, TagViewSet, set_password)
+                       ShoppingListView, SubscriptionsView, TagViewSet,
+                       set_password)
 
 app_name = 'api'
 
@@ -36,8 +37,19 @@ urlpatterns = [
           'recipes/<int:recipe_id>/shopping_cart/',
           AddDeleteShoppingCart.as_view(),
           name='shopping_cart'),
+     path('recipes/shopping_list/',
+          ShoppingListView.as_view(),
+          name='shopping_list'),
      path('recipes/download_shopping_cart/',
-          DownloadShoppingCart.as_view({'get': 'download'}), name='download'),
+          DownloadShoppingCart.as_view(
+               {'get': 'download', 'post': 'create_export'}),
+          name='download'),
+     path('recipes/download_shopping_cart/<int:export_id>/',
+          DownloadShoppingCart.as_view({'get': 'export_status'}),
+          name='download_status'),
+     path('recipes/download_shopping_cart/<int:export_id>/file/',
+          DownloadShoppingCart.as_view({'get': 'export_file'}),
+          name='download_export'),
      path('', include(router.urls)),
      path('auth/', include('djoser.urls.authtoken')),
      path('', include('djoser.urls')),
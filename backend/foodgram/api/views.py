@@ -1,39 +1,53 @@
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.db.models import Sum
+from django.db import transaction
+from django.db.models import F, OuterRef, Prefetch, Subquery
 from django.db.models.aggregates import Count
 from django.db.models.expressions import Value
-from django.http import HttpResponse
+from django.http import Http404, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from django.urls import reverse
 from djoser.views import UserViewSet
-from reportlab.lib.pagesizes import A4
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
-from reportlab.pdfgen import canvas
 from rest_framework import generics, status, viewsets
-from rest_framework.decorators import api_view
+from rest_framework.decorators import action, api_view
 from rest_framework.generics import ListAPIView
 from rest_framework.permissions import SAFE_METHODS, IsAuthenticated
 from rest_framework.response import Response
 
+from api.fast_serializers import (SUBSCRIPTION_FIELDS, FastRecipeSerializer,
+                                  FastSubscriptionSerializer, recipe_columns)
 from api.filters import IngredientFilter, RecipeFilter
-from api.mixins import GetObjectMixin, PermissionAndPaginationMixin
+from api.mixins import (AnonymousResponseCacheMixin, ConditionalGetMixin,
+                        GetObjectMixin, PermissionAndPaginationMixin,
+                        SparseFieldsMixin)
 from api.pagination import LimitFieldPagination
 from api.permissions import IsAuthorOrAdminOrReadOnly
-from recipes.models import Ingredient, Recipe, RecipeIngredient, Tag
-from api.serializers import (CustomUserSerializer, IngredientSerializer,
-                             RecipeSerializer, RecipeWriteSerializer,
-                             SubscribeSerializer, SubscriptionSerializer,
-                             TagSerializer, UserPasswordSerializer)
+from api.renderers import FAST_RENDERER_CLASSES
+from recipes import counters, exports, images, shopping_list
+from recipes.ingredient_index import ingredient_index
+from recipes.models import (FavoriteRecipe, Ingredient, Recipe, ShoppingCart,
+                            ShoppingListExport, Tag)
+from recipes.recipe_matcher import recipe_matcher
+from api.serializers import (RECIPE_CARD_FIELDS, CustomUserSerializer,
+                             IngredientSerializer, MatchedRecipeSerializer,
+                             RecipeMatchQuerySerializer, RecipeSerializer,
+                             RecipeWriteSerializer,
+                             ShoppingListExportSerializer,
+                             ShoppingListItemSerializer, SubscribeSerializer,
+                             SubscriptionSerializer, TagSerializer,
+                             UserPasswordSerializer)
 
 User = get_user_model()
 
 
 class TagViewSet(
+        ConditionalGetMixin,
         PermissionAndPaginationMixin,
         viewsets.ModelViewSet):
     """Список тэгов."""
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
+    list_versions = retrieve_versions = ('tags',)
 
 
 class CustomUserViewSet(UserViewSet):
@@ -44,26 +58,94 @@ class CustomUserViewSet(UserViewSet):
     serializer_class = CustomUserSerializer
 
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(ConditionalGetMixin,
+                    AnonymousResponseCacheMixin,
+                    SparseFieldsMixin,
+                    viewsets.ModelViewSet):
     """
     Вьюсет для работы с запросами о рецептах - просмотр списка рецептов,
     просмотр отдельного рецепта, создание, изменение и удаление рецепта.
+    Список по умолчанию отдает поля карточки рецепта, параметры fields и
+    omit выбирают поля и заодно то, что читается из базы.
     """
     queryset = Recipe.objects.all()
     serializer_class = RecipeSerializer
     permission_classes = (IsAuthorOrAdminOrReadOnly,)
     filterset_class = RecipeFilter
+    list_versions = ('recipes', 'tags', 'ingredients', 'users')
+    retrieve_versions = ('recipe:{pk}', 'tags', 'ingredients', 'users')
+    per_user = True
+    response_cache_name = 'recipes'
+    response_cache_versions = ('recipes',)
+    renderer_classes = FAST_RENDERER_CLASSES
+    all_fields = RecipeSerializer.Meta.fields
+    default_fields = {'list': RECIPE_CARD_FIELDS}
+
+    def is_fast_read(self):
+        """
+        Список и отдельный рецепт читаются строками values() и
+        сериализуются FastRecipeSerializer, если это не отключено.
+        """
+        return (settings.FAST_READ_SERIALIZERS
+                and self.request.method in SAFE_METHODS
+                and self.action in ('list', 'retrieve'))
+
+    def get_queryset(self):
+        fields = self.response_fields
+        if self.is_fast_read():
+            return Recipe.objects.values(*recipe_columns(fields))
+        if fields is not None:
+            return Recipe.objects.with_related(
+                author='author' in fields, tags='tags' in fields,
+                ingredients='ingredients' in fields, text='text' in fields)
+        if self.request.method in SAFE_METHODS:
+            return Recipe.objects.with_related()
+        return Recipe.objects.all()
 
+    @transaction.atomic
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
+        images.schedule(serializer.instance)
+
+    def perform_update(self, serializer):
+        serializer.save()
+        images.schedule(serializer.instance)
 
     def get_serializer_class(self):
+        if self.action == 'match':
+            return MatchedRecipeSerializer
+        if self.is_fast_read():
+            return FastRecipeSerializer
         if self.request.method in SAFE_METHODS:
             return RecipeSerializer
         return RecipeWriteSerializer
 
-
-class IngredientViewSet(PermissionAndPaginationMixin,
+    @action(detail=False)
+    def match(self, request):
+        """
+        Рецепты по убыванию доли их ингредиентов, которые есть у
+        пользователя. Подбор идет по индексу в памяти, из базы читается
+        только страница результатов.
+        """
+        params = RecipeMatchQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        count, matches = recipe_matcher.match(**params.validated_data)
+        recipes = self.get_queryset().in_bulk(
+            [recipe_id for recipe_id, _, _ in matches])
+        results = []
+        for recipe_id, coverage, matched in matches:
+            # Рецепт мог быть удален после обновления индекса.
+            if recipe_id in recipes:
+                recipe = recipes[recipe_id]
+                recipe.coverage = round(coverage, 4)
+                recipe.matched_ingredients = matched
+                results.append(recipe)
+        serializer = self.get_serializer(results, many=True)
+        return Response({'count': count, 'results': serializer.data})
+
+
+class IngredientViewSet(ConditionalGetMixin,
+                        PermissionAndPaginationMixin,
                         viewsets.ModelViewSet):
     """
     Вьюсет для получения списка ингредиентов и отдельного ингредиента.
@@ -72,6 +154,19 @@ class IngredientViewSet(PermissionAndPaginationMixin,
     serializer_class = IngredientSerializer
     filterset_class = IngredientFilter
     filterset_class = IngredientFilter
+    list_versions = retrieve_versions = ('ingredients',)
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional(self.search, request, *args, **kwargs)
+
+    def search(self, request, *args, **kwargs):
+        try:
+            limit = int(request.query_params['limit'])
+        except (KeyError, ValueError):
+            limit = None
+        return Response(ingredient_index.search(
+            request.query_params.get('name', ''),
+            limit if limit is None or limit >= 0 else None))
 
 
 class AddAndDeleteSubscribe(
@@ -107,12 +202,20 @@ class AddAndDeleteSubscribe(
             return Response(
                 {'errors': 'Уже подписан!'},
                 status=status.HTTP_400_BAD_REQUEST)
-        subs = request.user.follower.create(author=instance)
+        with transaction.atomic():
+            subs = request.user.follower.create(author=instance)
+            counters.increment(
+                User.objects.filter(id=instance.id), followers_count=1)
         serializer = self.get_serializer(subs)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
+    @transaction.atomic
     def perform_destroy(self, instance):
-        self.request.user.follower.filter(author=instance).delete()
+        deleted, _ = self.request.user.follower.filter(
+            author=instance).delete()
+        if deleted:
+            counters.increment(
+                User.objects.filter(id=instance.id), followers_count=-1)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
@@ -123,17 +226,59 @@ class SubscriptionsView(ListAPIView):
     permission_classes = (IsAuthenticated,)
     pagination_class = LimitFieldPagination
     serializer_class = SubscriptionSerializer
+    renderer_classes = FAST_RENDERER_CLASSES
+    cursor_ordering = ('-subscription_id',)
+
+    def get_serializer_class(self):
+        if settings.FAST_READ_SERIALIZERS:
+            return FastSubscriptionSerializer
+        return SubscriptionSerializer
 
     def get_serializer_context(self):
         context = super().get_serializer_context()
         context.update({'request': self.request})
+        if settings.FAST_READ_SERIALIZERS:
+            context['preview_recipes'] = self.get_preview_recipes()
         return context
 
+    def get_recipes_limit(self):
+        try:
+            limit = int(self.request.query_params['recipes_limit'])
+        except (KeyError, ValueError):
+            return None
+        return limit if limit >= 0 else None
+
+    def get_preview_recipes(self):
+        limit = self.get_recipes_limit()
+        if limit is None:
+            return Recipe.objects.all()
+        return Recipe.objects.filter(id__in=Subquery(
+            Recipe.objects.filter(
+                author=OuterRef('author')
+            ).values('id')[:limit]))
+
     def get_queryset(self):
-        cur_user = self.request.user
-        return User.objects.filter(
-            following__user=cur_user
-        )
+        # Ключ подписки аннотируется в том же вызове, что и фильтр по
+        # пользователю: следующий filter() по following__id присоединил бы
+        # подписки всех пользователей на автора, и страницы повторялись бы.
+        users = User.objects.filter(
+            following__user=self.request.user
+        ).annotate(subscription_id=F('following__id'))
+        if settings.FAST_READ_SERIALIZERS:
+            return users.values(*SUBSCRIPTION_FIELDS)
+        return users.prefetch_related(Prefetch(
+            'recipes', queryset=self.get_preview_recipes(),
+            to_attr='preview_recipes'))
+
+
+def locked(model, user):
+    """
+    Избранное или корзина пользователя под блокировкой строки до конца
+    транзакции: одновременные запросы одного пользователя проверяют и
+    меняют связи по очереди, и счетчики рецептов и списки покупок,
+    которые ведут сигналы m2m_changed, не учитывают одну связь дважды.
+    """
+    return model.objects.select_for_update().get(user=user)
 
 
 class AddDeleteFavoriteRecipe(GetObjectMixin,
@@ -142,14 +287,20 @@ class AddDeleteFavoriteRecipe(GetObjectMixin,
 
     """Добавление и удаление рецепта в/из избранных."""
 
+    @transaction.atomic
     def create(self, request, *args, **kwargs):
         instance = self.get_object()
-        request.user.favorite_recipe.recipe.add(instance)
+        favorites = locked(FavoriteRecipe, request.user).recipe
+        if not favorites.filter(id=instance.id).exists():
+            favorites.add(instance)
         serializer = self.get_serializer(instance)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
+    @transaction.atomic
     def perform_destroy(self, instance):
-        self.request.user.favorite_recipe.recipe.remove(instance)
+        favorites = locked(FavoriteRecipe, self.request.user).recipe
+        if favorites.filter(id=instance.id).exists():
+            favorites.remove(instance)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
@@ -158,65 +309,130 @@ class AddDeleteShoppingCart(GetObjectMixin,
                             generics.ListCreateAPIView):
     """Добавление и удаление рецепта в/из корзины."""
 
+    @transaction.atomic
     def create(self, request, *args, **kwargs):
         instance = self.get_object()
-        request.user.cart.recipe.add(instance)
+        cart = locked(ShoppingCart, request.user).recipe
+        if not cart.filter(id=instance.id).exists():
+            cart.add(instance)
         serializer = self.get_serializer(instance)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
+    @transaction.atomic
     def perform_destroy(self, instance):
-        self.request.user.cart.recipe.remove(instance)
+        cart = locked(ShoppingCart, self.request.user).recipe
+        if cart.filter(id=instance.id).exists():
+            cart.remove(instance)
+
+
+class ShoppingListView(ListAPIView):
+    """
+    Текущий список покупок пользователя: готовые суммы ингредиентов
+    читаются одним запросом по индексу.
+    """
+    permission_classes = (IsAuthenticated,)
+    serializer_class = ShoppingListItemSerializer
+    pagination_class = None
+
+    def get_queryset(self):
+        return self.request.user.shopping_list_items.select_related(
+            'ingredient').order_by('ingredient__name')
 
 
 class DownloadShoppingCart(viewsets.ModelViewSet):
     """
-    Сохранение файла списка покупок.
+    Сохранение файла списка покупок. Файл можно получить сразу или
+    поставить выгрузку в очередь и забрать результат позже.
     """
     permission_classes = [IsAuthenticated]
+    serializer_class = ShoppingListExportSerializer
 
-    def download_pdf(self, result):
+    def get_queryset(self):
+        return self.request.user.shopping_list_exports.all()
+
+    def perform_content_negotiation(self, request, force=False):
+        # Параметр format и заголовок Accept выбирают формат файла
+        # из реестра списка покупок, а не рендерер DRF.
+        return super().perform_content_negotiation(request, force=True)
+
+    def get_export_format(self, request):
+        return shopping_list.select_format(
+            request.data.get('format') or request.query_params.get('format'),
+            request.META.get('HTTP_ACCEPT', ''))
+
+    def unsupported_format(self):
+        return Response(
+            {'errors': 'Формат не поддерживается! Доступны: '
+                       f'{", ".join(shopping_list.RENDERERS)}.'},
+            status=status.HTTP_400_BAD_REQUEST)
+
+    def download_file(self, export_format, document):
         """
-        Метод сохранения списка покупок в формате PDF.
+        Метод сохранения списка покупок в выбранном формате.
         """
-        response = HttpResponse(content_type='application/pdf')
+        renderer = shopping_list.RENDERERS[export_format]
+        response = StreamingHttpResponse(
+            shopping_list.iter_chunks(document),
+            content_type=renderer.content_type)
         response[
             'Content-Disposition'
-            ] = ('attachment; filename="somefilename.pdf"')
-        p = canvas.Canvas(response, pagesize=A4)
-        left_position = 50
-        top_position = 700
-        pdfmetrics.registerFont(TTFont('FreeSans',
-                                       'recipes/fonts/FreeSans.ttf'))
-        p.setFont('FreeSans', 25)
-        p.drawString(left_position, top_position + 40, "Список покупок:")
-
-        for number, item in enumerate(result, start=1):
-            pdfmetrics.registerFont(
-                TTFont('Miama Nueva', 'recipes/fonts/Miama Nueva.ttf')
-                )
-            p.setFont('Miama Nueva', 14)
-            p.drawString(
-                left_position,
-                top_position,
-                f'{number}.  {item["ingredient__name"]} - '
-                f'{item["ingredient_total"]}'
-                f'{item["ingredient__measurement_unit"]}'
-            )
-            top_position = top_position - 40
-
-        p.showPage()
-        p.save()
+            ] = (f'attachment; filename="somefilename.{renderer.extension}"')
+        response['Content-Length'] = len(document)
         return response
 
     def download(self, request):
         """
         Метод создания списка покупок.
         """
-        result = RecipeIngredient.objects.filter(
-            recipe__cart__user=request.user).values(
-            'ingredient__name', 'ingredient__measurement_unit').order_by(
-                'ingredient__name').annotate(ingredient_total=Sum('amount'))
-        return self.download_pdf(result)
+        export_format = self.get_export_format(request)
+        if export_format is None:
+            return self.unsupported_format()
+        document = shopping_list.get_document(
+            export_format, shopping_list.get_cart_items(request.user))
+        return self.download_file(export_format, document)
+
+    def create_export(self, request):
+        """
+        Метод постановки выгрузки списка покупок в очередь.
+        """
+        export_format = self.get_export_format(request)
+        if export_format is None:
+            return self.unsupported_format()
+        export = exports.create_export(request.user, export_format)
+        serializer = self.get_serializer(export)
+        return Response(
+            serializer.data,
+            status=status.HTTP_202_ACCEPTED,
+            headers={'Location': reverse(
+                'api:download_status', args=(export.id,))})
+
+    def get_export(self):
+        export = get_object_or_404(
+            self.get_queryset(), id=self.kwargs['export_id'])
+        if exports.is_expired(export):
+            export.delete()
+            raise Http404
+        if exports.is_stale(export):
+            exports.fail_stale()
+            export.refresh_from_db()
+        return export
+
+    def export_status(self, request, export_id):
+        """
+        Метод получения статуса выгрузки.
+        """
+        serializer = self.get_serializer(self.get_export())
+        return Response(serializer.data)
+
+    def export_file(self, request, export_id):
+        """
+        Метод получения готового файла выгрузки.
+        """
+        export = self.get_export()
+        if export.status != ShoppingListExport.DONE:
+            serializer = self.get_serializer(export)
+            return Response(serializer.data, status=status.HTTP_409_CONFLICT)
+        return self.download_file(export.format, bytes(export.document))
 
 
 @api_view(['post'])
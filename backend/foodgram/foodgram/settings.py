@@ -69,6 +69,20 @@ DATABASES = {
      }
 }
 
+# Версии данных (recipes.versions) сбрасываются и командами manage.py в
+# отдельных процессах, поэтому в работе нужен общий кэш в памяти:
+# memcached или redis (в infra - memcached). Кэш процесса по умолчанию
+# годится для разработки с одним процессом, кэш в базе запрещен
+# проверкой recipes.E001: версии читаются на каждом запросе.
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND',
+            'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', ''),
+    }
+}
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -103,6 +117,22 @@ MEDIA_ROOT = os.path.join(BASE_DIR, "media")
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+RESPONSE_CACHE_TIMEOUT = 5 * 60
+SHOPPING_LIST_CACHE_TIMEOUT = 60 * 60
+RELATIONS_CACHE_TIMEOUT = 60 * 60
+AUTH_TOKEN_CACHE_SIZE = 10000
+AUTH_TOKEN_CACHE_TTL = 5 * 60
+AUTH_TOKEN_VERSION_CHECK_INTERVAL = 5
+AUTH_TOKEN_SHARED_CACHE = os.getenv('AUTH_TOKEN_SHARED_CACHE') == '1'
+SHOPPING_LIST_EXPORT_TTL = 60 * 60
+SHOPPING_LIST_EXPORT_CLAIM_TIMEOUT = 10 * 60
+SHOPPING_LIST_EXPORT_WORKERS = int(
+    os.getenv('SHOPPING_LIST_EXPORT_WORKERS', 0))
+IMAGE_PROCESSING_WORKERS = int(os.getenv('IMAGE_PROCESSING_WORKERS', 0))
+IMAGE_MAX_PIXELS = 40 * 1000 * 1000
+IMAGE_MAX_UPLOAD_SIZE = 10 * 1024 * 1024
+FAST_READ_SERIALIZERS = os.getenv('FAST_READ_SERIALIZERS', '1') == '1'
+
 CORS_ORIGIN_ALLOW_ALL = True
 CORS_URLS_REGEX = r'^/api/.*$'
 
@@ -111,7 +141,7 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.IsAuthenticated',
     ],
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
     ],
     'DEFAULT_PAGINATION_CLASS': 'api.pagination.LimitFieldPagination',
     'PAGE_SIZE': 6,
@@ -1,7 +1,7 @@
 from django.contrib import admin
 
 from .models import (FavoriteRecipe, Ingredient, Recipe, RecipeIngredient,
-                     ShoppingCart, Subscribe, Tag)
+                     ShoppingCart, ShoppingListExport, Subscribe, Tag)
 
 EMPTY_MSG = '-пусто-'
 
@@ -52,6 +52,13 @@ class FavoriteRecipeAdmin(admin.ModelAdmin):
     list_filter = ('user', 'id')
 
 
+class ShoppingListExportAdmin(admin.ModelAdmin):
+    list_display = (
+        'user', 'format', 'status', 'created', 'started', 'finished', 'id')
+    list_filter = ('status', 'format')
+    exclude = ('document',)
+
+
 admin.site.register(Recipe, RecipeAdmin)
 admin.site.register(Ingredient, IngredientAdmin)
 admin.site.register(Tag, TagAdmin)
@@ -59,3 +66,4 @@ admin.site.register(ShoppingCart, ShoppingCartAdmin)
 admin.site.register(RecipeIngredient, RecipeIngredientAdmin)
 admin.site.register(FavoriteRecipe, FavoriteRecipeAdmin)
 admin.site.register(Subscribe, SubscribeAdmin)
+admin.site.register(ShoppingListExport, ShoppingListExportAdmin)
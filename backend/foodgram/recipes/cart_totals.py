@@ -0,0 +1,177 @@
+from collections import defaultdict
+
+from django.db import connection, transaction
+from django.db.models import Count, Sum
+
+from recipes.models import RecipeIngredient, ShoppingCart, ShoppingListItem
+
+BATCH_SIZE = 1000
+
+
+def recipe_deltas(recipe_ids, sign=1):
+    """
+    Изменения списка покупок при добавлении рецептов recipe_ids в
+    корзину (sign=1) или их удалении из корзины (sign=-1): для каждого
+    ингредиента пара (количество, число рецептов).
+    """
+    rows = RecipeIngredient.objects.filter(
+        recipe_id__in=recipe_ids).order_by().values('ingredient_id').annotate(
+            total=Sum('amount'), recipe_count=Count('id')).values_list(
+                'ingredient_id', 'total', 'recipe_count')
+    return {ingredient_id: (sign * total, sign * recipe_count)
+            for ingredient_id, total, recipe_count in rows}
+
+
+def composition_deltas(old, new):
+    """Изменения списка покупок при замене состава old на new."""
+    deltas = {}
+    for ingredient_id in old.keys() | new.keys():
+        before, after = old.get(ingredient_id), new.get(ingredient_id)
+        if before != after:
+            deltas[ingredient_id] = (
+                (after or 0) - (before or 0),
+                (after is not None) - (before is not None))
+    return deltas
+
+
+def cart_holders(recipe_id):
+    return sorted(ShoppingCart.objects.filter(
+        recipe=recipe_id).values_list('user_id', flat=True))
+
+
+def apply_sql(user_ids, deltas):
+    """Одна вставка с ON CONFLICT для PostgreSQL."""
+    table = ShoppingListItem._meta.db_table
+    ingredient_ids = sorted(deltas)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {table} (user_id, ingredient_id, total, '
+            f'recipe_count) SELECT users.id, deltas.ingredient_id, '
+            f'deltas.total, deltas.recipe_count '
+            f'FROM unnest(%s::integer[]) AS users(id) '
+            f'CROSS JOIN unnest(%s::integer[], %s::integer[], '
+            f'%s::integer[]) AS deltas(ingredient_id, total, recipe_count) '
+            f'ORDER BY 1, 2 '
+            f'ON CONFLICT (user_id, ingredient_id) DO UPDATE SET '
+            f'total = {table}.total + EXCLUDED.total, '
+            f'recipe_count = {table}.recipe_count + EXCLUDED.recipe_count',
+            [list(user_ids), ingredient_ids,
+             [deltas[ingredient_id][0] for ingredient_id in ingredient_ids],
+             [deltas[ingredient_id][1] for ingredient_id in ingredient_ids]])
+
+
+def apply_orm(user_ids, deltas):
+    existing = {
+        (item.user_id, item.ingredient_id): item
+        for item in ShoppingListItem.objects.filter(
+            user_id__in=user_ids, ingredient_id__in=deltas)}
+    created, changed = [], []
+    for user_id in user_ids:
+        for ingredient_id, (total, recipe_count) in deltas.items():
+            item = existing.get((user_id, ingredient_id))
+            if item is None:
+                created.append(ShoppingListItem(
+                    user_id=user_id, ingredient_id=ingredient_id,
+                    total=total, recipe_count=recipe_count))
+                continue
+            item.total += total
+            item.recipe_count += recipe_count
+            changed.append(item)
+    ShoppingListItem.objects.bulk_update(
+        changed, ('total', 'recipe_count'), batch_size=BATCH_SIZE)
+    ShoppingListItem.objects.bulk_create(created, batch_size=BATCH_SIZE)
+
+
+def apply(user_ids, deltas):
+    """
+    Прибавляет deltas к спискам покупок пользователей user_ids и удаляет
+    строки, для которых в корзине не осталось рецептов. В PostgreSQL
+    это атомарный upsert, на других базах - чтение и запись строк.
+    """
+    if not user_ids or not deltas:
+        return
+    if connection.vendor == 'postgresql':
+        apply_sql(user_ids, deltas)
+    else:
+        apply_orm(user_ids, deltas)
+    if any(recipe_count < 0 for _, recipe_count in deltas.values()):
+        ShoppingListItem.objects.filter(
+            user_id__in=user_ids, ingredient_id__in=deltas,
+            recipe_count__lte=0).delete()
+
+
+def links_changed(links, sign):
+    """
+    Переносит в списки покупок добавление (sign=1) или удаление (sign=-1)
+    связей корзин links - пар (user_id, recipe_id). Пользователи с
+    одинаковым набором рецептов обновляются одним вызовом apply.
+    """
+    recipes_by_user = defaultdict(set)
+    for user_id, recipe_id in links:
+        recipes_by_user[user_id].add(recipe_id)
+    users_by_recipes = defaultdict(list)
+    for user_id, recipe_ids in recipes_by_user.items():
+        users_by_recipes[frozenset(recipe_ids)].append(user_id)
+    for recipe_ids, user_ids in users_by_recipes.items():
+        apply(sorted(user_ids), recipe_deltas(recipe_ids, sign))
+
+
+def remove_from_carts(recipe_id):
+    """Вычитает рецепт из списков всех, у кого он в корзине (до удаления)."""
+    apply(cart_holders(recipe_id), recipe_deltas([recipe_id], -1))
+
+
+def composition_changed(recipe_id, old, new):
+    """
+    Переносит изменение состава рецепта ({ingredient_id: amount} до и
+    после) в списки покупок всех, у кого рецепт в корзине.
+    """
+    deltas = composition_deltas(old, new)
+    if deltas:
+        apply(cart_holders(recipe_id), deltas)
+
+
+def group_by_user(rows):
+    grouped = defaultdict(set)
+    for user_id, *item in rows:
+        grouped[user_id].add(tuple(item))
+    return grouped
+
+
+def rebuild_users(user_ids, dry_run=False):
+    """
+    Сверяет списки покупок user_ids с корзинами и пересобирает
+    разошедшиеся. Возвращает число пользователей с расхождениями.
+    """
+    actual = group_by_user(RecipeIngredient.objects.filter(
+        recipe__cart__user__in=user_ids
+    ).order_by().values_list('recipe__cart__user', 'ingredient').annotate(
+        total=Sum('amount'), recipe_count=Count('id')))
+    stored = group_by_user(ShoppingListItem.objects.filter(
+        user_id__in=user_ids).values_list(
+            'user_id', 'ingredient_id', 'total', 'recipe_count'))
+    drifted = [user_id for user_id in user_ids
+               if actual.get(user_id, set()) != stored.get(user_id, set())]
+    if dry_run or not drifted:
+        return len(drifted)
+    with transaction.atomic():
+        ShoppingListItem.objects.filter(user_id__in=drifted).delete()
+        ShoppingListItem.objects.bulk_create((
+            ShoppingListItem(
+                user_id=user_id, ingredient_id=ingredient_id, total=total,
+                recipe_count=recipe_count)
+            for user_id in drifted
+            for ingredient_id, total, recipe_count in actual.get(
+                user_id, ())), batch_size=BATCH_SIZE)
+    return len(drifted)
+
+
+def rebuild(dry_run=False, batch_size=BATCH_SIZE):
+    """Сверяет и при необходимости пересобирает списки всех пользователей."""
+    user_ids = sorted(set(ShoppingCart.objects.filter(
+        recipe__isnull=False).values_list('user_id', flat=True)) | set(
+        ShoppingListItem.objects.order_by().values_list(
+            'user_id', flat=True).distinct()))
+    return sum(
+        rebuild_users(user_ids[start:start + batch_size], dry_run)
+        for start in range(0, len(user_ids), batch_size))
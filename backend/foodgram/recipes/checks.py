@@ -0,0 +1,41 @@
+from django.conf import settings
+from django.core import checks
+
+# Кэши, операции которых - запросы к базе или файлы на диске.
+SLOW_CACHES = (
+    'django.core.cache.backends.db.DatabaseCache',
+    'django.core.cache.backends.filebased.FileBasedCache',
+)
+# Кэши, которые не видны другим процессам.
+PROCESS_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+@checks.register(checks.Tags.caches)
+def check_version_cache(app_configs, **kwargs):
+    """
+    Версии данных, счетчики и журналы читаются и пишутся на каждом
+    запросе, поэтому кэш по умолчанию должен быть в памяти.
+    """
+    backend = settings.CACHES['default']['BACKEND']
+    if backend in SLOW_CACHES:
+        return [checks.Error(
+            f'{backend} turns every version read and bump into a query.',
+            hint='Set CACHE_BACKEND to memcached or redis.',
+            id='recipes.E001')]
+    return []
+
+
+@checks.register(checks.Tags.caches, deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    """Кэш процесса не видит версии, сброшенные другими процессами."""
+    backend = settings.CACHES['default']['BACKEND']
+    if backend in PROCESS_CACHES:
+        return [checks.Warning(
+            f'{backend} is local to one process: web workers and '
+            f'management commands do not see each other\'s version bumps.',
+            hint='Set CACHE_BACKEND to memcached or redis.',
+            id='recipes.W001')]
+    return []
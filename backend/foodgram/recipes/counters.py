@@ -0,0 +1,51 @@
+from collections import namedtuple
+
+from django.contrib.auth import get_user_model
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from recipes.models import FavoriteRecipe, Recipe, ShoppingCart, Subscribe
+
+User = get_user_model()
+
+Counter = namedtuple('Counter', 'model field source source_field')
+
+COUNTERS = (
+    Counter(Recipe, 'favorites_count',
+            FavoriteRecipe.recipe.through, 'recipe'),
+    Counter(Recipe, 'shopping_cart_count',
+            ShoppingCart.recipe.through, 'recipe'),
+    Counter(User, 'recipes_count', Recipe, 'author'),
+    Counter(User, 'followers_count', Subscribe, 'author'),
+)
+
+
+def increment(queryset, **deltas):
+    """Атомарно меняет счетчики на заданные величины одним UPDATE."""
+    return queryset.update(**{
+        field: F(field) + delta for field, delta in deltas.items()})
+
+
+def actual_count(counter):
+    return Coalesce(Subquery(
+        counter.source.objects.filter(
+            **{counter.source_field: OuterRef('pk')}
+        ).order_by().values(counter.source_field).annotate(
+            total=Count('pk')).values('total')), 0)
+
+
+def recount(counter, dry_run=False):
+    """
+    Находит строки, где счетчик разошелся с реальным числом связей, и
+    исправляет их одним UPDATE. Возвращает число таких строк.
+    """
+    drifted = counter.model.objects.exclude(
+        **{counter.field: actual_count(counter)})
+    if dry_run:
+        return drifted.count()
+    return drifted.update(**{counter.field: actual_count(counter)})
+
+
+def recount_all(dry_run=False):
+    return {f'{counter.model._meta.model_name}.{counter.field}':
+            recount(counter, dry_run) for counter in COUNTERS}
@@ -0,0 +1,123 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from recipes import shopping_list
+from recipes.models import ShoppingListExport
+
+STALE_ERROR = 'Обработчик не завершил выгрузку вовремя.'
+
+
+@lru_cache(maxsize=None)
+def get_executor():
+    """Пул потоков для выгрузок, если он включен в настройках."""
+    if not settings.SHOPPING_LIST_EXPORT_WORKERS:
+        return None
+    return ThreadPoolExecutor(
+        max_workers=settings.SHOPPING_LIST_EXPORT_WORKERS,
+        thread_name_prefix='shopping-list-export')
+
+
+def create_export(user, export_format):
+    """
+    Ставит выгрузку списка покупок в очередь. Без пула потоков задачу
+    выполнит команда process_shopping_list_exports.
+    """
+    export = ShoppingListExport.objects.create(
+        user=user, format=export_format)
+    executor = get_executor()
+    if executor is not None:
+        transaction.on_commit(
+            lambda: executor.submit(run_in_thread, export.id))
+    return export
+
+
+def claim(export_id):
+    """Забирает задачу в работу, если ее еще не забрал другой обработчик."""
+    return ShoppingListExport.objects.filter(
+        id=export_id, status=ShoppingListExport.PENDING
+    ).update(status=ShoppingListExport.RUNNING, started=timezone.now()) == 1
+
+
+def process(export_id):
+    """Рисует файл выгрузки и сохраняет его в базу."""
+    if not claim(export_id):
+        return False
+    export = ShoppingListExport.objects.select_related('user').get(
+        id=export_id)
+    try:
+        export.document = shopping_list.get_document(
+            export.format, shopping_list.get_cart_items(export.user))
+        export.status = ShoppingListExport.DONE
+    except Exception as error:
+        export.error = repr(error)
+        export.status = ShoppingListExport.FAILED
+    export.finished = timezone.now()
+    export.save(update_fields=('document', 'error', 'status', 'finished'))
+    return True
+
+
+def run_in_thread(export_id):
+    close_old_connections()
+    try:
+        process(export_id)
+        # Без команды process_shopping_list_exports очередь чистит пул.
+        fail_stale()
+        purge_expired()
+    finally:
+        close_old_connections()
+
+
+def process_pending(limit=None):
+    """Обрабатывает задачи из очереди по порядку поступления."""
+    pending = ShoppingListExport.objects.filter(
+        status=ShoppingListExport.PENDING).order_by('id').values_list(
+        'id', flat=True)
+    if limit is not None:
+        pending = pending[:limit]
+    return sum(process(export_id) for export_id in list(pending))
+
+
+def stale_before():
+    return timezone.now() - timedelta(
+        seconds=settings.SHOPPING_LIST_EXPORT_CLAIM_TIMEOUT)
+
+
+def fail_stale():
+    """
+    Завершает ошибкой задачи, которые обработчик забрал, но не закончил
+    за SHOPPING_LIST_EXPORT_CLAIM_TIMEOUT: скорее всего, он упал.
+    """
+    return ShoppingListExport.objects.filter(
+        status=ShoppingListExport.RUNNING, started__lt=stale_before()
+    ).update(status=ShoppingListExport.FAILED, error=STALE_ERROR,
+             finished=timezone.now())
+
+
+def is_stale(export):
+    return (export.status == ShoppingListExport.RUNNING
+            and export.started is not None
+            and export.started < stale_before())
+
+
+def purge_expired():
+    """
+    Удаляет выгрузки, готовые раньше SHOPPING_LIST_EXPORT_TTL, и
+    незавершенные, созданные раньше этого срока.
+    """
+    expired = timezone.now() - timedelta(
+        seconds=settings.SHOPPING_LIST_EXPORT_TTL)
+    deleted, _ = ShoppingListExport.objects.filter(
+        Q(finished__lt=expired)
+        | Q(finished__isnull=True, created__lt=expired)).delete()
+    return deleted
+
+
+def is_expired(export):
+    return (export.finished or export.created) < timezone.now() - timedelta(
+        seconds=settings.SHOPPING_LIST_EXPORT_TTL)
@@ -0,0 +1,152 @@
+import io
+import os
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from django.db.models import F, Q
+from PIL import Image
+
+from recipes.models import Recipe
+from recipes.versions import bump_version, recipe_version
+
+Variant = namedtuple('Variant', 'name size')
+Encoding = namedtuple('Encoding', 'name extension options')
+
+# Варианты идут от большего к меньшему: каждый следующий уменьшается
+# из предыдущего, а не из оригинала.
+VARIANTS = (
+    Variant('full', (1280, 1280)),
+    Variant('card', (600, 600)),
+    Variant('thumbnail', (200, 200)),
+)
+ENCODINGS = (
+    Encoding('jpeg', 'jpg', {'format': 'JPEG', 'quality': 85,
+                             'optimize': True, 'progressive': True}),
+    Encoding('webp', 'webp', {'format': 'WEBP', 'quality': 80,
+                              'method': 4}),
+)
+VARIANTS_DIR = 'media/recipe/variants'
+
+
+class ImageTooLarge(ValueError):
+    pass
+
+
+@lru_cache(maxsize=None)
+def get_executor():
+    """Пул потоков для обработки изображений, если он включен."""
+    if not settings.IMAGE_PROCESSING_WORKERS:
+        return None
+    return ThreadPoolExecutor(
+        max_workers=settings.IMAGE_PROCESSING_WORKERS,
+        thread_name_prefix='recipe-images')
+
+
+def variant_name(image_name, variant, encoding):
+    stem = os.path.splitext(os.path.basename(image_name))[0]
+    return (f'{VARIANTS_DIR}/{stem}-{variant.name}.'
+            f'{encoding.extension}')
+
+
+def variant_urls(recipe):
+    """
+    Адреса вариантов изображения рецепта или None, пока они не готовы
+    для текущего изображения.
+    """
+    return image_variant_urls(recipe.image.name, recipe.processed_image)
+
+
+def image_variant_urls(image_name, processed_image):
+    """То же по имени файла изображения и полю processed_image."""
+    if not image_name or processed_image != image_name:
+        return None
+    return {
+        variant.name: {
+            encoding.name: default_storage.url(
+                variant_name(image_name, variant, encoding))
+            for encoding in ENCODINGS}
+        for variant in VARIANTS}
+
+
+def open_image(stream):
+    """
+    Открывает изображение, проверив размер по заголовку до декодирования.
+    JPEG сразу декодируется в уменьшенном масштабе.
+    """
+    image = Image.open(stream)
+    width, height = image.size
+    if width * height > settings.IMAGE_MAX_PIXELS:
+        raise ImageTooLarge(f'{width}x{height} pixels')
+    image.draft('RGB', VARIANTS[0].size)
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def render_variants(stream):
+    """
+    Декодирует изображение один раз и кодирует все варианты. Метаданные
+    (EXIF и прочее) в новые файлы не переносятся.
+    """
+    image = open_image(stream)
+    for variant in VARIANTS:
+        image.thumbnail(variant.size, Image.LANCZOS)
+        for encoding in ENCODINGS:
+            buffer = io.BytesIO()
+            image.save(buffer, **encoding.options)
+            yield variant, encoding, buffer.getvalue()
+
+
+def process(recipe_id):
+    """Строит варианты текущего изображения рецепта."""
+    recipe = Recipe.objects.only('image', 'processed_image').get(
+        id=recipe_id)
+    image_name = recipe.image.name
+    if not image_name or recipe.processed_image == image_name:
+        return False
+    with recipe.image.open('rb') as stream:
+        for variant, encoding, content in render_variants(stream):
+            name = variant_name(image_name, variant, encoding)
+            if default_storage.exists(name):
+                default_storage.delete(name)
+            default_storage.save(name, ContentFile(content))
+    # Изображение могли заменить, пока шла обработка.
+    updated = Recipe.objects.filter(id=recipe_id, image=image_name).update(
+        processed_image=image_name)
+    if updated:
+        bump_version(recipe_version(recipe_id), 'recipes')
+    return bool(updated)
+
+
+def run_in_thread(recipe_id):
+    close_old_connections()
+    try:
+        process(recipe_id)
+    finally:
+        close_old_connections()
+
+
+def schedule(recipe):
+    """
+    Ставит обработку изображения в пул потоков. Без пула изображения
+    обработает команда process_recipe_images.
+    """
+    executor = get_executor()
+    if executor is not None and recipe.image:
+        transaction.on_commit(
+            lambda: executor.submit(run_in_thread, recipe.id))
+
+
+def pending():
+    """Рецепты, для текущего изображения которых нет вариантов."""
+    return Recipe.objects.exclude(
+        Q(image='') | Q(image__isnull=True)
+        | Q(processed_image=F('image'))).order_by('id')
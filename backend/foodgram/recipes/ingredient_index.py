@@ -0,0 +1,64 @@
+import threading
+from bisect import bisect_left
+
+from recipes.models import Ingredient
+from recipes.versions import get_version
+
+MAX_CHAR = '\U0010ffff'
+
+
+def normalize(name):
+    """Ключ поиска: без учета регистра и различий между «е» и «ё»."""
+    return name.strip().casefold().replace('ё', 'е')
+
+
+class IngredientIndex:
+    """
+    Отсортированный по ключу поиска список ингредиентов в памяти
+    процесса. Перестраивается, когда меняется версия ingredients.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = None
+        self.entries = ([], [])
+
+    def build(self):
+        rows = sorted(
+            ({'id': pk, 'name': name, 'measurement_unit': measurement_unit}
+             for pk, name, measurement_unit in Ingredient.objects.values_list(
+                 'id', 'name', 'measurement_unit').order_by()),
+            key=lambda row: (normalize(row['name']), row['id']))
+        self.entries = ([normalize(row['name']) for row in rows], rows)
+
+    def refresh(self):
+        version = get_version('ingredients')
+        if version == self.version:
+            return
+        with self.lock:
+            if version != self.version:
+                self.build()
+                self.version = version
+
+    def search(self, query, limit=None):
+        """
+        Ингредиенты, название которых начинается с query, а за ними те,
+        что содержат query в середине названия.
+        """
+        self.refresh()
+        keys, rows = self.entries
+        query = normalize(query)
+        if not query:
+            return rows[:limit]
+        start = bisect_left(keys, query)
+        end = bisect_left(keys, query + MAX_CHAR, start)
+        found = rows[start:end][:limit]
+        if limit is not None and len(found) >= limit:
+            return found
+        found.extend(
+            row for key, row in zip(keys, rows)
+            if query in key and not key.startswith(query))
+        return found[:limit]
+
+
+ingredient_index = IngredientIndex()
@@ -0,0 +1,271 @@
+import json
+import math
+import subprocess
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from recipes import synthetic
+from recipes.models import (FavoriteRecipe, Ingredient, Recipe,
+                            RecipeIngredient, ShoppingCart, Subscribe, Tag)
+
+User = get_user_model()
+
+# setup выполняется перед каждым замером и не учитывается: так
+# переключатели избранного, корзины и подписки не меняют состояние базы.
+Scenario = namedtuple(
+    'Scenario', 'name method url setup anonymous', defaults=(None, False))
+
+SCENARIOS = (
+    Scenario('recipes', 'get', '/api/recipes/'),
+    Scenario('recipes anonymous', 'get', '/api/recipes/', anonymous=True),
+    Scenario('recipes all fields', 'get', '/api/recipes/?fields=all'),
+    Scenario('recipes id and name', 'get', '/api/recipes/?fields=id,name'),
+    Scenario('recipes by tags', 'get', '/api/recipes/?tags={tag}'),
+    Scenario('recipes by author', 'get', '/api/recipes/?author={author}'),
+    Scenario('recipes favorited', 'get', '/api/recipes/?is_favorited=1'),
+    Scenario('recipes in cart', 'get', '/api/recipes/?is_in_shopping_cart=1'),
+    Scenario('recipes popular', 'get', '/api/recipes/?ordering=popular'),
+    Scenario('recipes cursor', 'get', '/api/recipes/?cursor='),
+    Scenario('recipes search', 'get', '/api/recipes/?search={word}'),
+    Scenario('recipes with ingredients', 'get',
+             '/api/recipes/?ingredients={ingredient}'),
+    Scenario('recipe', 'get', '/api/recipes/{recipe}/'),
+    Scenario('recipe match', 'get',
+             '/api/recipes/match/?ingredients={ingredient}'
+             '&ingredients={other_ingredient}'),
+    Scenario('tags', 'get', '/api/tags/'),
+    Scenario('ingredients search', 'get',
+             '/api/ingredients/?name={ingredient_prefix}'),
+    Scenario('users', 'get', '/api/users/'),
+    Scenario('user', 'get', '/api/users/{author}/'),
+    Scenario('me', 'get', '/api/users/me/'),
+    Scenario('subscriptions', 'get',
+             '/api/users/subscriptions/?recipes_limit=3'),
+    Scenario('subscribe', 'post', '/api/users/{new_author}/subscribe/',
+             ('delete', '/api/users/{new_author}/subscribe/')),
+    Scenario('unsubscribe', 'delete', '/api/users/{new_author}/subscribe/',
+             ('post', '/api/users/{new_author}/subscribe/')),
+    Scenario('favorite add', 'post', '/api/recipes/{new_recipe}/favorite/',
+             ('delete', '/api/recipes/{new_recipe}/favorite/')),
+    Scenario('favorite remove', 'delete',
+             '/api/recipes/{new_recipe}/favorite/',
+             ('post', '/api/recipes/{new_recipe}/favorite/')),
+    Scenario('cart add', 'post', '/api/recipes/{new_recipe}/shopping_cart/',
+             ('delete', '/api/recipes/{new_recipe}/shopping_cart/')),
+    Scenario('cart remove', 'delete',
+             '/api/recipes/{new_recipe}/shopping_cart/',
+             ('post', '/api/recipes/{new_recipe}/shopping_cart/')),
+    Scenario('download shopping cart', 'get',
+             '/api/recipes/download_shopping_cart/?format=txt'),
+)
+
+
+def percentile(values, percent):
+    """Перцентиль по ближайшему рангу для отсортированного списка."""
+    rank = max(math.ceil(percent / 100 * len(values)), 1)
+    return values[rank - 1]
+
+
+def current_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+            capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = ('Seeds a synthetic dataset if needed and measures latency '
+            'percentiles, queries per request and throughput of the API '
+            'endpoints in-process, optionally writing a JSON report')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--users', type=int, default=1000,
+            help='Users to create when the database has to be seeded')
+        parser.add_argument(
+            '--recipes', type=int, default=10000,
+            help='Seed the database up to this number of recipes')
+        parser.add_argument('--favorites', type=int, default=20)
+        parser.add_argument('--carts', type=int, default=5)
+        parser.add_argument('--subscriptions', type=int, default=10)
+        parser.add_argument(
+            '--requests', type=int, default=50,
+            help='Measured requests per endpoint')
+        parser.add_argument('--warmup', type=int, default=5)
+        parser.add_argument(
+            '--concurrency', type=int, default=1,
+            help='Threads for the throughput run of read-only endpoints')
+        parser.add_argument(
+            '--only', nargs='+', default=(),
+            help='Names of the endpoints to measure')
+        parser.add_argument('--output', help='Write the JSON report here')
+        parser.add_argument(
+            '--compare', help='Print the p50 change against this report')
+
+    def seed(self, options):
+        missing = options['recipes'] - Recipe.objects.count()
+        if missing <= 0:
+            return
+        self.stdout.write(f'Seeding {missing} recipes...')
+        synthetic.seed(
+            users=options['users'], recipes=missing,
+            favorites=options['favorites'], carts=options['carts'],
+            subscriptions=options['subscriptions'])
+
+    def get_context(self):
+        """Пользователь для запросов и значения для адресов сценариев."""
+        user_id = Subscribe.objects.values_list('user_id', flat=True).first()
+        if user_id is None:
+            raise CommandError('Seed the database first (--recipes)')
+        user = User.objects.get(id=user_id)
+        ingredients = list(RecipeIngredient.objects.order_by(
+            'recipe_id').values_list('ingredient_id', flat=True)[:2])
+        name = Ingredient.objects.values_list('name', flat=True).get(
+            id=ingredients[0])
+        return user, {
+            'author': Recipe.objects.values_list(
+                'author_id', flat=True).first(),
+            'recipe': Recipe.objects.values_list('id', flat=True).first(),
+            'tag': Tag.objects.values_list('slug', flat=True).first(),
+            'word': Recipe.objects.values_list('name', flat=True).first(
+            ).split()[-1],
+            'ingredient': ingredients[0],
+            'other_ingredient': ingredients[-1],
+            'ingredient_prefix': name[:3],
+            'new_author': User.objects.exclude(id=user.id).exclude(
+                following__user=user).values_list('id', flat=True).first(),
+            'new_recipe': Recipe.objects.exclude(
+                id__in=FavoriteRecipe.objects.filter(user=user).values(
+                    'recipe__id')).exclude(
+                id__in=ShoppingCart.objects.filter(user=user).values(
+                    'recipe__id')).values_list('id', flat=True).first(),
+        }
+
+    def request(self, client, method, url):
+        response = getattr(client, method)(url)
+        if response.status_code >= 400:
+            raise CommandError(
+                f'{method.upper()} {url}: HTTP {response.status_code}')
+        # Потоковые ответы читаются целиком, как их читал бы клиент.
+        if response.streaming:
+            b''.join(response.streaming_content)
+        return response
+
+    def measure(self, scenario, client, context, options):
+        url = scenario.url.format(**context)
+        setup = scenario.setup and (
+            scenario.setup[0], scenario.setup[1].format(**context))
+        latencies = []
+        queries = 0
+        for number in range(options['warmup'] + options['requests']):
+            if setup:
+                client.generic(setup[0].upper(), setup[1])
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                self.request(client, scenario.method, url)
+                elapsed = time.perf_counter() - started
+            if number >= options['warmup']:
+                latencies.append(elapsed * 1000)
+                queries += len(captured.captured_queries)
+        latencies.sort()
+        return {
+            'name': scenario.name,
+            'method': scenario.method.upper(),
+            'url': url,
+            'requests': len(latencies),
+            'queries': queries / len(latencies),
+            'mean_ms': sum(latencies) / len(latencies),
+            'p50_ms': percentile(latencies, 50),
+            'p90_ms': percentile(latencies, 90),
+            'p99_ms': percentile(latencies, 99),
+            'rps': len(latencies) / sum(latencies) * 1000,
+        }
+
+    def throughput(self, scenario, user, context, options):
+        """Запросов в секунду при нескольких потоках одновременно."""
+        url = scenario.url.format(**context)
+        threads = options['concurrency']
+
+        def worker(count):
+            client = APIClient()
+            if not scenario.anonymous:
+                client.force_authenticate(user)
+            try:
+                for _ in range(count):
+                    self.request(client, scenario.method, url)
+            finally:
+                connections.close_all()
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(threads) as executor:
+            list(executor.map(
+                worker, [options['requests']] * threads))
+        return options['requests'] * threads / (
+            time.perf_counter() - started)
+
+    def handle(self, *args, **options):
+        self.seed(options)
+        user, context = self.get_context()
+        scenarios = [
+            scenario for scenario in SCENARIOS
+            if not options['only'] or scenario.name in options['only']]
+        results = []
+        self.stdout.write(
+            f'{"endpoint":>26} {"queries":>7} {"p50 ms":>8} {"p90 ms":>8} '
+            f'{"p99 ms":>8} {"req/s":>8}')
+        for scenario in scenarios:
+            client = APIClient()
+            if not scenario.anonymous:
+                client.force_authenticate(user)
+            result = self.measure(scenario, client, context, options)
+            if options['concurrency'] > 1 and scenario.method == 'get':
+                result['rps'] = self.throughput(
+                    scenario, user, context, options)
+            results.append(result)
+            self.stdout.write(
+                f'{result["name"]:>26} {result["queries"]:>7.1f} '
+                f'{result["p50_ms"]:>8.2f} {result["p90_ms"]:>8.2f} '
+                f'{result["p99_ms"]:>8.2f} {result["rps"]:>8.1f}')
+        report = {
+            'created': timezone.now().isoformat(),
+            'commit': current_commit(),
+            'database': connection.vendor,
+            'recipes': Recipe.objects.count(),
+            'users': User.objects.count(),
+            'requests': options['requests'],
+            'concurrency': options['concurrency'],
+            'results': results,
+        }
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump(report, file, indent=2)
+        if options['compare']:
+            self.compare(report, options['compare'])
+
+    def compare(self, report, path):
+        with open(path) as file:
+            previous = json.load(file)
+        self.stdout.write(
+            f'Against {path} (commit {previous["commit"] or "?"}):')
+        previous = {
+            result['name']: result for result in previous['results']}
+        for result in report['results']:
+            old = previous.get(result['name'])
+            if old is None:
+                continue
+            change = (result['p50_ms'] / old['p50_ms'] - 1) * 100
+            self.stdout.write(
+                f'{result["name"]:>26} {old["p50_ms"]:>8.2f} -> '
+                f'{result["p50_ms"]:>8.2f} ms ({change:+.0f}%), queries '
+                f'{old["queries"]:.1f} -> {result["queries"]:.1f}')
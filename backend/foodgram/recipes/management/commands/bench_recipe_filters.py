@@ -0,0 +1,78 @@
+import timeit
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.http import QueryDict
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from api.filters import RecipeFilter
+from recipes import synthetic
+from recipes.models import Recipe, Tag
+
+User = get_user_model()
+PAGE_SIZE = 6
+
+
+def legacy_queryset(params, user):
+    """Фильтрация соединениями, как до перехода на подзапросы Exists."""
+    queryset = Recipe.objects.all()
+    if params.get('is_favorited'):
+        queryset = queryset.filter(favorite_recipe__user=user)
+    if params.get('is_in_shopping_cart'):
+        queryset = queryset.filter(cart__user=user)
+    if params.get('author'):
+        queryset = queryset.filter(author__id=params['author'])
+    if not params.getlist('tags'):
+        return queryset
+    return queryset.filter(tags__slug__in=params.getlist('tags')).distinct()
+
+
+class Command(BaseCommand):
+    help = ('Compares the recipe filters with the legacy join-based '
+            'filtering on a seeded database')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--recipes', type=int, default=100000,
+            help='Seed the database up to this number of recipes')
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        missing = options['recipes'] - Recipe.objects.count()
+        if missing > 0:
+            self.stdout.write(f'Seeding {missing} recipes...')
+            synthetic.seed(users=1000, recipes=missing)
+        user = User.objects.filter(
+            favorite_recipe__recipe__isnull=False).first()
+        author = Recipe.objects.values_list('author_id', flat=True).first()
+        slugs = list(Tag.objects.values_list('slug', flat=True)[:2])
+        cases = {
+            'tags=1': f'tags={slugs[0]}',
+            'tags=2': f'tags={slugs[0]}&tags={slugs[1]}',
+            'author': f'author={author}',
+            'is_favorited': 'is_favorited=1',
+            'is_in_shopping_cart': 'is_in_shopping_cart=1',
+            'favorited+tags=2': (
+                f'is_favorited=1&tags={slugs[0]}&tags={slugs[1]}'),
+        }
+        self.stdout.write(
+            f'{"filter":>20} {"rows":>8} {"exists ms":>10} {"legacy ms":>10}')
+        for name, query in cases.items():
+            params = QueryDict(query)
+            request = Request(APIRequestFactory().get('/', params))
+            request.user = user
+            current = RecipeFilter(
+                params, queryset=Recipe.objects.all(), request=request).qs
+            legacy = legacy_queryset(params, user)
+            self.stdout.write(
+                f'{name:>20} {current.count():>8} '
+                f'{self.measure(current, options["repeat"]):>10.2f} '
+                f'{self.measure(legacy, options["repeat"]):>10.2f}')
+
+    def measure(self, queryset, repeat):
+        """Время подсчета и выборки первой страницы, в миллисекундах."""
+        def run():
+            queryset.count()
+            list(queryset[:PAGE_SIZE])
+        return min(timeit.repeat(run, number=1, repeat=repeat)) * 1000
@@ -0,0 +1,80 @@
+import random
+import sys
+import time
+import timeit
+
+from django.core.management.base import BaseCommand
+from django.db.models import Count, ExpressionWrapper, F, FloatField, Q
+
+from recipes import synthetic
+from recipes.models import Recipe, RecipeIngredient
+from recipes.recipe_matcher import RecipeMatcher, record_change
+
+LIMIT = 20
+
+
+def sql_match(ingredient_ids, limit=LIMIT):
+    """Тот же подбор группировкой RecipeIngredient в базе."""
+    return list(RecipeIngredient.objects.order_by().values(
+        'recipe_id'
+    ).annotate(
+        matched=Count('id', filter=Q(ingredient_id__in=ingredient_ids)),
+        total=Count('id'),
+    ).filter(matched__gt=0).annotate(
+        coverage=ExpressionWrapper(
+            F('matched') * 1.0 / F('total'), output_field=FloatField())
+    ).order_by('-coverage', '-matched', '-recipe_id').values_list(
+        'recipe_id', flat=True)[:limit])
+
+
+class Command(BaseCommand):
+    help = ('Measures the in-memory ingredient matcher (build, incremental '
+            'update, queries) against the same ranking done in SQL')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--recipes', type=int, default=100000,
+            help='Seed the database up to this number of recipes')
+        parser.add_argument(
+            '--sizes', type=int, nargs='+', default=[3, 10, 30],
+            help='Numbers of ingredients the user has')
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        missing = options['recipes'] - Recipe.objects.count()
+        if missing > 0:
+            self.stdout.write(f'Seeding {missing} recipes...')
+            synthetic.seed(users=1000, recipes=missing)
+        matcher = RecipeMatcher()
+        started = time.perf_counter()
+        matcher.refresh()
+        postings, sizes = matcher.index
+        memory = sys.getsizeof(sizes) + sum(
+            sys.getsizeof(recipe_ids) for recipe_ids in postings.values())
+        self.stdout.write(
+            f'build: {(time.perf_counter() - started) * 1000:.0f} ms, '
+            f'{len(postings)} ingredients, {memory / 2 ** 20:.1f} MiB')
+        recipe_id = Recipe.objects.values_list('id', flat=True).last()
+        record_change(recipe_id)
+        started = time.perf_counter()
+        matcher.refresh()
+        self.stdout.write(
+            f'update of one recipe: '
+            f'{(time.perf_counter() - started) * 1000:.1f} ms')
+        random.seed(0)
+        self.stdout.write(
+            f'{"ingredients":>12} {"matched":>8} {"memory ms":>10} '
+            f'{"sql ms":>10}')
+        for size in options['sizes']:
+            ingredient_ids = random.sample(list(postings), size)
+            count, _ = matcher.match(ingredient_ids, LIMIT)
+            memory_ms = self.measure(matcher.match, ingredient_ids, options)
+            sql_ms = self.measure(sql_match, ingredient_ids, options)
+            self.stdout.write(
+                f'{size:>12} {count:>8} {memory_ms:>10.2f} {sql_ms:>10.2f}')
+
+    def measure(self, function, ingredient_ids, options):
+        """Лучшее время подбора первых LIMIT рецептов, в миллисекундах."""
+        return min(timeit.repeat(
+            lambda: function(ingredient_ids, LIMIT),
+            number=1, repeat=options['repeat'])) * 1000
@@ -0,0 +1,135 @@
+import timeit
+from collections import namedtuple
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Prefetch
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from api.fast_serializers import (RECIPE_FIELDS, SUBSCRIPTION_FIELDS,
+                                  FastRecipeSerializer,
+                                  FastSubscriptionSerializer)
+from api.renderers import FastJSONRenderer
+from api.serializers import RecipeSerializer, SubscriptionSerializer
+from api.views import SubscriptionsView
+from recipes import synthetic
+from recipes.models import Recipe, Subscribe
+
+User = get_user_model()
+
+# drf и fast строят (сериализатор, queryset, контекст) для одной и той
+# же выборки.
+Case = namedtuple('Case', 'name path drf fast')
+
+
+def recipes_case(limit):
+    def recipes():
+        return Recipe.objects.order_by('-pub_date', '-id')
+
+    def drf(request):
+        return RecipeSerializer, recipes().with_related()[:limit], {}
+
+    def fast(request):
+        return FastRecipeSerializer, recipes().values(
+            *RECIPE_FIELDS)[:limit], {}
+
+    return Case('recipes', '/api/recipes/', drf, fast)
+
+
+def subscriptions_case(limit):
+    def users(request):
+        return User.objects.filter(
+            following__user=request.user).order_by('-following__id')
+
+    def drf(request):
+        recipes = SubscriptionsView(request=request).get_preview_recipes()
+        return SubscriptionSerializer, users(request).prefetch_related(
+            Prefetch('recipes', queryset=recipes, to_attr='preview_recipes')
+        )[:limit], {}
+
+    def fast(request):
+        recipes = SubscriptionsView(request=request).get_preview_recipes()
+        return FastSubscriptionSerializer, users(request).values(
+            *SUBSCRIPTION_FIELDS)[:limit], {'preview_recipes': recipes}
+
+    return Case('subscriptions', '/api/users/subscriptions/?recipes_limit=3',
+                drf, fast)
+
+
+class Command(BaseCommand):
+    help = ('Checks that the fast read serializers and the orjson renderer '
+            'produce byte-identical JSON to the DRF serializers and '
+            'measures the cost per item of both paths')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--recipes', type=int, default=1000,
+            help='Seed the database up to this number of recipes')
+        parser.add_argument(
+            '--items', type=int, default=100,
+            help='Objects serialized at once, like a page of the API')
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def make_request(self, user, path):
+        request = Request(APIRequestFactory().get(path))
+        request.user = user
+        return request
+
+    def render(self, build, renderer, request):
+        serializer_class, queryset, context = build(request)
+        data = serializer_class(
+            queryset, many=True, context={'request': request, **context}).data
+        return renderer.render(data), len(data)
+
+    def compare(self, case, drf, fast):
+        """Ответы обоих путей совпадают побайтно, иначе ошибка."""
+        if drf == fast:
+            return
+        position = next(
+            (index for index, (left, right) in enumerate(zip(drf, fast))
+             if left != right), min(len(drf), len(fast)))
+        start = max(position - 80, 0)
+        raise CommandError(
+            f'{case.name}: fast output differs at byte {position}:\n'
+            f'drf:  {drf[start:position + 80]!r}\n'
+            f'fast: {fast[start:position + 80]!r}')
+
+    def measure(self, build, renderer, user, path, options):
+        """Лучшее время на один объект, в микросекундах."""
+        best = min(timeit.repeat(
+            lambda: self.render(build, renderer, self.make_request(
+                user, path)),
+            number=1, repeat=options['repeat']))
+        _, count = self.render(build, renderer, self.make_request(user, path))
+        return best / max(count, 1) * 10 ** 6, count
+
+    def handle(self, *args, **options):
+        missing = options['recipes'] - Recipe.objects.count()
+        if missing > 0:
+            self.stdout.write(f'Seeding {missing} recipes...')
+            synthetic.seed(users=100, recipes=missing)
+        user_id = Subscribe.objects.values_list('user_id', flat=True).first()
+        if user_id is None:
+            raise CommandError('Seed the database first (--recipes)')
+        user = User.objects.get(id=user_id)
+        drf_renderer, fast_renderer = JSONRenderer(), FastJSONRenderer()
+        self.stdout.write(
+            f'{"endpoint":>14} {"items":>6} {"drf us/item":>12} '
+            f'{"fast us/item":>13} {"speedup":>8}')
+        for case in (recipes_case(options['items']),
+                     subscriptions_case(options['items'])):
+            request = self.make_request(user, case.path)
+            drf, _ = self.render(case.drf, drf_renderer, request)
+            request = self.make_request(user, case.path)
+            fast, _ = self.render(case.fast, fast_renderer, request)
+            self.compare(case, drf, fast)
+            drf_cost, count = self.measure(
+                case.drf, drf_renderer, user, case.path, options)
+            fast_cost, _ = self.measure(
+                case.fast, fast_renderer, user, case.path, options)
+            self.stdout.write(
+                f'{case.name:>14} {count:>6} {drf_cost:>12.1f} '
+                f'{fast_cost:>13.1f} {drf_cost / fast_cost:>7.1f}x')
+        self.stdout.write('Fast output is byte-identical to DRF output.')
@@ -0,0 +1,35 @@
+import timeit
+
+from django.core.management.base import BaseCommand
+
+from recipes import shopping_list
+
+
+class Command(BaseCommand):
+    help = ('Compares render time and size of the shopping list '
+            'in every registered format')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', type=int, nargs='+', default=[10, 100, 1000],
+            help='Numbers of lines in the generated shopping lists')
+        parser.add_argument(
+            '--repeat', type=int, default=5,
+            help='Number of renders per format and size')
+
+    def handle(self, *args, **options):
+        self.stdout.write(
+            f'{"lines":>6} {"format":>6} {"ms/render":>10} {"bytes":>10}')
+        for size in options['sizes']:
+            items = [
+                {'ingredient__name': f'ингредиент {number}',
+                 'ingredient__measurement_unit': 'г',
+                 'ingredient_total': number}
+                for number in range(size)]
+            for name, renderer in shopping_list.RENDERERS.items():
+                seconds = min(timeit.repeat(
+                    lambda: renderer.render(items),
+                    number=1, repeat=options['repeat']))
+                self.stdout.write(
+                    f'{size:>6} {name:>6} {seconds * 1000:>10.2f} '
+                    f'{len(renderer.render(items)):>10}')
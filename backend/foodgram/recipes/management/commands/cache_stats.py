@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from api.cache import get_counters
+
+
+class Command(BaseCommand):
+    help = 'Shows hit and miss counters of the shared caches'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'names', nargs='*', default=['recipes'],
+            help='Cache names, e.g. recipes')
+
+    def handle(self, *args, **options):
+        for name in options['names']:
+            counters = get_counters(f'{name}:hits', f'{name}:misses')
+            hits = counters[f'{name}:hits']
+            total = hits + counters[f'{name}:misses']
+            rate = hits / total * 100 if total else 0
+            self.stdout.write(
+                f'{name}: {hits} hits / {total} requests ({rate:.1f}%)')
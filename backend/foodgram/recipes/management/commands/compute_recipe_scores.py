@@ -0,0 +1,17 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from recipes import scores
+
+
+class Command(BaseCommand):
+    help = ('Recomputes popular and trending recipe scores from the '
+            'favorite and shopping cart counters')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        total = scores.compute()
+        self.stdout.write(self.style.SUCCESS(
+            f'Scored {total} recipes in '
+            f'{time.perf_counter() - started:.2f}s'))
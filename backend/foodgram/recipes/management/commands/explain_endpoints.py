@@ -0,0 +1,65 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from rest_framework.test import APIClient
+
+from recipes import synthetic
+from recipes.models import Recipe
+from recipes.query_plans import (ENDPOINTS, check_endpoint, endpoint_context,
+                                 table_sizes)
+
+
+class Command(BaseCommand):
+    help = ('Runs the hot API endpoints against the current (seeded) '
+            'PostgreSQL database, captures EXPLAIN for every query and '
+            'fails if a large table is read with a sequential scan')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--recipes', type=int, default=0,
+            help='Seed the database up to this number of recipes first')
+        parser.add_argument(
+            '--min-rows', type=int, default=10000,
+            help='Sequential scans of smaller tables are ignored')
+        parser.add_argument(
+            '--verbose-plans', action='store_true',
+            help='Print the plan of every query')
+
+    def print_plan(self, plan):
+        self.stdout.write(json.dumps(plan, indent=1))
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('EXPLAIN checks need PostgreSQL')
+        missing = options['recipes'] - Recipe.objects.count()
+        if missing > 0:
+            self.stdout.write(f'Seeding {missing} recipes...')
+            synthetic.seed(users=1000, recipes=missing)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        found = endpoint_context()
+        if found is None:
+            raise CommandError('Seed the database first (--recipes)')
+        user, context = found
+        client = APIClient()
+        client.force_authenticate(user)
+        tables = {
+            table for table, rows in table_sizes().items()
+            if rows >= options['min_rows']}
+        on_plan = self.print_plan if options['verbose_plans'] else None
+        failed = 0
+        for name, url in ENDPOINTS:
+            try:
+                queries, problems = check_endpoint(
+                    client, url.format(**context), tables, on_plan)
+            except ValueError as error:
+                raise CommandError(error)
+            failed += bool(problems)
+            status = 'FAIL' if problems else 'ok'
+            self.stdout.write(f'{name:>20} {queries:>3} queries  {status}')
+            for problem in problems:
+                self.stdout.write(f'{"":>22}{problem}')
+        if failed:
+            raise CommandError(f'{failed} endpoints use sequential scans')
+        self.stdout.write(self.style.SUCCESS('No sequential scans found'))
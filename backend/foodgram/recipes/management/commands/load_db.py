@@ -1,19 +1,101 @@
 import csv
+import json
+import os
+import sys
+import time
 
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
 
 from recipes.models import Ingredient
+from recipes.versions import bump_version
+
+DEFAULT_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(__file__))),
+    'data', 'ingredients.csv')
+FORMATS = ('csv', 'json')
+
+
+def read_csv(stream):
+    for row in csv.reader(stream):
+        if len(row) >= 2:
+            yield row[0], row[1]
+
+
+def read_json(stream):
+    for item in json.load(stream):
+        yield item['name'], item['measurement_unit']
+
+
+READERS = {'csv': read_csv, 'json': read_json}
+
+
+def unique_pairs(rows):
+    """Убирает пробелы по краям и повторы, сохраняя порядок строк."""
+    pairs = {}
+    for name, unit in rows:
+        name, unit = name.strip(), unit.strip()
+        if name and unit:
+            pairs.setdefault((name, unit), None)
+    return list(pairs)
 
 
 class Command(BaseCommand):
-    help = 'Loads ingredients from a csv file'
+    help = ('Loads ingredients from a csv or json file in batches, '
+            'skipping ingredients that already exist')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path', nargs='?', default=DEFAULT_PATH,
+            help='Path to the file, "-" to read from stdin')
+        parser.add_argument(
+            '--format', choices=FORMATS,
+            help='File format, detected from the extension by default')
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Number of ingredients per INSERT')
+
+    def get_format(self, path, file_format):
+        if file_format:
+            return file_format
+        extension = os.path.splitext(path)[1].lstrip('.').lower()
+        if extension not in FORMATS:
+            raise CommandError(
+                'Cannot detect the file format, use --format')
+        return extension
+
+    def read(self, path, file_format):
+        reader = READERS[file_format]
+        if path == '-':
+            return list(reader(sys.stdin))
+        try:
+            with open(path, encoding='utf-8') as stream:
+                return list(reader(stream))
+        except (OSError, ValueError, KeyError) as error:
+            raise CommandError(f'Cannot read {path}: {error!r}')
 
     def handle(self, *args, **options):
-        with open('recipes/data/ingredients.csv', encoding='utf-8') as f:
-            reader = csv.reader(f)
-            for row in reader:
-                name, unit = row
-                Ingredient.objects.get_or_create(
-                    name=name, measurement_unit=unit)
-        self.stdout.write(
-            self.style.SUCCESS('Successfully loaded ingredients'))
+        path = options['path']
+        started = time.perf_counter()
+        rows = self.read(
+            path, self.get_format(path, options['format']))
+        pairs = unique_pairs(rows)
+        existing = set(Ingredient.objects.values_list(
+            'name', 'measurement_unit'))
+        new = [Ingredient(name=name, measurement_unit=unit)
+               for name, unit in pairs if (name, unit) not in existing]
+        # Пачка не может быть больше, чем позволяет база (у SQLite
+        # это 999 параметров на запрос).
+        batch_size = min(options['batch_size'], max(
+            connection.ops.bulk_batch_size(
+                ('name', 'measurement_unit'), new), 1))
+        with transaction.atomic():
+            Ingredient.objects.bulk_create(
+                new, batch_size=batch_size, ignore_conflicts=True)
+        if new:
+            bump_version('ingredients', 'recipes')
+        seconds = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Read {len(rows)} rows ({len(pairs)} unique), '
+            f'created {len(new)} ingredients in {seconds:.3f}s '
+            f'({len(rows) / max(seconds, 1e-6):.0f} rows/s)'))
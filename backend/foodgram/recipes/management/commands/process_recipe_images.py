@@ -0,0 +1,47 @@
+import time
+
+from django.core.management.base import BaseCommand
+from PIL import Image
+
+from recipes import images
+
+
+class Command(BaseCommand):
+    help = ('Builds resized JPEG and WebP variants for recipe images '
+            'that do not have them yet')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Process the current backlog and exit')
+        parser.add_argument(
+            '--interval', type=float, default=5.0,
+            help='Seconds to wait between polls')
+        parser.add_argument(
+            '--batch', type=int, default=20,
+            help='Maximum number of recipes taken per poll')
+
+    def process_batch(self, failed, batch):
+        processed = 0
+        recipe_ids = images.pending().exclude(id__in=failed).values_list(
+            'id', flat=True)[:batch]
+        for recipe_id in list(recipe_ids):
+            try:
+                processed += images.process(recipe_id)
+            except (OSError, ValueError,
+                    Image.DecompressionBombError) as error:
+                failed.add(recipe_id)
+                self.stderr.write(f'Recipe {recipe_id}: {error!r}')
+        return processed
+
+    def handle(self, *args, **options):
+        failed = set()
+        while True:
+            processed = self.process_batch(failed, options['batch'])
+            if processed:
+                self.stdout.write(f'Processed {processed} images')
+            if options['once'] and not processed:
+                break
+            if not processed:
+                time.sleep(options['interval'])
+        self.stdout.write(self.style.SUCCESS('Recipe images processed'))
@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from recipes import exports
+
+
+class Command(BaseCommand):
+    help = ('Renders queued shopping list exports and removes '
+            'expired results')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Process the current queue and exit')
+        parser.add_argument(
+            '--interval', type=float, default=1.0,
+            help='Seconds to wait between queue polls')
+        parser.add_argument(
+            '--batch', type=int, default=50,
+            help='Maximum number of exports taken per poll')
+
+    def handle(self, *args, **options):
+        while True:
+            failed = exports.fail_stale()
+            processed = exports.process_pending(options['batch'])
+            purged = exports.purge_expired()
+            if failed or processed or purged:
+                self.stdout.write(
+                    f'Processed {processed} exports, purged {purged}, '
+                    f'failed {failed} stale')
+            if options['once']:
+                break
+            if not processed:
+                time.sleep(options['interval'])
+        self.stdout.write(
+            self.style.SUCCESS('Shopping list exports processed'))
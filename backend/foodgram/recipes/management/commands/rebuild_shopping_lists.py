@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from recipes import cart_totals
+
+
+class Command(BaseCommand):
+    help = ('Compares the stored shopping list totals with the shopping '
+            'carts and rebuilds the lists of users that drifted')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Only report the number of drifted users')
+        parser.add_argument(
+            '--batch-size', type=int, default=cart_totals.BATCH_SIZE,
+            help='Users checked per query')
+
+    def handle(self, *args, **options):
+        drifted = cart_totals.rebuild(
+            options['dry_run'], options['batch_size'])
+        self.stdout.write(f'{drifted} users with drifted shopping lists')
+        self.stdout.write(self.style.SUCCESS('Shopping lists checked'))
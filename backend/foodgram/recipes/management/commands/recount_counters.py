@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from recipes import counters
+
+
+class Command(BaseCommand):
+    help = ('Recomputes denormalized favorite, shopping cart, recipe and '
+            'follower counters and repairs rows that drifted')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Only report the number of drifted rows')
+
+    def handle(self, *args, **options):
+        for name, drifted in counters.recount_all(
+                options['dry_run']).items():
+            self.stdout.write(f'{name}: {drifted} drifted rows')
+        self.stdout.write(self.style.SUCCESS('Counters checked'))
@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from recipes import synthetic
+
+
+class Command(BaseCommand):
+    help = 'Fills the database with a synthetic dataset using bulk inserts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--recipes', type=int, default=1000)
+        parser.add_argument('--ingredients', type=int, default=2000)
+        parser.add_argument('--ingredients-per-recipe', type=int, default=8)
+        parser.add_argument('--favorites', type=int, default=20,
+                            help='Favorite recipes per new user')
+        parser.add_argument('--carts', type=int, default=5,
+                            help='Recipes in the cart of every new user')
+        parser.add_argument('--subscriptions', type=int, default=10,
+                            help='Followed authors per new user')
+        parser.add_argument('--random-seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        created = synthetic.seed(
+            users=options['users'],
+            recipes=options['recipes'],
+            ingredients=options['ingredients'],
+            ingredients_per_recipe=options['ingredients_per_recipe'],
+            favorites=options['favorites'],
+            carts=options['carts'],
+            subscriptions=options['subscriptions'],
+            random_seed=options['random_seed'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Created {created["users"]} users and {created["recipes"]} '
+            f'recipes in {time.perf_counter() - started:.1f}s'))
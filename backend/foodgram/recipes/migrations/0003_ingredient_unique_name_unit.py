@@ -0,0 +1,42 @@
+# Generated by Django 3.0.5 on 2026-10-18 17:29
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def merge_duplicate_ingredients(apps, schema_editor):
+    Ingredient = apps.get_model('recipes', 'Ingredient')
+    RecipeIngredient = apps.get_model('recipes', 'RecipeIngredient')
+    duplicates = Ingredient.objects.values(
+        'name', 'measurement_unit').annotate(
+        keep_id=Min('id'), total=Count('id')).filter(total__gt=1)
+    for group in duplicates:
+        extra_ids = list(Ingredient.objects.filter(
+            name=group['name'],
+            measurement_unit=group['measurement_unit']).exclude(
+            id=group['keep_id']).values_list('id', flat=True))
+        recipes_with_kept = RecipeIngredient.objects.filter(
+            ingredient_id=group['keep_id']).values('recipe_id')
+        RecipeIngredient.objects.filter(
+            ingredient_id__in=extra_ids,
+            recipe_id__in=recipes_with_kept).delete()
+        RecipeIngredient.objects.filter(
+            ingredient_id__in=extra_ids).update(
+            ingredient_id=group['keep_id'])
+        Ingredient.objects.filter(id__in=extra_ids).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0002_shoppinglistexport'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            merge_duplicate_ingredients, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='ingredient',
+            constraint=models.UniqueConstraint(fields=('name', 'measurement_unit'), name='unique_ingredient_unit'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.0.5 on 2026-10-18 17:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0003_ingredient_unique_name_unit'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='processed_image',
+            field=models.CharField(blank=True, editable=False, max_length=100, verbose_name='Изображение, для которого построены варианты'),
+        ),
+    ]
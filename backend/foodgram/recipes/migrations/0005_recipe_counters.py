@@ -0,0 +1,47 @@
+# Generated by Django 3.0.5 on 2026-10-18 17:36
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_of(model, field):
+    return Coalesce(Subquery(model.objects.filter(
+        **{field: OuterRef('pk')}).order_by().values(field).annotate(
+        total=Count('pk')).values('total')), 0)
+
+
+def fill_counters(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    User = apps.get_model('users', 'User')
+    favorites = apps.get_model('recipes', 'FavoriteRecipe').recipe.through
+    carts = apps.get_model('recipes', 'ShoppingCart').recipe.through
+    Subscribe = apps.get_model('recipes', 'Subscribe')
+    Recipe.objects.update(
+        favorites_count=count_of(favorites, 'recipe'),
+        shopping_cart_count=count_of(carts, 'recipe'))
+    User.objects.update(
+        recipes_count=count_of(Recipe, 'author'),
+        followers_count=count_of(Subscribe, 'author'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0004_recipe_processed_image'),
+        ('users', '0002_user_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='В избранном у'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='shopping_cart_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='В списке покупок у'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
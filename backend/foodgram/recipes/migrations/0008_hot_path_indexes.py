@@ -0,0 +1,45 @@
+# Generated by Django 3.0.5 on 2026-10-18 17:43
+
+from django.db import migrations, models
+
+
+# istartswith в PostgreSQL сравнивает UPPER(name::text) LIKE UPPER(%s), и
+# обычный индекс по name для такого условия не используется.
+INGREDIENT_NAME_INDEX = (
+    'CREATE INDEX IF NOT EXISTS ingredient_name_upper_idx '
+    'ON recipes_ingredient (UPPER(name::text) text_pattern_ops)')
+DROP_INGREDIENT_NAME_INDEX = 'DROP INDEX IF EXISTS ingredient_name_upper_idx'
+
+
+def create_ingredient_name_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(INGREDIENT_NAME_INDEX)
+
+
+def drop_ingredient_name_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(DROP_INGREDIENT_NAME_INDEX)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0007_recipe_pub_date_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['author', '-pub_date'], name='recipe_author_pub_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipeingredient',
+            index=models.Index(fields=['ingredient', 'recipe'], name='recipe_ingredient_reverse_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='subscribe',
+            index=models.Index(fields=['user', '-id'], name='subscribe_user_id_idx'),
+        ),
+        migrations.RunPython(
+            create_ingredient_name_index, drop_ingredient_name_index),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 3.0.5 on 2026-10-18 17:44
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+# Вектор поддерживается триггером, поэтому он заполняется и при
+# bulk_create, и при правках из админки. Название весит больше текста.
+CREATE_SEARCH = '''
+CREATE OR REPLACE FUNCTION recipes_recipe_search_vector() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector :=
+        setweight(to_tsvector('russian', coalesce(NEW.name, '')), 'A') ||
+        setweight(to_tsvector('russian', coalesce(NEW.text, '')), 'B');
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+CREATE TRIGGER recipes_recipe_search_vector_update
+    BEFORE INSERT OR UPDATE OF name, text ON recipes_recipe
+    FOR EACH ROW EXECUTE PROCEDURE recipes_recipe_search_vector();
+UPDATE recipes_recipe SET name = name;
+CREATE INDEX recipe_search_vector_idx ON recipes_recipe
+    USING GIN (search_vector);
+'''
+DROP_SEARCH = '''
+DROP INDEX IF EXISTS recipe_search_vector_idx;
+DROP TRIGGER IF EXISTS recipes_recipe_search_vector_update ON recipes_recipe;
+DROP FUNCTION IF EXISTS recipes_recipe_search_vector();
+'''
+
+
+def create_search(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(CREATE_SEARCH)
+
+
+def drop_search(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(DROP_SEARCH)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0008_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True, verbose_name='Поисковый вектор'),
+        ),
+        migrations.RunPython(create_search, drop_search),
+    ]
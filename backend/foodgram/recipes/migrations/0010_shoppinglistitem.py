@@ -0,0 +1,58 @@
+# Generated by Django 3.0.5 on 2026-10-18 18:02
+
+from itertools import islice
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Sum
+import django.db.models.deletion
+
+
+def fill_shopping_lists(apps, schema_editor):
+    RecipeIngredient = apps.get_model('recipes', 'RecipeIngredient')
+    ShoppingListItem = apps.get_model('recipes', 'ShoppingListItem')
+    items = (
+        ShoppingListItem(
+            user_id=row['recipe__cart__user'],
+            ingredient_id=row['ingredient'],
+            total=row['total'],
+            recipe_count=row['recipe_count'])
+        for row in RecipeIngredient.objects.filter(
+            recipe__cart__user__isnull=False
+        ).order_by().values('recipe__cart__user', 'ingredient').annotate(
+            total=Sum('amount'), recipe_count=Count('id')
+        ).iterator())
+    batch = list(islice(items, 5000))
+    while batch:
+        ShoppingListItem.objects.bulk_create(batch)
+        batch = list(islice(items, 5000))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('recipes', '0009_recipe_search_vector'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShoppingListItem',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total', models.IntegerField(default=0, verbose_name='Количество')),
+                ('recipe_count', models.IntegerField(default=0, verbose_name='Число рецептов с ингредиентом')),
+                ('ingredient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shopping_list_items', to='recipes.Ingredient', verbose_name='Ингредиент')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shopping_list_items', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Строка списка покупок',
+                'verbose_name_plural': 'Строки списков покупок',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='shoppinglistitem',
+            constraint=models.UniqueConstraint(fields=('user', 'ingredient'), name='unique_shopping_list_item'),
+        ),
+        migrations.RunPython(fill_shopping_lists, migrations.RunPython.noop),
+    ]
@@ -1,9 +1,13 @@
 from django.contrib.auth import get_user_model
+from django.contrib.postgres.search import SearchVectorField
 from django.core import validators
 from django.db import models
+from django.db.models import Prefetch
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 
+from users.models import CounterFieldsMixin
+
 User = get_user_model()
 
 
@@ -19,6 +23,10 @@ class Ingredient(models.Model):
         ordering = ['name']
         verbose_name = 'Ингредиент'
         verbose_name_plural = 'Ингредиенты'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['name', 'measurement_unit'],
+                name='unique_ingredient_unit')]
 
     def __str__(self):
         return f'{self.name}, {self.measurement_unit}.'
@@ -54,7 +62,30 @@ class Tag(models.Model):
         return self.name
 
 
-class Recipe(models.Model):
+class RecipeQuerySet(models.QuerySet):
+    """Запросы рецептов с заранее спланированной подгрузкой связей."""
+
+    def with_related(self, author=True, tags=True, ingredients=True,
+                     text=True):
+        """
+        Подгружает автора в том же запросе, а теги и ингредиенты одним
+        запросом на каждую связь. Флаги избранного, корзины и подписки
+        сериализаторы берут из кэша связей пользователя
+        (recipes.relations). Поисковый вектор в ответах не нужен и не
+        читается. Связи и текст, которых нет в ответе, можно отключить.
+        """
+        deferred = ('search_vector',) if text else ('search_vector', 'text')
+        prefetches = ['tags'] if tags else []
+        if ingredients:
+            prefetches.append(Prefetch(
+                'ingredients_in_recipe',
+                queryset=RecipeIngredient.objects.select_related(
+                    'ingredient')))
+        queryset = self.defer(*deferred).prefetch_related(*prefetches)
+        return queryset.select_related('author') if author else queryset
+
+
+class Recipe(CounterFieldsMixin, models.Model):
     author = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
@@ -68,6 +99,11 @@ class Recipe(models.Model):
         upload_to='media/recipe/',
         blank=True,
         null=True)
+    processed_image = models.CharField(
+        'Изображение, для которого построены варианты',
+        max_length=100,
+        blank=True,
+        editable=False)
     text = models.TextField(
         'Описание рецепта')
     cooking_time = models.BigIntegerField(
@@ -86,17 +122,40 @@ class Recipe(models.Model):
     pub_date = models.DateTimeField(
         'Дата публикации',
         auto_now_add=True)
+    favorites_count = models.PositiveIntegerField(
+        'В избранном у',
+        default=0,
+        editable=False)
+    shopping_cart_count = models.PositiveIntegerField(
+        'В списке покупок у',
+        default=0,
+        editable=False)
+    # Заполняется триггером PostgreSQL из name и text, см. миграцию
+    # 0009_recipe_search_vector.
+    search_vector = SearchVectorField(
+        'Поисковый вектор',
+        null=True,
+        editable=False)
+
+    counter_fields = ('favorites_count', 'shopping_cart_count')
+
+    objects = RecipeQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
         ordering = ('-pub_date',)
+        indexes = [
+            models.Index(fields=['-pub_date', '-id'],
+                         name='recipe_pub_date_idx'),
+            models.Index(fields=['author', '-pub_date'],
+                         name='recipe_author_pub_date_idx')]
 
     def __str__(self):
         return f'{self.name}, автор {self.author}'
 
     def _get_number_additions_to_favourite(self):
-        return self.favorite_recipe.count()
+        return self.favorites_count
 
     _get_number_additions_to_favourite.short_description = 'в избранном у'
 
@@ -125,6 +184,9 @@ class RecipeIngredient(models.Model):
             models.UniqueConstraint(
                 fields=['recipe', 'ingredient'],
                 name='unique ingredient')]
+        indexes = [
+            models.Index(fields=['ingredient', 'recipe'],
+                         name='recipe_ingredient_reverse_idx')]
 
 
 class Subscribe(models.Model):
@@ -150,6 +212,9 @@ class Subscribe(models.Model):
             models.UniqueConstraint(
                 fields=['user', 'author'],
                 name='unique_subscription')]
+        indexes = [
+            models.Index(fields=['user', '-id'],
+                         name='subscribe_user_id_idx')]
 
     def __str__(self):
         return f'Пользователь {self.user} -> автор {self.author}'
@@ -182,6 +247,41 @@ class ShoppingCart(models.Model):
             return ShoppingCart.objects.create(user=instance)
 
 
+class ShoppingListItem(models.Model):
+    """
+    Строка списка покупок: сумма ингредиента по всем рецептам в корзине
+    пользователя. Поддерживается при изменении корзины и состава
+    рецептов (recipes.cart_totals).
+    """
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='shopping_list_items',
+        verbose_name='Пользователь')
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        related_name='shopping_list_items',
+        verbose_name='Ингредиент')
+    total = models.IntegerField(
+        'Количество',
+        default=0)
+    recipe_count = models.IntegerField(
+        'Число рецептов с ингредиентом',
+        default=0)
+
+    class Meta:
+        verbose_name = 'Строка списка покупок'
+        verbose_name_plural = 'Строки списков покупок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'ingredient'],
+                name='unique_shopping_list_item')]
+
+    def __str__(self):
+        return f'{self.user}: {self.ingredient} {self.total}'
+
+
 class FavoriteRecipe(models.Model):
     user = models.OneToOneField(
         User,
@@ -206,3 +306,92 @@ class FavoriteRecipe(models.Model):
     def create_favorite_recipe(sender, instance, created, **kwargs):
         if created:
             return FavoriteRecipe.objects.create(user=instance)
+
+
+class ShoppingListExport(models.Model):
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    STATUS_CHOICES = [
+        (PENDING, 'В очереди'),
+        (RUNNING, 'Выполняется'),
+        (DONE, 'Готово'),
+        (FAILED, 'Ошибка'),
+    ]
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='shopping_list_exports',
+        verbose_name='Пользователь')
+    format = models.CharField(
+        'Формат файла',
+        max_length=10)
+    status = models.CharField(
+        'Статус',
+        max_length=10,
+        choices=STATUS_CHOICES,
+        default=PENDING)
+    document = models.BinaryField(
+        'Файл списка покупок',
+        null=True)
+    error = models.TextField(
+        'Ошибка',
+        blank=True)
+    created = models.DateTimeField(
+        'Дата создания',
+        auto_now_add=True)
+    started = models.DateTimeField(
+        'Дата начала обработки',
+        null=True,
+        blank=True)
+    finished = models.DateTimeField(
+        'Дата готовности',
+        null=True,
+        blank=True)
+
+    class Meta:
+        verbose_name = 'Выгрузка списка покупок'
+        verbose_name_plural = 'Выгрузки списков покупок'
+        ordering = ['-id']
+        indexes = [
+            models.Index(fields=['status', 'id'],
+                         name='export_status_idx')]
+
+    def __str__(self):
+        return f'Выгрузка {self.format} для {self.user}: {self.status}'
+
+
+class RecipeScore(models.Model):
+    """
+    Рейтинги рецепта для сортировок popular и trending. Таблица целиком
+    пересчитывается командой compute_recipe_scores.
+    """
+    recipe = models.OneToOneField(
+        Recipe,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='score',
+        verbose_name='Рецепт')
+    popular = models.FloatField(
+        'Популярность',
+        default=0)
+    trending = models.FloatField(
+        'Популярность с учетом давности',
+        default=0)
+    computed = models.DateTimeField(
+        'Дата расчета',
+        auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Рейтинг рецепта'
+        verbose_name_plural = 'Рейтинги рецептов'
+        indexes = [
+            models.Index(fields=['-popular', '-recipe'],
+                         name='score_popular_idx'),
+            models.Index(fields=['-trending', '-recipe'],
+                         name='score_trending_idx')]
+
+    def __str__(self):
+        return f'{self.recipe_id}: {self.popular:.1f} / {self.trending:.3f}'
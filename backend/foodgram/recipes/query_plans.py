@@ -0,0 +1,88 @@
+import json
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from recipes.models import Recipe, Subscribe, Tag
+
+User = get_user_model()
+
+ENDPOINTS = (
+    ('recipes', '/api/recipes/?count=estimate'),
+    ('recipes by author', '/api/recipes/?author={author}&count=estimate'),
+    ('recipes by tag', '/api/recipes/?tags={tag}&count=estimate'),
+    ('favorited', '/api/recipes/?is_favorited=1&count=estimate'),
+    ('in shopping cart', '/api/recipes/?is_in_shopping_cart=1'),
+    ('popular', '/api/recipes/?ordering=popular&cursor='),
+    ('trending', '/api/recipes/?ordering=trending&cursor='),
+    ('recipes cursor', '/api/recipes/?cursor='),
+    ('recipe', '/api/recipes/{recipe}/'),
+    ('user', '/api/users/{author}/'),
+    ('subscriptions', '/api/users/subscriptions/?recipes_limit=3'),
+    ('shopping list', '/api/recipes/download_shopping_cart/?format=txt'),
+)
+
+
+def seq_scans(plan):
+    """Имена таблиц, которые план читает последовательным сканированием."""
+    found = []
+    if plan.get('Node Type') == 'Seq Scan':
+        found.append(plan['Relation Name'])
+    for child in plan.get('Plans', ()):
+        found.extend(seq_scans(child))
+    return found
+
+
+def explain(sql):
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}')
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]['Plan']
+
+
+def table_sizes():
+    """Оценка числа строк в таблицах по статистике PostgreSQL."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT relname, reltuples FROM pg_class WHERE relkind = 'r'")
+        return dict(cursor.fetchall())
+
+
+def endpoint_context():
+    """
+    Пользователь с подписками и значения для подстановки в ENDPOINTS
+    или None, если база пуста.
+    """
+    user = Subscribe.objects.values_list('user_id', flat=True).first()
+    if user is None or not Recipe.objects.exists():
+        return None
+    return User.objects.get(id=user), {
+        'author': Recipe.objects.values_list('author_id', flat=True).first(),
+        'recipe': Recipe.objects.values_list('id', flat=True).first(),
+        'tag': Tag.objects.values_list('slug', flat=True).first(),
+    }
+
+
+def check_endpoint(client, url, tables, on_plan=None):
+    """
+    Выполняет GET url и EXPLAIN каждого его SELECT. Возвращает число
+    запросов и описания последовательных сканирований таблиц из tables.
+    """
+    with CaptureQueriesContext(connection) as context:
+        response = client.get(url)
+    if response.status_code >= 400:
+        raise ValueError(f'{url}: HTTP {response.status_code}')
+    problems = []
+    for query in context.captured_queries:
+        if not query['sql'].lstrip().upper().startswith('SELECT'):
+            continue
+        plan = explain(query['sql'])
+        if on_plan is not None:
+            on_plan(plan)
+        problems.extend(
+            f'Seq Scan on {table}: {query["sql"][:200]}'
+            for table in seq_scans(plan) if table in tables)
+    return len(context.captured_queries), problems
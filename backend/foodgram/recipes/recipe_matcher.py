@@ -0,0 +1,158 @@
+import heapq
+import threading
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from itertools import chain, groupby
+from operator import itemgetter
+
+from django.core.cache import cache
+
+from recipes.models import RecipeIngredient
+from recipes.versions import bump_version, get_version
+
+VERSION = 'recipe_matcher'
+CHANGES_KEY = 'recipe_matcher:changes'
+CHANGE_KEY = 'recipe_matcher:change:{}'
+CHANGE_TIMEOUT = 24 * 60 * 60
+# Если изменений накопилось больше, индекс дешевле перестроить целиком.
+MAX_CHANGES = 1000
+
+
+def record_change(*recipe_ids):
+    """
+    Записывает в общий журнал изменений рецепты, у которых поменялся
+    состав. Процессы применяют журнал к своим индексам при следующем
+    запросе.
+    """
+    cache.add(CHANGES_KEY, 0, None)
+    for recipe_id in recipe_ids:
+        number = cache.incr(CHANGES_KEY)
+        cache.set(CHANGE_KEY.format(number), recipe_id, CHANGE_TIMEOUT)
+
+
+def invalidate():
+    """Перестроить индексы всех процессов, например после загрузки."""
+    bump_version(VERSION)
+
+
+def grow(sizes, recipe_id):
+    """Дополняет массив размеров нулями до индекса recipe_id."""
+    if recipe_id >= len(sizes):
+        sizes.frombytes(bytes(
+            (max(recipe_id + 1, len(sizes) * 2) - len(sizes))
+            * sizes.itemsize))
+
+
+def contains(recipe_ids, recipe_id):
+    index = bisect_left(recipe_ids, recipe_id)
+    return index < len(recipe_ids) and recipe_ids[index] == recipe_id
+
+
+class RecipeMatcher:
+    """
+    Инвертированный индекс состава рецептов в памяти процесса: для
+    каждого ингредиента отсортированный массив id рецептов, для каждого
+    рецепта число его ингредиентов. Изменения отдельных рецептов
+    применяются по журналу record_change, смена версии recipe_matcher
+    перестраивает индекс целиком.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = None
+        self.change = 0
+        self.index = ({}, array('H'))
+
+    def build(self):
+        postings = {}
+        sizes = array('H')
+        rows = RecipeIngredient.objects.order_by(
+            'ingredient_id', 'recipe_id'
+        ).values_list('ingredient_id', 'recipe_id').iterator(chunk_size=10000)
+        for ingredient_id, group in groupby(rows, key=itemgetter(0)):
+            postings[ingredient_id] = array(
+                'i', (recipe_id for _, recipe_id in group))
+        for recipe_id, count in Counter(
+                chain.from_iterable(postings.values())).items():
+            grow(sizes, recipe_id)
+            sizes[recipe_id] = count
+        self.index = (postings, sizes)
+
+    def update(self, recipe_ids):
+        """
+        Заменяет состав рецептов recipe_ids на текущий из базы. Массивы
+        не меняются на месте, а заменяются копиями, поэтому параллельные
+        запросы видят либо старый, либо новый список.
+        """
+        postings, sizes = self.index
+        current = {}
+        for ingredient_id, recipe_id in RecipeIngredient.objects.filter(
+                recipe_id__in=recipe_ids).order_by().values_list(
+                    'ingredient_id', 'recipe_id'):
+            current.setdefault(ingredient_id, set()).add(recipe_id)
+        # Размеры меняются раньше списков: у рецепта из списка размер
+        # всегда уже больше нуля.
+        counts = Counter(chain.from_iterable(current.values()))
+        for recipe_id in recipe_ids:
+            grow(sizes, recipe_id)
+            sizes[recipe_id] = counts[recipe_id]
+        for ingredient_id in set(postings) | set(current):
+            old = postings.get(ingredient_id, ())
+            stale = any(contains(old, recipe_id) for recipe_id in recipe_ids)
+            added = current.get(ingredient_id, ())
+            if not stale and not added:
+                continue
+            kept = [recipe_id for recipe_id in old
+                    if recipe_id not in recipe_ids]
+            postings[ingredient_id] = array('i', sorted(kept + list(added)))
+
+    def pending_changes(self, last):
+        """Id рецептов из журнала или None, если журнал неполон."""
+        if last - self.change > MAX_CHANGES:
+            return None
+        keys = [CHANGE_KEY.format(number)
+                for number in range(self.change + 1, last + 1)]
+        found = cache.get_many(keys)
+        if len(found) != len(keys):
+            return None
+        return set(found.values())
+
+    def refresh(self):
+        version = get_version(VERSION)
+        last = cache.get(CHANGES_KEY, 0)
+        if version == self.version and last == self.change:
+            return
+        with self.lock:
+            if version == self.version and last == self.change:
+                return
+            changed = self.pending_changes(last)
+            if version != self.version or changed is None:
+                self.build()
+            else:
+                self.update(changed)
+            self.version, self.change = version, last
+
+    def match(self, ingredient_ids, limit=20, min_coverage=0):
+        """
+        Рецепты, в которых есть хотя бы один из ingredient_ids, по
+        убыванию доли своих ингредиентов, имеющихся у пользователя.
+        Возвращает общее число таких рецептов и список кортежей
+        (recipe_id, доля, число совпавших ингредиентов) длиной до limit.
+        """
+        self.refresh()
+        postings, sizes = self.index
+        found = Counter()
+        for ingredient_id in set(ingredient_ids):
+            found.update(postings.get(ingredient_id, ()))
+        ranked = [
+            (matched / sizes[recipe_id], matched, recipe_id)
+            for recipe_id, matched in found.items()
+            if sizes[recipe_id]
+            and matched >= min_coverage * sizes[recipe_id]]
+        return len(ranked), [
+            (recipe_id, coverage, matched)
+            for coverage, matched, recipe_id in heapq.nlargest(limit, ranked)]
+
+
+recipe_matcher = RecipeMatcher()
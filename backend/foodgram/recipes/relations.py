@@ -0,0 +1,49 @@
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.cache import cache
+
+from recipes.models import FavoriteRecipe, ShoppingCart, Subscribe
+from recipes.versions import get_version, relations_version
+
+RELATIONS_KEY = 'user-relations:{}:{}'
+REQUEST_ATTRIBUTE = '_user_relations'
+
+Relations = namedtuple('Relations', 'favorites cart following')
+EMPTY = Relations(frozenset(), frozenset(), frozenset())
+
+
+def load_relations(user):
+    return Relations(
+        frozenset(FavoriteRecipe.recipe.through.objects.filter(
+            favoriterecipe__user=user).values_list('recipe_id', flat=True)),
+        frozenset(ShoppingCart.recipe.through.objects.filter(
+            shoppingcart__user=user).values_list('recipe_id', flat=True)),
+        frozenset(Subscribe.objects.filter(
+            user=user).values_list('author_id', flat=True)))
+
+
+def get_relations(user):
+    """
+    Множества id избранных рецептов, рецептов в корзине и авторов, на
+    которых подписан user. Хранятся в общем кэше под версией связей
+    пользователя, которую сигналы меняют при каждом изменении.
+    """
+    if user.is_anonymous:
+        return EMPTY
+    key = RELATIONS_KEY.format(
+        user.id, get_version(relations_version(user.id)))
+    relations = cache.get(key)
+    if relations is None:
+        relations = load_relations(user)
+        cache.set(key, relations, settings.RELATIONS_CACHE_TIMEOUT)
+    return relations
+
+
+def request_relations(request):
+    """Связи пользователя запроса, прочитанные один раз за запрос."""
+    relations = getattr(request, REQUEST_ATTRIBUTE, None)
+    if relations is None:
+        relations = get_relations(request.user)
+        setattr(request, REQUEST_ATTRIBUTE, relations)
+    return relations
@@ -0,0 +1,83 @@
+from itertools import islice
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from recipes.models import Recipe, RecipeScore
+from recipes.versions import bump_version
+
+FAVORITE_WEIGHT = 2
+CART_WEIGHT = 1
+# trending = popular / (возраст в часах + AGE_OFFSET) ** GRAVITY: чем
+# больше GRAVITY, тем быстрее старые рецепты уходят вниз.
+GRAVITY = 1.5
+AGE_OFFSET = 2
+ORDERINGS = ('popular', 'trending')
+BATCH_SIZE = 5000
+
+
+def popularity(favorites, carts):
+    return FAVORITE_WEIGHT * favorites + CART_WEIGHT * carts
+
+
+def trending(popular, age_hours):
+    return popular / (max(age_hours, 0) + AGE_OFFSET) ** GRAVITY
+
+
+def iter_scores(now):
+    rows = Recipe.objects.order_by().values_list(
+        'id', 'pub_date', 'favorites_count', 'shopping_cart_count'
+    ).iterator(chunk_size=5000)
+    for recipe_id, pub_date, favorites, carts in rows:
+        popular = popularity(favorites, carts)
+        age_hours = (now - pub_date).total_seconds() / 3600
+        yield RecipeScore(recipe_id=recipe_id, popular=popular,
+                          trending=trending(popular, age_hours))
+
+
+def insert_scores_sql(now):
+    """Те же формулы одним INSERT ... SELECT для PostgreSQL."""
+    popular = (f'{FAVORITE_WEIGHT} * favorites_count + '
+               f'{CART_WEIGHT} * shopping_cart_count')
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {RecipeScore._meta.db_table} '
+            f'(recipe_id, popular, trending, computed) '
+            f'SELECT id, {popular}, ({popular}) / power(greatest('
+            f'extract(epoch from %s - pub_date) / 3600, 0) + {AGE_OFFSET}, '
+            f'{GRAVITY}), %s FROM {Recipe._meta.db_table}', [now, now])
+
+
+def insert_scores(now):
+    scores = iter_scores(now)
+    batch = list(islice(scores, BATCH_SIZE))
+    while batch:
+        RecipeScore.objects.bulk_create(batch)
+        batch = list(islice(scores, BATCH_SIZE))
+
+
+def compute():
+    """
+    Пересчитывает рейтинги всех рецептов по счетчикам избранного и
+    корзин. Таблица заменяется целиком в одной транзакции, так что
+    читатели видят либо старые, либо новые рейтинги. Возвращает число
+    рецептов.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        RecipeScore.objects.all().delete()
+        if connection.vendor == 'postgresql':
+            insert_scores_sql(now)
+        else:
+            insert_scores(now)
+    bump_version('recipes')
+    return RecipeScore.objects.count()
+
+
+def order_by_score(queryset, ordering):
+    """
+    Сортирует рецепты по рейтингу. Условие на наличие рейтинга делает
+    соединение внутренним, и база может идти по индексу рейтинга.
+    """
+    return queryset.filter(score__isnull=False).order_by(
+        f'-score__{ordering}', '-id')
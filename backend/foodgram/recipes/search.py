@@ -0,0 +1,48 @@
+import re
+from functools import reduce
+from operator import and_
+
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connections
+from django.db.models import Count, F, Q
+
+from recipes.models import RecipeIngredient
+
+SEARCH_CONFIG = 'russian'
+WORD = re.compile(r'\w+')
+
+
+def search_recipes(queryset, text):
+    """
+    Рецепты, в названии или описании которых есть все слова из text
+    (последнее слово может быть началом слова). В PostgreSQL поиск идет
+    по вектору search_vector с сортировкой по рангу, на других базах —
+    через icontains без ранжирования.
+    """
+    words = WORD.findall(text)
+    if not words:
+        return queryset
+    if connections[queryset.db].vendor != 'postgresql':
+        return queryset.filter(reduce(and_, (
+            Q(name__icontains=word) | Q(text__icontains=word)
+            for word in words)))
+    # Слова состоят только из \w, поэтому их безопасно собрать в raw
+    # tsquery с префиксным поиском.
+    query = SearchQuery(
+        ' & '.join(f'{word}:*' for word in words),
+        config=SEARCH_CONFIG, search_type='raw')
+    return queryset.filter(search_vector=query).annotate(
+        search_rank=SearchRank(F('search_vector'), query)
+    ).order_by('-search_rank', '-id')
+
+
+def with_ingredients(queryset, ingredient_ids):
+    """Рецепты, в которых есть все ингредиенты из ingredient_ids."""
+    ingredient_ids = set(ingredient_ids)
+    if not ingredient_ids:
+        return queryset
+    return queryset.filter(id__in=RecipeIngredient.objects.filter(
+        ingredient_id__in=ingredient_ids
+    ).order_by().values('recipe_id').annotate(
+        found=Count('id')
+    ).filter(found=len(ingredient_ids)).values('recipe_id'))
@@ -0,0 +1,185 @@
+import csv
+import hashlib
+import io
+import json
+import os
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
+
+from recipes.models import ShoppingListItem
+
+FONTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fonts')
+TITLE_FONT = 'FreeSans'
+ITEM_FONT = 'Miama Nueva'
+FONTS = (
+    (TITLE_FONT, 'FreeSans.ttf'),
+    (ITEM_FONT, 'Miama Nueva.ttf'),
+)
+
+TITLE = 'Список покупок:'
+LEFT_POSITION = 50
+TOP_POSITION = 700
+BOTTOM_POSITION = 50
+LINE_STEP = 40
+CHUNK_SIZE = 8192
+DEFAULT_FORMAT = 'pdf'
+
+Renderer = namedtuple('Renderer', ('media_type', 'content_type',
+                                   'extension', 'render', 'cached'))
+RENDERERS = {}
+
+
+def register_renderer(name, media_type, extension, cached=False,
+                      charset='utf-8'):
+    """
+    Регистрирует функцию, превращающую список покупок в байты формата
+    name. Дорогие в отрисовке форматы помечаются cached.
+    """
+    content_type = f'{media_type}; charset={charset}' if charset else (
+        media_type)
+
+    def decorator(render):
+        RENDERERS[name] = Renderer(
+            media_type, content_type, extension, render, cached)
+        return render
+    return decorator
+
+
+def register_fonts():
+    """Регистрирует шрифты списка покупок один раз на процесс."""
+    registered = pdfmetrics.getRegisteredFontNames()
+    for name, filename in FONTS:
+        if name not in registered:
+            pdfmetrics.registerFont(
+                TTFont(name, os.path.join(FONTS_DIR, filename)))
+
+
+def get_cart_items(user):
+    """
+    Суммарное количество каждого ингредиента из корзины пользователя из
+    поддерживаемой таблицы ShoppingListItem.
+    """
+    return list(ShoppingListItem.objects.filter(user=user).order_by(
+        'ingredient__name').values(
+            'ingredient__name', 'ingredient__measurement_unit',
+            ingredient_total=F('total')))
+
+
+def item_line(number, item):
+    return (f'{number}.  {item["ingredient__name"]} - '
+            f'{item["ingredient_total"]}'
+            f'{item["ingredient__measurement_unit"]}')
+
+
+@register_renderer('txt', 'text/plain', 'txt')
+def render_txt(items):
+    lines = [TITLE]
+    lines.extend(
+        item_line(number, item) for number, item in enumerate(items, 1))
+    return ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+@register_renderer('csv', 'text/csv', 'csv')
+def render_csv(items):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(('name', 'measurement_unit', 'amount'))
+    writer.writerows(
+        (item['ingredient__name'],
+         item['ingredient__measurement_unit'],
+         item['ingredient_total']) for item in items)
+    return buffer.getvalue().encode('utf-8')
+
+
+@register_renderer('json', 'application/json', 'json')
+def render_json(items):
+    return json.dumps(
+        [{'name': item['ingredient__name'],
+          'measurement_unit': item['ingredient__measurement_unit'],
+          'amount': item['ingredient_total']} for item in items],
+        ensure_ascii=False).encode('utf-8')
+
+
+@register_renderer('pdf', 'application/pdf', 'pdf', cached=True,
+                   charset=None)
+def render_pdf(items):
+    """Рисует список покупок постранично и возвращает байты PDF."""
+    buffer = io.BytesIO()
+    p = canvas.Canvas(buffer, pagesize=A4)
+    p.setFont(TITLE_FONT, 25)
+    p.drawString(LEFT_POSITION, TOP_POSITION + LINE_STEP, TITLE)
+    p.setFont(ITEM_FONT, 14)
+    top_position = TOP_POSITION
+    for number, item in enumerate(items, start=1):
+        if top_position < BOTTOM_POSITION:
+            p.showPage()
+            p.setFont(ITEM_FONT, 14)
+            top_position = TOP_POSITION + LINE_STEP
+        p.drawString(LEFT_POSITION, top_position, item_line(number, item))
+        top_position -= LINE_STEP
+    p.showPage()
+    p.save()
+    return buffer.getvalue()
+
+
+def select_format(requested=None, accept=''):
+    """
+    Выбирает формат выгрузки: явно запрошенный формат важнее заголовка
+    Accept. Возвращает None для неизвестного запрошенного формата.
+    """
+    if requested:
+        return requested if requested in RENDERERS else None
+    by_media_type = {
+        renderer.media_type: name for name, renderer in RENDERERS.items()}
+    accepted = []
+    for position, media_range in enumerate(accept.split(',')):
+        media_type, *params = (part.strip() for part in media_range.split(';'))
+        quality = 1.0
+        for param in params:
+            if param.startswith('q='):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+        if media_type in by_media_type and quality > 0:
+            accepted.append((-quality, position, by_media_type[media_type]))
+    return min(accepted)[2] if accepted else DEFAULT_FORMAT
+
+
+def cart_digest(items):
+    """Хэш агрегированного списка покупок - ключ кэша документа."""
+    payload = json.dumps(
+        [(item['ingredient__name'],
+          item['ingredient__measurement_unit'],
+          item['ingredient_total']) for item in items],
+        ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def get_document(name, items):
+    """
+    Возвращает список покупок в формате name. Кэшируемые форматы
+    берутся из кэша, пока состав корзины не изменился.
+    """
+    renderer = RENDERERS[name]
+    if not renderer.cached:
+        return renderer.render(items)
+    key = f'shopping-list:{name}:{cart_digest(items)}'
+    document = cache.get(key)
+    if document is None:
+        document = renderer.render(items)
+        cache.set(key, document, settings.SHOPPING_LIST_CACHE_TIMEOUT)
+    return document
+
+
+def iter_chunks(document, chunk_size=CHUNK_SIZE):
+    """Отдает документ частями для StreamingHttpResponse."""
+    for start in range(0, len(document), chunk_size):
+        yield document[start:start + chunk_size]
@@ -0,0 +1,239 @@
+import threading
+from collections import Counter, defaultdict, namedtuple
+from functools import partial
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete)
+from django.dispatch import receiver
+
+from recipes import cart_totals, counters, recipe_matcher
+from recipes.models import (FavoriteRecipe, Ingredient, Recipe,
+                            RecipeIngredient, RecipeScore, ShoppingCart,
+                            ShoppingListItem, Subscribe, Tag)
+from recipes.versions import bump_version, recipe_version, relations_version
+
+User = get_user_model()
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+def ingredient_changed(sender, **kwargs):
+    bump_version('ingredients', 'recipes')
+
+
+@receiver((post_save, post_delete), sender=Tag)
+def tag_changed(sender, **kwargs):
+    bump_version('tags', 'recipes')
+
+
+@receiver(post_save, sender=User)
+def user_changed(sender, **kwargs):
+    bump_version('users', 'recipes')
+
+
+class RecipeWrites(threading.local):
+    changes = None
+
+
+recipe_writes = RecipeWrites()
+
+
+class RecipeChanges:
+    """
+    Рецепты, записанные в одной транзакции. Версии рецепта и списка
+    меняются при сохранении самого рецепта, при первой в транзакции
+    записи строки его состава и еще раз после коммита. После коммита же
+    рецепты один раз записываются в журнал индекса подбора, сколько бы
+    строк состава ни сохранялось.
+    """
+
+    def __init__(self):
+        self.recipe_ids = set()
+
+    def add(self, recipe_id, force=False):
+        if recipe_id in self.recipe_ids and not force:
+            return
+        self.recipe_ids.add(recipe_id)
+        # Вне транзакции версии сразу сменит обработчик коммита.
+        if transaction.get_connection().in_atomic_block:
+            bump_version(recipe_version(recipe_id), 'recipes')
+
+    def __call__(self):
+        if recipe_writes.changes is self:
+            recipe_writes.changes = None
+        recipe_ids = sorted(self.recipe_ids)
+        bump_version(
+            *(recipe_version(recipe_id) for recipe_id in recipe_ids),
+            'recipes')
+        recipe_matcher.record_change(*recipe_ids)
+
+
+def recipe_written(recipe_id, force=False):
+    """
+    Отмечает запись рецепта или строки его состава. Если обработчик
+    прежних изменений больше не ждет коммита (транзакцию откатили или ее
+    нет), начинаются новые изменения.
+    """
+    changes = recipe_writes.changes
+    if changes is not None and any(
+            func is changes
+            for _, func in transaction.get_connection().run_on_commit):
+        changes.add(recipe_id, force)
+        return
+    changes = recipe_writes.changes = RecipeChanges()
+    changes.add(recipe_id, force)
+    transaction.on_commit(changes)
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+def recipe_changed(sender, instance, **kwargs):
+    recipe_written(instance.pk, force=True)
+
+
+@receiver(pre_delete, sender=Recipe)
+def remove_recipe_from_shopping_lists(sender, instance, **kwargs):
+    """
+    Строки корзин удаляются каскадом без сигналов, поэтому рецепт
+    вычитается из списков покупок до удаления, в том числе при удалении
+    автора.
+    """
+    cart_totals.remove_from_carts(instance.pk)
+
+
+@receiver(post_save, sender=Recipe)
+def count_created_recipe(sender, instance, created, **kwargs):
+    if created:
+        counters.increment(
+            User.objects.filter(id=instance.author_id), recipes_count=1)
+
+
+@receiver(post_delete, sender=Recipe)
+def count_deleted_recipe(sender, instance, **kwargs):
+    """Срабатывает и при удалении из админки, и каскадом."""
+    counters.increment(
+        User.objects.filter(id=instance.author_id), recipes_count=-1)
+
+
+@receiver(post_save, sender=Recipe)
+def create_recipe_score(sender, instance, created, **kwargs):
+    """Новый рецепт попадает в сортировки по рейтингу сразу, с нулем."""
+    if created:
+        RecipeScore.objects.get_or_create(recipe=instance)
+
+
+@receiver((post_save, post_delete), sender=RecipeIngredient)
+def recipe_ingredient_changed(sender, instance, **kwargs):
+    """Строки состава пишутся пачками: версия меняется раз на рецепт."""
+    recipe_written(instance.recipe_id)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def recipe_tags_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        bump_version(recipe_version(instance.pk), 'recipes')
+    elif pk_set:
+        bump_version(*(recipe_version(pk) for pk in pk_set), 'recipes')
+
+
+def bump_relations(*user_ids):
+    """
+    Меняет версию связей пользователей сразу и еще раз после коммита:
+    связи, прочитанные другим запросом до коммита, иначе остались бы в
+    кэше под новой версией.
+    """
+    names = [relations_version(user_id) for user_id in user_ids]
+    bump_version(*names)
+    transaction.on_commit(partial(bump_version, *names))
+
+
+@receiver(m2m_changed, sender=FavoriteRecipe.recipe.through)
+@receiver(m2m_changed, sender=ShoppingCart.recipe.through)
+def user_recipes_changed(sender, instance, action, reverse, model, pk_set,
+                         **kwargs):
+    if not reverse:
+        if action.startswith('post_'):
+            bump_relations(instance.user_id)
+    elif action == 'pre_clear':
+        # После очистки pk_set пуст: пользователи берутся до нее.
+        bump_relations(*model.objects.filter(
+            recipe=instance).values_list('user_id', flat=True))
+    elif action.startswith('post_') and pk_set:
+        bump_relations(*model.objects.filter(
+            pk__in=pk_set).values_list('user_id', flat=True))
+
+
+@receiver((post_save, post_delete), sender=Subscribe)
+def subscription_changed(sender, instance, **kwargs):
+    bump_relations(instance.user_id)
+
+
+UserRecipes = namedtuple('UserRecipes', 'source counter')
+
+USER_RECIPES = {
+    FavoriteRecipe.recipe.through: UserRecipes(
+        'favoriterecipe', 'favorites_count'),
+    ShoppingCart.recipe.through: UserRecipes(
+        'shoppingcart', 'shopping_cart_count'),
+}
+LINK_SIGNS = {'post_add': 1, 'pre_remove': -1, 'pre_clear': -1}
+
+
+def changed_links(sender, instance, action, reverse, pk_set):
+    """
+    Связи (user_id, recipe_id), которые действие действительно меняет.
+    После add это записанные связи: add передает в pk_set только новые.
+    Перед remove и clear - существующие из запрошенных, под блокировкой
+    до конца транзакции, чтобы одновременное удаление их не вычло.
+    """
+    source = USER_RECIPES[sender].source
+    if action == 'post_add' and not reverse:
+        return [(instance.user_id, recipe_id) for recipe_id in pk_set]
+    owner, target = ('recipe', source) if reverse else (source, 'recipe')
+    links = sender.objects.filter(**{owner: instance})
+    if pk_set is not None:
+        links = links.filter(**{f'{target}__in': pk_set})
+    if action != 'post_add':
+        links = links.select_for_update(of=('self',))
+    return list(links.values_list(f'{source}__user_id', 'recipe_id'))
+
+
+def count_links(field, links, sign):
+    """Меняет счетчик field рецептов на число связей с каждым из них."""
+    recipes_by_count = defaultdict(list)
+    for recipe_id, count in Counter(
+            recipe_id for _, recipe_id in links).items():
+        recipes_by_count[count].append(recipe_id)
+    for count, recipe_ids in recipes_by_count.items():
+        counters.increment(
+            Recipe.objects.filter(id__in=recipe_ids), **{field: sign * count})
+
+
+@receiver(m2m_changed, sender=FavoriteRecipe.recipe.through)
+@receiver(m2m_changed, sender=ShoppingCart.recipe.through)
+def user_recipes_counted(sender, instance, action, reverse, pk_set,
+                         **kwargs):
+    """
+    Счетчики рецептов и списки покупок меняются по связям, которые
+    действие действительно записывает или удаляет, откуда бы ни пришло
+    изменение: вьюсеты, админка, shell.
+    """
+    sign = LINK_SIGNS.get(action)
+    if sign is None or (pk_set is not None and not pk_set):
+        return
+    links = changed_links(sender, instance, action, reverse, pk_set)
+    count_links(USER_RECIPES[sender].counter, links, sign)
+    if sender is ShoppingCart.recipe.through:
+        cart_totals.links_changed(links, sign)
+
+
+@receiver(pre_delete, sender=FavoriteRecipe)
+@receiver(pre_delete, sender=ShoppingCart)
+def user_recipes_deleted(sender, instance, **kwargs):
+    """Связи удаляемого избранного или корзины уходят без m2m_changed."""
+    counters.increment(instance.recipe.all(), **{
+        USER_RECIPES[sender.recipe.through].counter: -1})
+    if sender is ShoppingCart:
+        ShoppingListItem.objects.filter(user_id=instance.user_id).delete()
@@ -0,0 +1,175 @@
+import random
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from django.utils import timezone
+
+from recipes import cart_totals, recipe_matcher, scores
+from recipes.counters import recount_all
+from recipes.models import (FavoriteRecipe, Ingredient, Recipe,
+                            RecipeIngredient, ShoppingCart, Subscribe, Tag)
+from recipes.versions import bump_version
+
+User = get_user_model()
+
+BATCH_SIZE = 5000
+SEED_PREFIX = 'seed'
+# Словари для названий и описаний, чтобы поиск по тексту на синтетических
+# данных находил правдоподобное число рецептов.
+DISHES = ('борщ', 'суп', 'салат', 'пирог', 'омлет', 'рагу', 'плов',
+          'запеканка', 'каша', 'блины', 'котлеты', 'паста', 'пюре',
+          'солянка', 'щи', 'оладьи', 'ризотто', 'гуляш', 'крем-суп', 'торт')
+ADJECTIVES = ('домашний', 'быстрый', 'овощной', 'куриный', 'грибной',
+              'рыбный', 'сырный', 'острый', 'летний', 'праздничный',
+              'постный', 'мясной', 'сливочный', 'томатный', 'ягодный')
+TEXT_WORDS = ('нарезать', 'обжарить', 'варить', 'запекать', 'посолить',
+              'добавить', 'перемешать', 'остудить', 'подавать', 'сметана',
+              'зелень', 'чеснок', 'лук', 'морковь', 'картофель', 'сыр',
+              'сливки', 'масло', 'мука', 'яйца', 'духовка', 'сковорода',
+              'кастрюля', 'минут', 'огонь', 'соус', 'специи', 'перец')
+
+
+def recipe_name():
+    return f'{random.choice(ADJECTIVES)} {random.choice(DISHES)}'.capitalize()
+
+
+def recipe_text():
+    return ' '.join(random.choices(TEXT_WORDS, k=random.randint(10, 30)))
+
+
+def batched_create(model, objects, batch_size=BATCH_SIZE):
+    batch = []
+    for obj in objects:
+        batch.append(obj)
+        if len(batch) >= batch_size:
+            model.objects.bulk_create(batch)
+            batch = []
+    if batch:
+        model.objects.bulk_create(batch)
+
+
+def ensure_tags():
+    for number, (color, _) in enumerate(Tag.COLOR_CHOICES):
+        Tag.objects.get_or_create(
+            color=color,
+            defaults={'name': f'{SEED_PREFIX} tag {number}',
+                      'slug': f'{SEED_PREFIX}-tag-{number}'})
+    return list(Tag.objects.values_list('id', flat=True))
+
+
+def ensure_ingredients(count):
+    existing = Ingredient.objects.count()
+    batched_create(Ingredient, (
+        Ingredient(name=f'{SEED_PREFIX} ингредиент {number}',
+                   measurement_unit='г')
+        for number in range(existing, count)))
+    return list(Ingredient.objects.values_list('id', flat=True))
+
+
+def create_users(count):
+    """Создает пользователей с корзинами и избранным, возвращает id всех."""
+    password = make_password(None)
+    start = User.objects.count()
+    batched_create(User, (
+        User(username=f'{SEED_PREFIX}{number}',
+             email=f'{SEED_PREFIX}{number}@example.com',
+             first_name='Имя', last_name='Фамилия', password=password)
+        for number in range(start, start + count)))
+    batched_create(ShoppingCart, (
+        ShoppingCart(user_id=user_id) for user_id in User.objects.filter(
+            cart__isnull=True).values_list('id', flat=True)))
+    batched_create(FavoriteRecipe, (
+        FavoriteRecipe(user_id=user_id) for user_id in User.objects.filter(
+            favorite_recipe__isnull=True).values_list('id', flat=True)))
+    return list(User.objects.order_by('id').values_list('id', flat=True))
+
+
+def create_recipes(count, user_ids, start_date):
+    first_id = (Recipe.objects.order_by('-id').values_list(
+        'id', flat=True).first() or 0) + 1
+    batched_create(Recipe, (
+        Recipe(author_id=random.choice(user_ids),
+               name=recipe_name(),
+               text=recipe_text(),
+               cooking_time=random.randint(1, 180),
+               image='media/recipe/seed.png')
+        for _ in range(count)))
+    recipe_ids = list(Recipe.objects.filter(
+        id__gte=first_id).order_by('id').values_list('id', flat=True))
+    # pub_date заполняется auto_now_add при вставке, поэтому даты
+    # публикации разносятся отдельным пакетным обновлением.
+    step = (timezone.now() - start_date) / max(len(recipe_ids), 1)
+    Recipe.objects.bulk_update(
+        [Recipe(id=recipe_id, pub_date=start_date + step * number)
+         for number, recipe_id in enumerate(recipe_ids)],
+        ('pub_date',), batch_size=500)
+    return recipe_ids
+
+
+def create_recipe_links(recipe_ids, tag_ids, ingredient_ids,
+                        ingredients_per_recipe):
+    batched_create(Recipe.tags.through, (
+        Recipe.tags.through(recipe_id=recipe_id, tag_id=tag_id)
+        for recipe_id in recipe_ids
+        for tag_id in random.sample(
+            tag_ids, random.randint(1, min(3, len(tag_ids))))))
+    batched_create(RecipeIngredient, (
+        RecipeIngredient(recipe_id=recipe_id, ingredient_id=ingredient_id,
+                         amount=random.randint(1, 500))
+        for recipe_id in recipe_ids
+        for ingredient_id in random.sample(
+            ingredient_ids, min(ingredients_per_recipe,
+                                len(ingredient_ids)))))
+
+
+def create_user_links(user_ids, recipe_ids, favorites, carts, subscriptions):
+    carts_by_user = dict(ShoppingCart.objects.values_list('user_id', 'id'))
+    favorites_by_user = dict(
+        FavoriteRecipe.objects.values_list('user_id', 'id'))
+    batched_create(FavoriteRecipe.recipe.through, (
+        FavoriteRecipe.recipe.through(
+            favoriterecipe_id=favorites_by_user[user_id], recipe_id=recipe_id)
+        for user_id in user_ids
+        for recipe_id in random.sample(
+            recipe_ids, min(favorites, len(recipe_ids)))))
+    batched_create(ShoppingCart.recipe.through, (
+        ShoppingCart.recipe.through(
+            shoppingcart_id=carts_by_user[user_id], recipe_id=recipe_id)
+        for user_id in user_ids
+        for recipe_id in random.sample(
+            recipe_ids, min(carts, len(recipe_ids)))))
+    batched_create(Subscribe, (
+        Subscribe(user_id=user_id, author_id=author_id)
+        for user_id in user_ids
+        for author_id in random.sample(
+            user_ids, min(subscriptions + 1, len(user_ids)))
+        if author_id != user_id))
+
+
+def seed(users=100, recipes=1000, ingredients=2000, ingredients_per_recipe=8,
+         favorites=20, carts=5, subscriptions=10, random_seed=0):
+    """
+    Заполняет базу синтетическими данными пакетными вставками. Сигналы
+    моделей при этом не вызываются, поэтому счетчики и рейтинги
+    пересчитываются, а версии кэшей сбрасываются в конце вручную.
+    """
+    random.seed(random_seed)
+    with transaction.atomic():
+        tag_ids = ensure_tags()
+        ingredient_ids = ensure_ingredients(ingredients)
+        user_ids = create_users(users)
+        recipe_ids = create_recipes(
+            recipes, user_ids, timezone.now() - timedelta(days=365))
+        create_recipe_links(
+            recipe_ids, tag_ids, ingredient_ids, ingredients_per_recipe)
+        create_user_links(
+            user_ids[len(user_ids) - users:], recipe_ids, favorites, carts,
+            subscriptions)
+        recount_all()
+        cart_totals.rebuild()
+        scores.compute()
+    bump_version('recipes', 'users', 'tags', 'ingredients',
+                 recipe_matcher.VERSION)
+    return {'users': users, 'recipes': len(recipe_ids)}
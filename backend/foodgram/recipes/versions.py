@@ -0,0 +1,44 @@
+import time
+
+from django.core.cache import cache
+
+VERSION_KEY = 'version:{}'
+
+
+def get_versions(*names):
+    """
+    Текущие версии ресурсов names - время их последнего изменения.
+    Хранятся в общем кэше, чтобы все процессы видели одни и те же версии.
+    """
+    keys = [VERSION_KEY.format(name) for name in names]
+    found = cache.get_many(keys)
+    now = time.time()
+    for key in keys:
+        if key not in found and not cache.add(key, now, None):
+            found[key] = cache.get(key, now)
+        found.setdefault(key, now)
+    return [found[key] for key in keys]
+
+
+def get_version(name):
+    return get_versions(name)[0]
+
+
+def bump_version(*names):
+    """Отмечает изменение ресурсов names."""
+    now = time.time()
+    cache.set_many({VERSION_KEY.format(name): now for name in names}, None)
+
+
+def recipe_version(recipe_id):
+    return f'recipe:{recipe_id}'
+
+
+def relations_version(user_id):
+    """Версия избранного, корзины и подписок пользователя."""
+    return f'relations:{user_id}'
+
+
+def auth_version(user_id):
+    """Версия данных, по которым токен пользователя пускает в API."""
+    return f'auth:{user_id}'
@@ -7,7 +7,8 @@ User = get_user_model()
 class UserAdmin(admin.ModelAdmin):
     list_display = (
         'id', 'username', 'email',
-        'first_name', 'last_name', 'date_joined', 'password')
+        'first_name', 'last_name', 'date_joined', 'recipes_count',
+        'followers_count', 'password')
     search_fields = ('email', 'username', 'first_name', 'last_name')
     list_filter = ('date_joined', 'email', 'first_name')
     empty_value_display = '-пусто-'